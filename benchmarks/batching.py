@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark: one-by-one OpenAIChat.chat calls vs. the batching scheduler.
+
+Usage:
+    python benchmarks/batching.py --requests 32 --max-batch-size 8
+    python benchmarks/batching.py --model gpt2 --max-tokens 64
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the src directory to the path so we can import our modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+from core.chat.registry import ModelRegistry
+from core.chat.scheduler import BatchScheduler
+from tiny_model import build_tiny_model
+
+PROMPTS = [
+    "Hello! Can you tell me a short joke?",
+    "What is the capital of France?",
+    "Explain machine learning in one sentence.",
+    "What is Python programming language?",
+]
+
+
+def make_messages(i: int):
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": PROMPTS[i % len(PROMPTS)]},
+    ]
+
+
+def run_sequential(registry: ModelRegistry, model: str, requests: int, max_tokens: int):
+    chat_model = registry.get(model)
+    start = time.perf_counter()
+    for i in range(requests):
+        chat_model.chat(make_messages(i), max_tokens=max_tokens, temperature=1.0)
+    return time.perf_counter() - start
+
+
+def run_scheduled(
+    registry: ModelRegistry,
+    model: str,
+    requests: int,
+    max_tokens: int,
+    max_batch_size: int,
+    max_queue_delay_ms: float,
+):
+    scheduler = BatchScheduler(
+        registry=registry,
+        max_batch_size=max_batch_size,
+        max_queue_delay_ms=max_queue_delay_ms,
+    )
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=requests) as pool:
+        futures = [
+            pool.submit(
+                scheduler.chat,
+                model,
+                make_messages(i),
+                max_tokens=max_tokens,
+                temperature=1.0,
+            )
+            for i in range(requests)
+        ]
+        for future in futures:
+            future.result()
+    elapsed = time.perf_counter() - start
+    scheduler.shutdown()
+    return elapsed, scheduler.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model", help="Model to load (default: tiny local GPT-2)")
+    parser.add_argument("--requests", type=int, default=32)
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--max-batch-size", type=int, default=8)
+    parser.add_argument("--max-queue-delay-ms", type=float, default=10)
+    args = parser.parse_args()
+
+    model = args.model or build_tiny_model()
+    registry = ModelRegistry()
+    registry.configure(model, use_cpu=True)
+
+    # Warm up so neither path pays for loading or first-call overhead
+    registry.get(model).chat(make_messages(0), max_tokens=4, temperature=1.0)
+
+    sequential = run_sequential(registry, model, args.requests, args.max_tokens)
+    scheduled, stats = run_scheduled(
+        registry,
+        model,
+        args.requests,
+        args.max_tokens,
+        args.max_batch_size,
+        args.max_queue_delay_ms,
+    )
+
+    print(f"Model: {model}")
+    print(f"Requests: {args.requests}, max_tokens: {args.max_tokens}")
+    print(f"One-by-one: {sequential:.2f}s ({args.requests / sequential:.2f} req/s)")
+    print(
+        f"Scheduler:  {scheduled:.2f}s ({args.requests / scheduled:.2f} req/s), "
+        f"{stats['batches']} batches, largest {stats['max_batch_size_seen']}"
+    )
+    print(f"Speedup: {sequential / scheduled:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
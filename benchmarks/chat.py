@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Chat inference benchmark suite: latency, throughput and memory at several concurrency levels.
+
+Drives OpenAIChat.chat directly and ChatCompletions.create / stream through the
+batching scheduler and inference executor. Every level reports time to first
+token, tokens/sec, p50/p95/p99 latency and peak RSS. With --draft (or
+--speculative for the tiny model) greedy decoding with and without the draft
+model is compared as well. Results are written as JSON; pass a previous file
+with --baseline to print the changes.
+
+Usage:
+    python benchmarks/chat.py
+    python benchmarks/chat.py --concurrency 1 8 32 --requests 64 --speculative
+    python benchmarks/chat.py --model gpt2 --targets chat create --baseline old.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+# Add the src directory to the path so we can import our modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import torch
+
+import model.chat_completions as chat_completions
+from core.chat.openai import OpenAIChat
+from core.chat.registry import model_registry
+from model.chat_completions import ChatCompletionRequest, ChatCompletions
+from tiny_model import DEFAULT_PATH, build_layer_skip_draft, build_tiny_model
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+TARGETS = ["chat", "create", "stream"]
+
+PROMPTS = [
+    "Hello! Can you tell me a short joke?",
+    "What is the capital of France?",
+    "Explain machine learning in one sentence.",
+    "What is Python programming language?",
+]
+
+
+def make_messages(i: int):
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": PROMPTS[i % len(PROMPTS)]},
+    ]
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process"""
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of `values`, or None if there are none"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class RssSampler:
+    """Track the peak resident set size while a block of code runs"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def __enter__(self):
+        self.peak = rss_bytes()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+
+class FirstTokenTimer:
+    """Minimal `generate` streamer that records when the first new token arrives"""
+
+    def __init__(self):
+        self.first_token_at: Optional[float] = None
+        self._prompt_seen = False
+
+    def put(self, value):
+        # `generate` hands over the prompt first
+        if not self._prompt_seen:
+            self._prompt_seen = True
+        elif self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+
+    def end(self):
+        pass
+
+
+def run_chat(model: str, i: int, max_tokens: int, temperature: float) -> Dict[str, Any]:
+    chat_model = model_registry.get(model)
+    timer = FirstTokenTimer()
+    start = time.perf_counter()
+    result = chat_model.chat(
+        make_messages(i), max_tokens=max_tokens, temperature=temperature, streamer=timer
+    )
+    end = time.perf_counter()
+    return {
+        "latency": end - start,
+        "ttft": timer.first_token_at - start if timer.first_token_at else None,
+        "tokens": result["usage"]["completion_tokens"],
+    }
+
+
+def make_request(model: str, i: int, max_tokens: int, temperature: float):
+    return ChatCompletionRequest(
+        model=model,
+        messages=make_messages(i),
+        max_tokens=max_tokens,
+        temperature=temperature,
+    )
+
+
+def run_create(model: str, i: int, max_tokens: int, temperature: float) -> Dict[str, Any]:
+    start = time.perf_counter()
+    response = ChatCompletions.create(make_request(model, i, max_tokens, temperature))
+    end = time.perf_counter()
+    # Non-streamed responses arrive all at once
+    return {
+        "latency": end - start,
+        "ttft": None,
+        "tokens": response.usage.completion_tokens,
+    }
+
+
+def run_stream(model: str, i: int, max_tokens: int, temperature: float) -> Dict[str, Any]:
+    start = time.perf_counter()
+    first_token_at = None
+    tokens = 0
+    for chunk in ChatCompletions.stream(make_request(model, i, max_tokens, temperature)):
+        if first_token_at is None and chunk.choices and chunk.choices[0].delta.content:
+            first_token_at = time.perf_counter()
+        if chunk.usage is not None:
+            tokens = chunk.usage.completion_tokens
+    end = time.perf_counter()
+    return {
+        "latency": end - start,
+        "ttft": first_token_at - start if first_token_at else None,
+        "tokens": tokens,
+    }
+
+
+RUNNERS: Dict[str, Callable[..., Dict[str, Any]]] = {
+    "chat": run_chat,
+    "create": run_create,
+    "stream": run_stream,
+}
+
+
+def run_level(
+    target: str,
+    model: str,
+    concurrency: int,
+    requests: int,
+    max_tokens: int,
+    temperature: float,
+) -> Dict[str, Any]:
+    runner = RUNNERS[target]
+    with RssSampler() as rss, ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        samples = list(
+            pool.map(
+                lambda i: runner(model, i, max_tokens, temperature), range(requests)
+            )
+        )
+        wall = time.perf_counter() - start
+
+    latencies = [sample["latency"] for sample in samples]
+    ttfts = [sample["ttft"] for sample in samples if sample["ttft"] is not None]
+    tokens = sum(sample["tokens"] for sample in samples)
+    return {
+        "target": target,
+        "concurrency": concurrency,
+        "requests": requests,
+        "wall_s": wall,
+        "requests_per_s": requests / wall,
+        "tokens": tokens,
+        "tokens_per_s": tokens / wall,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p95_s": percentile(latencies, 95),
+        "latency_p99_s": percentile(latencies, 99),
+        "ttft_p50_s": percentile(ttfts, 50),
+        "ttft_p95_s": percentile(ttfts, 95),
+        "ttft_p99_s": percentile(ttfts, 99),
+        "peak_rss_mb": rss.peak / 1024**2,
+    }
+
+
+def run_speculative(
+    model: str, draft: str, requests: int, max_tokens: int, num_draft_tokens: int
+) -> Dict[str, Any]:
+    """Compare greedy decoding with and without the draft model, one request at a time"""
+    chat_model = OpenAIChat(
+        model=model,
+        use_cpu=True,
+        prefix_cache_mb=0,
+        draft_model=draft,
+        num_draft_tokens=num_draft_tokens,
+    )
+    speculative = chat_model.speculative
+    if speculative is None:
+        sys.exit(f"Draft model {draft} cannot be paired with {model}")
+
+    def run(use_draft: bool):
+        chat_model.speculative = speculative if use_draft else None
+        chat_model.chat(make_messages(0), max_tokens=4, temperature=0)  # warm up
+        completions, tokens = [], 0
+        start = time.perf_counter()
+        for i in range(requests):
+            result = chat_model.chat(make_messages(i), max_tokens=max_tokens, temperature=0)
+            completions.append(result["choices"][0]["message"]["content"])
+            tokens += result["usage"]["completion_tokens"]
+        return time.perf_counter() - start, tokens, completions
+
+    greedy_time, greedy_tokens, greedy_completions = run(use_draft=False)
+    before = speculative.get_stats()
+    spec_time, spec_tokens, spec_completions = run(use_draft=True)
+    after = speculative.get_stats()
+
+    drafted = after["draft_tokens"] - before["draft_tokens"]
+    accepted = after["accepted_tokens"] - before["accepted_tokens"]
+    rounds = after["rounds"] - before["rounds"]
+    return {
+        "draft_model": draft,
+        "num_draft_tokens": num_draft_tokens,
+        "requests": requests,
+        "greedy_tokens_per_s": greedy_tokens / greedy_time,
+        "speculative_tokens_per_s": spec_tokens / spec_time,
+        "acceptance_rate": accepted / drafted if drafted else 0.0,
+        "tokens_per_target_forward": spec_tokens / rounds if rounds else 0.0,
+        "speedup": greedy_time / spec_time,
+        "identical_completions": sum(
+            a == b for a, b in zip(greedy_completions, spec_completions)
+        ),
+    }
+
+
+def format_seconds(value: Optional[float]) -> str:
+    return f"{value * 1000:.1f}" if value is not None else "-"
+
+
+def print_results(results: List[Dict[str, Any]], baseline: Optional[Dict[str, Any]]):
+    previous = {}
+    if baseline:
+        previous = {(r["target"], r["concurrency"]): r for r in baseline["results"]}
+
+    print(
+        f"{'target':<7} {'conc':>4} {'req/s':>7} {'tok/s':>8} {'p50 ms':>8} "
+        f"{'p95 ms':>8} {'p99 ms':>8} {'ttft50':>7} {'ttft95':>7} {'rss MB':>7}"
+        + (f" {'d tok/s':>8} {'d p95':>7}" if baseline else "")
+    )
+    for r in results:
+        line = (
+            f"{r['target']:<7} {r['concurrency']:>4} {r['requests_per_s']:>7.2f} "
+            f"{r['tokens_per_s']:>8.1f} {format_seconds(r['latency_p50_s']):>8} "
+            f"{format_seconds(r['latency_p95_s']):>8} {format_seconds(r['latency_p99_s']):>8} "
+            f"{format_seconds(r['ttft_p50_s']):>7} {format_seconds(r['ttft_p95_s']):>7} "
+            f"{r['peak_rss_mb']:>7.1f}"
+        )
+        old = previous.get((r["target"], r["concurrency"]))
+        if old:
+            line += (
+                f" {r['tokens_per_s'] / old['tokens_per_s'] - 1:>+8.1%}"
+                f" {r['latency_p95_s'] / old['latency_p95_s'] - 1:>+7.1%}"
+            )
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model", help="Model to load (default: tiny local GPT-2)")
+    parser.add_argument("--targets", nargs="+", default=TARGETS, choices=TARGETS)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=32, help="Requests per level")
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--temperature", type=float, default=1.0)
+    parser.add_argument("--draft", help="Draft model for the speculative comparison")
+    parser.add_argument(
+        "--speculative",
+        action="store_true",
+        help="Run the speculative comparison with a draft built from the tiny model",
+    )
+    parser.add_argument("--num-draft-tokens", type=int, default=4)
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/)")
+    parser.add_argument("--baseline", help="Previous results file to compare against")
+    args = parser.parse_args()
+
+    if args.model is None:
+        # Deep enough for a one-block draft to be meaningfully cheaper
+        model = build_tiny_model(path=f"{DEFAULT_PATH}-large", n_layer=8, n_embd=256)
+    else:
+        model = args.model
+    draft = args.draft
+    if draft is None and args.speculative:
+        if args.model is not None:
+            parser.error("--speculative builds a draft for the tiny model; pass --draft")
+        draft = build_layer_skip_draft(model, n_layer=1)
+
+    # Serve the benchmark model through the API layer like a listed model
+    if model not in chat_completions.AVAILABLE_MODELS:
+        chat_completions.AVAILABLE_MODELS.append(model)
+    model_registry.configure(model, use_cpu=True)
+    run_chat(model, 0, 4, args.temperature)  # load and warm up
+
+    results = []
+    for target in args.targets:
+        for concurrency in args.concurrency:
+            result = run_level(
+                target,
+                model,
+                concurrency,
+                args.requests,
+                args.max_tokens,
+                args.temperature,
+            )
+            results.append(result)
+            print(
+                f"{target} x{concurrency}: {result['tokens_per_s']:.1f} tok/s, "
+                f"p95 {format_seconds(result['latency_p95_s'])} ms"
+            )
+
+    speculative = None
+    if draft is not None:
+        speculative = run_speculative(
+            model, draft, args.requests, args.max_tokens, args.num_draft_tokens
+        )
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "model": model,
+            "requests_per_level": args.requests,
+            "max_tokens": args.max_tokens,
+            "temperature": args.temperature,
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "cpu_count": os.cpu_count(),
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        },
+        "results": results,
+        "speculative": speculative,
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(
+            RESULTS_DIR, f"chat-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+        )
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    print()
+    print(f"Model: {model}")
+    print(f"Requests per level: {args.requests}, max_tokens: {args.max_tokens}")
+    print_results(results, baseline)
+    if speculative:
+        print()
+        print(
+            f"Speculative ({speculative['draft_model']}, "
+            f"{speculative['num_draft_tokens']} tokens per round, greedy):"
+        )
+        print(f"  Acceptance rate: {speculative['acceptance_rate']:.1%}")
+        print(f"  Tokens per target forward: {speculative['tokens_per_target_forward']:.2f}")
+        print(
+            f"  {speculative['greedy_tokens_per_s']:.1f} -> "
+            f"{speculative['speculative_tokens_per_s']:.1f} tok/s "
+            f"({speculative['speedup']:.2f}x), identical completions: "
+            f"{speculative['identical_completions']}/{speculative['requests']}"
+        )
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Compiled vs. eager benchmark: steady-state throughput of chat and TTS models.
+
+Each mode runs in a fresh process. The first request of a compiled model
+compiles it (or loads it from the persistent compile cache, so run twice to
+see a warm restart) and is reported separately; throughput is measured on the
+requests after it. Chat completions are greedy with a fixed length, so both
+modes generate the same tokens. TTS needs the Kokoro weights in
+src/core/models and is measured as seconds of audio generated per second.
+Results are written as JSON.
+
+Usage:
+    python benchmarks/compile.py
+    python benchmarks/compile.py --model gpt2 --max-tokens 64 --batch-size 4
+    python benchmarks/compile.py --tts
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+# Add the src directory to the path so we can import our modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+PROMPTS = [
+    "Hello! Can you tell me a short joke?",
+    "What is the capital of France?",
+    "Explain machine learning in one sentence.",
+    "What is Python programming language?",
+]
+
+TTS_TEXTS = [
+    "həlˈO! kæn ju tˈɛl mi ɐ ʃˈɔɹt ʤˈOk?",
+    "wˌʌt ɪz ðə kˈæpətᵊl ʌv fɹˈæns?",
+    "ɪksplˈAn məʃˈin lˈɜɹnɪŋ ɪn wˌʌn sˈɛntᵊns.",
+    "ðə kwˈɪk bɹˈWn fˈɑks ʤˈʌmps ˌOvəɹ ðə lˈAzi dˈɔɡ, ænd ðə dˈɔɡ dʌzᵊnt mˈInd.",
+]
+
+
+def make_messages(i: int):
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": PROMPTS[i % len(PROMPTS)]},
+    ]
+
+
+def run_chat(
+    model: str, compiled: bool, requests: int, batch_size: int, max_tokens: int
+) -> Dict[str, Any]:
+    """Measure one chat mode (runs in a subprocess)"""
+    from core.chat.openai import OpenAIChat
+
+    start = time.perf_counter()
+    chat_model = OpenAIChat(model=model, use_cpu=True, prefix_cache_mb=0, compile=compiled)
+    load_s = time.perf_counter() - start
+
+    def run_batch(i: int) -> List[List[int]]:
+        batch = [make_messages(i + row) for row in range(batch_size)]
+        results = chat_model.chat_batch(
+            batch, max_tokens=max_tokens, temperature=0, min_new_tokens=max_tokens
+        )
+        return [result["choices"][0]["message"]["content"] for result in results]
+
+    start = time.perf_counter()
+    run_batch(0)
+    first_s = time.perf_counter() - start
+    # Each prompt length is its own prefill shape; see them all before timing
+    for i in range(1, len(PROMPTS)):
+        run_batch(i)
+
+    outputs = []
+    start = time.perf_counter()
+    for i in range(requests):
+        outputs.extend(run_batch(i))
+    elapsed = time.perf_counter() - start
+
+    return {
+        "mode": "compiled" if compiled else "eager",
+        "load_s": load_s,
+        "first_call_s": first_s,
+        "elapsed_s": elapsed,
+        "tokens_per_s": requests * batch_size * max_tokens / elapsed,
+        "compile": chat_model.compiled.get_stats() if chat_model.compiled else None,
+        "outputs": outputs,
+    }
+
+
+def run_tts(compiled: bool, requests: int) -> Dict[str, Any]:
+    """Measure one TTS mode on the Kokoro model (runs in a subprocess)"""
+    import torch
+
+    from core.tts.kokoro import KokotoTTS
+
+    tts = KokotoTTS()
+    start = time.perf_counter()
+    tts.load_model(compile=compiled)
+    load_s = time.perf_counter() - start
+
+    # Throughput does not depend on the voice, so a fixed random style stands in
+    generator = torch.Generator().manual_seed(0)
+    ref_s = torch.randn(1, 256, generator=generator)
+
+    def synthesize(i: int) -> int:
+        with torch.no_grad():
+            audio = tts._model(TTS_TEXTS[i % len(TTS_TEXTS)], ref_s)
+        return audio.shape[-1]
+
+    start = time.perf_counter()
+    synthesize(0)
+    first_s = time.perf_counter() - start
+
+    samples = 0
+    start = time.perf_counter()
+    for i in range(requests):
+        samples += synthesize(i)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "mode": "compiled" if compiled else "eager",
+        "load_s": load_s,
+        "first_call_s": first_s,
+        "elapsed_s": elapsed,
+        "audio_s_per_s": samples / 24000 / elapsed,
+        "compile": {name: state.get_stats() for name, state in tts.compiled.items()},
+    }
+
+
+def print_results(title: str, results: List[Dict[str, Any]], rate_key: str, unit: str):
+    base = results[0][rate_key]
+    print(title)
+    header = f"{'mode':<9} {'load s':>7} {'first s':>8} {unit:>10} {'speedup':>8} {'fallbacks':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        states = r["compile"] or {}
+        if "fallbacks" in states:
+            states = {"model": states}
+        fallbacks = sum(state["fallbacks"] for state in states.values())
+        print(
+            f"{r['mode']:<9} {r['load_s']:>7.2f} {r['first_call_s']:>8.2f} "
+            f"{r[rate_key]:>10.1f} {r[rate_key] / base:>7.2f}x {fallbacks:>9}"
+        )
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model", help="Chat model to load (default: tiny local GPT-2)")
+    parser.add_argument("--requests", type=int, default=16, help="Timed requests per mode")
+    parser.add_argument("--batch-size", type=int, default=1, help="Conversations per request")
+    parser.add_argument("--max-tokens", type=int, default=64)
+    parser.add_argument("--tts", action="store_true", help="Also benchmark the Kokoro TTS model")
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/)")
+    args = parser.parse_args()
+
+    if args.model is None:
+        from tiny_model import DEFAULT_PATH, build_tiny_model
+
+        model = build_tiny_model(path=f"{DEFAULT_PATH}-large", n_layer=8, n_embd=256)
+    else:
+        model = args.model
+
+    context = multiprocessing.get_context("spawn")
+    chat_results = []
+    for compiled in (False, True):
+        with context.Pool(1) as pool:
+            chat_results.append(
+                pool.apply(
+                    run_chat, (model, compiled, args.requests, args.batch_size, args.max_tokens)
+                )
+            )
+    identical = chat_results[0].pop("outputs") == chat_results[1].pop("outputs")
+
+    tts_results = []
+    if args.tts:
+        for compiled in (False, True):
+            with context.Pool(1) as pool:
+                tts_results.append(pool.apply(run_tts, (compiled, args.requests)))
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "model": model,
+            "requests": args.requests,
+            "batch_size": args.batch_size,
+            "max_tokens": args.max_tokens,
+            "python": platform.python_version(),
+            "torch": __import__("torch").__version__,
+            "cpu_count": os.cpu_count(),
+        },
+        "chat": chat_results,
+        "chat_outputs_identical": identical,
+        "tts": tts_results,
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(
+            RESULTS_DIR, f"compile-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+        )
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print(f"Model: {model}")
+    print(
+        f"Requests: {args.requests} x {args.batch_size} conversations, "
+        f"max_tokens: {args.max_tokens} (greedy)\n"
+    )
+    print_results("Chat", chat_results, "tokens_per_s", "tok/s")
+    print(f"Compiled outputs identical to eager: {identical}\n")
+    if tts_results:
+        print_results("TTS", tts_results, "audio_s_per_s", "audio s/s")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
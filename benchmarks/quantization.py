@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+CPU quantization benchmark: float32 vs. int8 dynamic quantization vs. bfloat16.
+
+Each mode is loaded in a fresh process so resident memory is measured in
+isolation. Outputs are compared against float32 with greedy decoding: how many
+completions are identical, how many leading tokens agree, and how far the
+next-token logits of the prompts drift.
+
+Usage:
+    python benchmarks/quantization.py --model gpt2
+    python benchmarks/quantization.py --modes fp32 int8 --max-tokens 64
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+# Add the src directory to the path so we can import our modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+PROMPTS = [
+    "Hello! Can you tell me a short joke?",
+    "What is the capital of France?",
+    "Explain machine learning in one sentence.",
+    "What is Python programming language?",
+]
+
+
+def make_messages(i: int):
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": PROMPTS[i % len(PROMPTS)]},
+    ]
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process"""
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) * 1024
+    return 0
+
+
+def run_mode(model: str, mode: str, requests: int, max_tokens: int):
+    """Load `model` in one precision mode and measure it (runs in a subprocess)"""
+    import torch
+
+    from core.chat.openai import OpenAIChat
+    from core.chat.registry import model_resident_bytes
+
+    rss_before = rss_bytes()
+    start = time.perf_counter()
+    chat_model = OpenAIChat(
+        model=model,
+        use_cpu=True,
+        prefix_cache_mb=0,
+        quantization=None if mode == "fp32" else mode,
+    )
+    load_time = time.perf_counter() - start
+
+    hf_model = chat_model.pipe.model
+    tokenizer = chat_model.pipe.tokenizer
+    prompts = [chat_model._build_prompt(make_messages(i)) for i in range(requests)]
+
+    def generate(prompt: str, new_tokens: int):
+        inputs = tokenizer(prompt, return_tensors="pt")
+        output = hf_model.generate(
+            **inputs,
+            max_new_tokens=new_tokens,
+            min_new_tokens=new_tokens,
+            do_sample=False,
+            pad_token_id=tokenizer.pad_token_id,
+        )
+        return output[0, inputs["input_ids"].shape[1] :].tolist()
+
+    # Warm up so the timed runs do not pay for first-call overhead
+    generate(prompts[0], 4)
+
+    completions = []
+    start = time.perf_counter()
+    for prompt in prompts:
+        completions.append(generate(prompt, max_tokens))
+    elapsed = time.perf_counter() - start
+
+    logits = []
+    with torch.no_grad():
+        for prompt in prompts:
+            inputs = tokenizer(prompt, return_tensors="pt")
+            logits.append(hf_model(**inputs).logits[0, -1].float())
+
+    return {
+        "mode": mode,
+        "applied": chat_model.quantization or "fp32",
+        "load_time_s": load_time,
+        "weight_bytes": model_resident_bytes(chat_model),
+        "rss_bytes": rss_bytes() - rss_before,
+        "tokens_per_s": sum(len(c) for c in completions) / elapsed,
+        "completions": completions,
+        "logits": torch.stack(logits),
+    }
+
+
+def compare(baseline, result):
+    """Divergence of `result` from the float32 baseline"""
+    import torch
+
+    identical = 0
+    agreeing_tokens = 0
+    total_tokens = 0
+    for expected, actual in zip(baseline["completions"], result["completions"]):
+        identical += expected == actual
+        prefix = 0
+        while prefix < min(len(expected), len(actual)) and expected[prefix] == actual[prefix]:
+            prefix += 1
+        agreeing_tokens += prefix
+        total_tokens += len(expected)
+
+    base_logits, logits = baseline["logits"], result["logits"]
+    kl = torch.nn.functional.kl_div(
+        torch.log_softmax(logits, dim=-1),
+        torch.log_softmax(base_logits, dim=-1),
+        log_target=True,
+        reduction="batchmean",
+    )
+    return {
+        "identical": identical,
+        "prefix_agreement": agreeing_tokens / total_tokens if total_tokens else 1.0,
+        "top1_agreement": (logits.argmax(-1) == base_logits.argmax(-1)).float().mean().item(),
+        "max_logit_diff": (logits - base_logits).abs().max().item(),
+        "kl": kl.item(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model", help="Model to load (default: tiny local GPT-2)")
+    parser.add_argument(
+        "--modes", nargs="+", default=["fp32", "int8", "bf16"], choices=["fp32", "int8", "bf16"]
+    )
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--max-tokens", type=int, default=32)
+    args = parser.parse_args()
+
+    if args.model is None:
+        from tiny_model import build_tiny_model
+
+        model = build_tiny_model()
+    else:
+        model = args.model
+
+    modes = ["fp32"] + [mode for mode in args.modes if mode != "fp32"]
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for mode in modes:
+        with context.Pool(1) as pool:
+            results.append(
+                pool.apply(run_mode, (model, mode, args.requests, args.max_tokens))
+            )
+
+    baseline = results[0]
+    print(f"Model: {model}")
+    print(f"Requests: {args.requests}, max_tokens: {args.max_tokens} (greedy)")
+    print(
+        f"{'mode':<6} {'applied':<8} {'load s':>7} {'weights MB':>11} {'RSS MB':>8} "
+        f"{'tok/s':>8} {'speedup':>8} {'identical':>10} {'prefix':>7} "
+        f"{'top1':>6} {'max|dlogit|':>12} {'KL':>9}"
+    )
+    for result in results:
+        divergence = compare(baseline, result)
+        print(
+            f"{result['mode']:<6} {result['applied']:<8} {result['load_time_s']:>7.2f} "
+            f"{result['weight_bytes'] / 1024**2:>11.1f} {result['rss_bytes'] / 1024**2:>8.1f} "
+            f"{result['tokens_per_s']:>8.1f} "
+            f"{result['tokens_per_s'] / baseline['tokens_per_s']:>7.2f}x "
+            f"{divergence['identical']:>4}/{len(result['completions']):<5} "
+            f"{divergence['prefix_agreement']:>7.1%} {divergence['top1_agreement']:>6.1%} "
+            f"{divergence['max_logit_diff']:>12.4f} {divergence['kl']:>9.5f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""
+Build a tiny randomly initialised GPT-2-shaped model for offline benchmarks.
+
+The model and a byte-level BPE tokenizer are written to a local directory that
+OpenAIChat can load like any Hugging Face model, so benchmarks run without
+network access or large downloads.
+"""
+
+import os
+
+from tokenizers import ByteLevelBPETokenizer
+from transformers import GPT2Config, GPT2LMHeadModel, GPT2TokenizerFast
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), ".tiny-gpt2")
+
+CORPUS = [
+    "System: You are a helpful assistant. Keep responses concise.",
+    "Human: Hello! Can you tell me a short joke?",
+    "Assistant: Why did the scarecrow win an award? Because he was outstanding in his field.",
+    "Human: What is the capital of France?",
+    "Assistant: The capital of France is Paris.",
+    "Human: Explain machine learning in one sentence.",
+    "Assistant: Machine learning lets computers learn patterns from data.",
+    '{"name": "Alice", "age": 30, "tags": ["a", "b"], "ok": true, "none": null}',
+    "0123456789 .,:;!?'\"()[]{}-_+=/\\",
+]
+
+
+def build_tiny_model(
+    path: str = DEFAULT_PATH,
+    n_layer: int = 2,
+    n_embd: int = 64,
+    n_head: int = 4,
+    vocab_size: int = 512,
+    n_positions: int = 1024,
+    seed: int = 0,
+) -> str:
+    """
+    Create (or reuse) a tiny GPT-2 model and tokenizer at `path`.
+
+    Returns:
+        The directory containing the model, usable as `OpenAIChat(model=path)`
+    """
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+
+    os.makedirs(path, exist_ok=True)
+
+    bpe = ByteLevelBPETokenizer()
+    bpe.train_from_iterator(
+        CORPUS * 8, vocab_size=vocab_size, special_tokens=["<|endoftext|>"]
+    )
+    bpe.save_model(path)
+    tokenizer = GPT2TokenizerFast(
+        vocab_file=os.path.join(path, "vocab.json"),
+        merges_file=os.path.join(path, "merges.txt"),
+    )
+    tokenizer.save_pretrained(path)
+
+    import torch
+
+    torch.manual_seed(seed)
+    config = GPT2Config(
+        vocab_size=len(tokenizer),
+        n_positions=n_positions,
+        n_embd=n_embd,
+        n_layer=n_layer,
+        n_head=n_head,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+    )
+    GPT2LMHeadModel(config).save_pretrained(path)
+    return path
+
+
+def build_layer_skip_draft(target_path: str, path: str = None, n_layer: int = 1) -> str:
+    """
+    Create (or reuse) a draft model made of the first `n_layer` blocks of a target.
+
+    The draft shares the target's tokenizer, embeddings and output head, so it
+    agrees with the target often enough to exercise speculative decoding even
+    with randomly initialised weights.
+
+    Returns:
+        The directory containing the draft model
+    """
+    path = path or f"{target_path.rstrip(os.sep)}-draft{n_layer}"
+    if os.path.exists(os.path.join(path, "config.json")):
+        return path
+
+    model = GPT2LMHeadModel.from_pretrained(target_path)
+    model.transformer.h = model.transformer.h[:n_layer]
+    model.config.n_layer = n_layer
+    model.save_pretrained(path)
+    GPT2TokenizerFast.from_pretrained(target_path).save_pretrained(path)
+    return path
+
+
+if __name__ == "__main__":
+    print(build_tiny_model())
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Scaling benchmark: chat throughput and memory with 1 to N inference worker processes.
+
+Each level starts a WorkerPool with the same total thread count split across
+its workers and sends concurrent OpenAIChat.chat requests to it. Every level
+reports tokens/sec, p50/p95 latency and how much of the memory-mapped weights
+each worker holds privately versus shares with the others (from
+/proc/<pid>/smaps). Results are written as JSON.
+
+Usage:
+    python benchmarks/workers.py
+    python benchmarks/workers.py --workers 1 2 4 --threads 8 --requests 64
+    python benchmarks/workers.py --model gpt2 --max-tokens 64
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+# Add the src directory to the path so we can import our modules
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.dirname(__file__))
+
+import torch
+
+from core.inference.workers import WorkerPool
+from tiny_model import DEFAULT_PATH, build_tiny_model
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+PROMPTS = [
+    "Hello! Can you tell me a short joke?",
+    "What is the capital of France?",
+    "Explain machine learning in one sentence.",
+    "What is Python programming language?",
+]
+
+
+def make_messages(i: int):
+    return [
+        {"role": "system", "content": "You are a helpful assistant."},
+        {"role": "user", "content": PROMPTS[i % len(PROMPTS)]},
+    ]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of `values`, or None if there are none"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, round(q / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+def mapping_memory(pid: int, path: str) -> Dict[str, int]:
+    """Sum the Rss, Pss and private pages of a process's mappings of `path`, in bytes"""
+    totals = {"Rss": 0, "Pss": 0, "Private_Clean": 0, "Private_Dirty": 0}
+    in_mapping = False
+    with open(f"/proc/{pid}/smaps") as smaps:
+        for line in smaps:
+            fields = line.split()
+            if not line[0].isupper() or ":" not in fields[0]:
+                # Mapping header: address range, permissions, ..., path
+                in_mapping = fields[-1] == path
+            elif in_mapping and fields[0][:-1] in totals:
+                totals[fields[0][:-1]] += int(fields[1]) * 1024
+    return totals
+
+
+def run_level(
+    model: str, workers: int, threads: int, requests: int, concurrency: int, max_tokens: int
+) -> Dict[str, Any]:
+    start = time.perf_counter()
+    pool = WorkerPool(model, num_workers=workers, num_threads=threads, use_cpu=True)
+    startup_s = time.perf_counter() - start
+
+    # Warm up every worker before timing
+    with ThreadPoolExecutor(max_workers=workers) as warmup:
+        list(warmup.map(lambda i: pool.chat(make_messages(i), max_tokens=4), range(workers)))
+
+    def run(i: int):
+        started = time.perf_counter()
+        result = pool.chat(make_messages(i), max_tokens=max_tokens, temperature=1.0, seed=i)
+        return time.perf_counter() - started, result["usage"]["completion_tokens"]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as clients:
+        outcomes = list(clients.map(run, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = [latency for latency, _ in outcomes]
+    tokens = sum(count for _, count in outcomes)
+
+    memory = [mapping_memory(worker["pid"], pool.weights) for worker in pool.get_stats()["workers"]]
+    pool.close()
+
+    return {
+        "workers": workers,
+        "threads_per_worker": pool.threads_per_worker,
+        "startup_s": startup_s,
+        "elapsed_s": elapsed,
+        "completion_tokens": tokens,
+        "tokens_per_s": tokens / elapsed,
+        "requests_per_s": requests / elapsed,
+        "latency_p50_s": percentile(latencies, 50),
+        "latency_p95_s": percentile(latencies, 95),
+        "weights_bytes": pool.resident_bytes(),
+        "weights_rss_bytes": sum(m["Rss"] for m in memory),
+        "weights_pss_bytes": sum(m["Pss"] for m in memory),
+        "weights_private_bytes": sum(m["Private_Clean"] + m["Private_Dirty"] for m in memory),
+    }
+
+
+def print_results(results: List[Dict[str, Any]]):
+    base = results[0]["tokens_per_s"]
+    header = (
+        f"{'workers':>7} {'threads':>7} {'tok/s':>8} {'speedup':>7} {'p50 ms':>8} "
+        f"{'p95 ms':>8} {'weights MB':>10} {'RSS MB':>8} {'PSS MB':>8} {'private MB':>10}"
+    )
+    print(header)
+    print("-" * len(header))
+    mb = 1024**2
+    for r in results:
+        print(
+            f"{r['workers']:>7} {r['threads_per_worker']:>7} {r['tokens_per_s']:>8.1f} "
+            f"{r['tokens_per_s'] / base:>6.2f}x {r['latency_p50_s'] * 1000:>8.1f} "
+            f"{r['latency_p95_s'] * 1000:>8.1f} {r['weights_bytes'] / mb:>10.1f} "
+            f"{r['weights_rss_bytes'] / mb:>8.1f} {r['weights_pss_bytes'] / mb:>8.1f} "
+            f"{r['weights_private_bytes'] / mb:>10.1f}"
+        )
+
+
+def main():
+    cpu_count = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--model", help="Model to load (default: tiny local GPT-2)")
+    parser.add_argument(
+        "--workers",
+        nargs="+",
+        type=int,
+        default=[n for n in (1, 2, 4, 8) if n <= cpu_count],
+        help="Worker counts to compare",
+    )
+    parser.add_argument(
+        "--threads", type=int, default=cpu_count, help="Total threads split across workers"
+    )
+    parser.add_argument("--requests", type=int, default=32, help="Requests per level")
+    parser.add_argument(
+        "--concurrency", type=int, help="Concurrent clients (default: 2 per worker)"
+    )
+    parser.add_argument("--max-tokens", type=int, default=32)
+    parser.add_argument("--output", help="Results file (default: benchmarks/results/)")
+    args = parser.parse_args()
+
+    if args.model is None:
+        model = build_tiny_model(path=f"{DEFAULT_PATH}-large", n_layer=8, n_embd=256)
+    else:
+        model = args.model
+
+    results = []
+    for workers in args.workers:
+        result = run_level(
+            model,
+            workers,
+            args.threads,
+            args.requests,
+            args.concurrency or 2 * workers,
+            args.max_tokens,
+        )
+        results.append(result)
+        print(
+            f"{workers} workers: {result['tokens_per_s']:.1f} tok/s, "
+            f"p95 {result['latency_p95_s'] * 1000:.1f} ms"
+        )
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "model": model,
+            "requests_per_level": args.requests,
+            "max_tokens": args.max_tokens,
+            "total_threads": args.threads,
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "cpu_count": cpu_count,
+        },
+        "results": results,
+    }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(
+            RESULTS_DIR, f"workers-{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+        )
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    print()
+    print(f"Model: {model}")
+    print(f"Requests per level: {args.requests}, max_tokens: {args.max_tokens}")
+    print_results(results)
+    print(f"\nResults written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,29 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 
-from api.routers import openai, processor, test
+from api.routers import metrics, openai, processor, test
+from api.services.tts import kokoro_tts
+from core.chat.batch import batch_jobs
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Offline batches interrupted by a restart continue where they stopped
+    batch_jobs.resume()
+    # The speech model and pipelines are warm before the first request
+    await run_in_threadpool(kokoro_tts.preload)
+    yield
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 app.include_router(openai.router, prefix="/api/v1", tags=["v1"])
 app.include_router(processor.router, prefix="/api/v1", tags=["v1"])
 app.include_router(test.router)
+app.include_router(metrics.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -0,0 +1,82 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from core.chat.registry import model_registry
+from core.chat.response_cache import completion_cache
+from core.inference.metrics import metrics
+from core.tts.response_cache import speech_cache
+from core.tts.segment_cache import segment_cache
+
+router = APIRouter(tags=["Metrics"])
+
+
+def _collect_cache_metrics():
+    """
+    Refresh the metrics that mirror the model registry and caches at scrape time.
+
+    Running totals (hits, misses, evictions, work saved) are exported as
+    counters with a `_total` suffix; sizes, entry counts and rates as gauges.
+    """
+    registry_stats = model_registry.stats()
+    metrics.set_gauge("model_registry_resident_bytes", registry_stats["resident_bytes"])
+    for model, stats in registry_stats["models"].items():
+        labels = {"model": model}
+        metrics.set_counter("model_registry_hits_total", stats["hits"], labels)
+        metrics.set_counter("model_registry_misses_total", stats["misses"], labels)
+        metrics.set_gauge("model_registry_model_bytes", stats["resident_bytes"], labels)
+        metrics.set_gauge("model_registry_last_load_seconds", stats["last_load_time_s"], labels)
+        prefix_stats = stats.get("prefix_cache")
+        if prefix_stats:
+            metrics.set_gauge("prefix_cache_hit_rate", prefix_stats["hit_rate"], labels)
+            metrics.set_counter(
+                "prefix_cache_tokens_saved_total", prefix_stats["tokens_saved"], labels
+            )
+            metrics.set_counter(
+                "prefix_cache_evictions_total", prefix_stats["evictions"], labels
+            )
+            metrics.set_gauge("prefix_cache_bytes", prefix_stats["bytes"], labels)
+        speculative_stats = stats.get("speculative")
+        if speculative_stats:
+            metrics.set_gauge(
+                "speculative_acceptance_rate", speculative_stats["acceptance_rate"], labels
+            )
+            metrics.set_gauge(
+                "speculative_tokens_per_round", speculative_stats["tokens_per_round"], labels
+            )
+
+    cache_stats = completion_cache.get_stats()
+    metrics.set_counter("completion_cache_hits_total", cache_stats["hits"])
+    metrics.set_counter("completion_cache_misses_total", cache_stats["misses"])
+    metrics.set_gauge("completion_cache_entries", cache_stats["entries"])
+
+    segment_stats = segment_cache.get_stats()
+    metrics.set_counter("tts_segment_cache_hits_total", segment_stats["hits"])
+    metrics.set_counter("tts_segment_cache_misses_total", segment_stats["misses"])
+    metrics.set_counter("tts_segment_cache_evictions_total", segment_stats["evictions"])
+    metrics.set_counter(
+        "tts_segment_cache_audio_seconds_saved_total", segment_stats["audio_seconds_saved"]
+    )
+    metrics.set_gauge("tts_segment_cache_hit_rate", segment_stats["hit_rate"])
+    metrics.set_gauge("tts_segment_cache_bytes", segment_stats["bytes"])
+    metrics.set_gauge("tts_segment_cache_disk_bytes", segment_stats["disk_bytes"])
+
+    response_stats = speech_cache.get_stats()
+    metrics.set_counter("tts_response_cache_hits_total", response_stats["hits"])
+    metrics.set_counter("tts_response_cache_misses_total", response_stats["misses"])
+    metrics.set_counter(
+        "tts_response_cache_not_modified_total", response_stats["not_modified"]
+    )
+    metrics.set_counter("tts_response_cache_evictions_total", response_stats["evictions"])
+    metrics.set_gauge("tts_response_cache_entries", response_stats["entries"])
+    metrics.set_gauge("tts_response_cache_bytes", response_stats["bytes"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Endpoint exposing inference metrics in the Prometheus text format.
+    """
+    _collect_cache_metrics()
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
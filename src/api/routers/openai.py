@@ -1,37 +1,190 @@
-from fastapi import APIRouter, UploadFile, HTTPException
-from fastapi.responses import StreamingResponse
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Iterator, Optional, Union
 
+from fastapi import APIRouter, UploadFile, HTTPException, Request, Response
+from fastapi.concurrency import iterate_in_threadpool, run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
+
+from model.batch import Batch, BatchList
 from model.chat_completions import ChatCompletionRequest, ChatCompletionResponse
 from model.image import ImageRequest, ImageResponse
 from model.speech import CreateSpeechRequest
 from model.topic import TopicDraft
 from model.video import VideoRequest, VideoResponse
 
-from api.services.tts import process_request as tts_process_request
+from core.chat.batch import batch_jobs
+from core.chat.registry import model_registry
+from core.chat.constrained import automaton_cache
+from core.inference.admission import admission_controller
+from core.inference.cancellation import (
+    CancellationToken,
+    GenerationCancelled,
+    cancellation_stats,
+)
+from core.inference.executor import (
+    InferenceQueueFull,
+    InferenceRejected,
+    inference_executor,
+)
+from core.tts.encoders import Chunk
+from core.tts.response_cache import speech_cache
+from core.tts.segment_cache import segment_cache
+
+from api.services.chat import (
+    process_request as chat_process_request,
+    stream_request as chat_stream_request,
+)
+from api.services.tts import (
+    process_request as tts_process_request,
+    stream_request as tts_stream_request,
+)
 from api.services.ocr import parse_ocr
 
 router = APIRouter()
 
+# Status reported when the client went away before its response was ready
+# (nginx's "client closed request"); nobody receives it, but it shows in access logs
+CLIENT_CLOSED_REQUEST = 499
+
+
+@asynccontextmanager
+async def cancel_on_disconnect(
+    http_request: Request, cancellation: Optional[CancellationToken] = None
+) -> AsyncIterator[CancellationToken]:
+    """
+    Get a token that is cancelled if the client disconnects while the block runs.
+
+    The request body has already been read, so the next ASGI message for the
+    request is the disconnect.
+
+    Args:
+        http_request: The request whose client is watched
+        cancellation: Token to cancel. Defaults to a new one.
+    """
+    cancellation = cancellation or CancellationToken()
+
+    async def watch() -> None:
+        while (await http_request.receive())["type"] != "http.disconnect":
+            pass
+        cancellation.cancel()
+
+    watcher = asyncio.create_task(watch())
+    try:
+        yield cancellation
+    finally:
+        watcher.cancel()
+
+
+async def stream_until_closed(
+    http_request: Request, events: Iterator[Union[str, Chunk]], cancellation: CancellationToken
+) -> AsyncIterator[Union[str, Chunk]]:
+    """
+    Stream blocking `events`, cancelling their generation if the client leaves.
+
+    The disconnect is watched for separately: waiting for the next event is
+    not interrupted by it, and generation may be far from the next event.
+    """
+    finished = False
+    try:
+        async with cancel_on_disconnect(http_request, cancellation):
+            async for event in iterate_in_threadpool(events):
+                yield event
+        finished = True
+    finally:
+        # Reached without finishing when the response was abandoned mid-stream
+        if not finished:
+            cancellation.cancel()
+
+
+class CachedSpeechResponse(FileResponse):
+    """
+    Speech response sent from a link to a speech cache entry.
+
+    The file is sent without reading it into the process where the server
+    supports it (ASGI pathsend). The link is removed once the response is
+    sent, failed or abandoned by the client.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await run_in_threadpool(speech_cache.release, self.path)
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Check whether an If-None-Match header lists `etag` (weakly compared)"""
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
 
 @router.post("/audio/speech")
-async def speech_to_text(request: CreateSpeechRequest):
+async def speech_to_text(request: CreateSpeechRequest, http_request: Request):
     """
     Endpoint to handle speech-to-text generation.
+
+    With `stream` set, audio is sent one sentence at a time as soon as each
+    is synthesized. Synthesis stops at the next sentence if the client disconnects.
+    Responses already generated for the same input, voice, speed and format
+    are sent from the speech response cache, or answered with 304 Not
+    Modified when the client's If-None-Match lists their ETag.
+    A non-streamed response is the download itself, so it is encoded in
+    `download_format` when one is given.
     """
     try:
-        audio = tts_process_request(request)
-        if not audio:
-            raise HTTPException(
-                status_code=500, detail="Error processing audio request"
-            )
-
-        format = request.download_format or request.response_format or "wav"
+        if not request.stream and request.download_format:
+            request = request.model_copy(update={"response_format": request.download_format})
+        format = request.response_format
         headers = {
             "Content-Disposition": f'attachment; filename="output.{format}"',
             "Content-Type": f"audio/{format}",
         }
 
-        return StreamingResponse(audio, media_type=f"audio/{format}", headers=headers)
+        if speech_cache.enabled:
+            key = speech_cache.make_key(request)
+            cached = await run_in_threadpool(speech_cache.get, key)
+            if cached is not None:
+                etag = speech_cache.etag(key)
+                if etag_matches(http_request.headers.get("if-none-match"), etag):
+                    speech_cache.release(cached)
+                    speech_cache.record_not_modified()
+                    return Response(status_code=304, headers={"ETag": etag})
+                return CachedSpeechResponse(
+                    cached, media_type=f"audio/{format}", headers={**headers, "ETag": etag}
+                )
+            # A non-streamed response is the file that gets cached
+            if not request.stream:
+                headers["ETag"] = speech_cache.etag(key)
+
+        if request.stream:
+            cancellation = CancellationToken()
+            async with cancel_on_disconnect(http_request, cancellation):
+                audio = await run_in_threadpool(tts_stream_request, request, cancellation)
+            return StreamingResponse(
+                stream_until_closed(http_request, audio, cancellation),
+                media_type=f"audio/{format}",
+                headers={**headers, "X-Accel-Buffering": "no"},
+            )
+
+        async with cancel_on_disconnect(http_request) as cancellation:
+            audio = await run_in_threadpool(tts_process_request, request, cancellation)
+        if not audio:
+            raise HTTPException(
+                status_code=500, detail="Error processing audio request"
+            )
+
+        # Sent from the encoded buffer itself, without copying it
+        return Response(audio.getbuffer(), media_type=f"audio/{format}", headers=headers)
+    except HTTPException:
+        raise
+    except GenerationCancelled as e:
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except FileNotFoundError:
         raise HTTPException(status_code=404, detail="File not found")
     except Exception as e:
@@ -81,33 +234,125 @@ async def ocr_topic(request: UploadFile):
 
 
 @router.post("/chat/completions", response_model=ChatCompletionResponse)
-async def chat_completions(request: ChatCompletionRequest):
+async def chat_completions(
+    request: ChatCompletionRequest, response: Response, http_request: Request
+):
     """
     Endpoint to handle chat completions following OpenAI's standard.
+    Set `stream: true` to receive `chat.completion.chunk` server-sent events.
+    Deterministic requests report `X-Cache: HIT` when served from the completion cache.
+    Non-streamed responses carry a `Server-Timing` header with the time spent per stage.
+    Generation stops within a token once the client disconnects.
     """
-    # Mock response for demonstration purposes
     try:
-        response = {
-            "id": "chatcmpl-123",
-            "object": "chat.completion",
-            "created": 1677652288,
-            "choices": [
-                {
-                    "index": 0,
-                    "message": {
-                        "role": "assistant",
-                        "content": "Hello! How can I assist you?",
-                    },
-                    "finish_reason": "stop",
-                }
-            ],
-            "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
-        }
-        return response
+        if request.stream:
+            cancellation = CancellationToken()
+            events = await run_in_threadpool(chat_stream_request, request, cancellation)
+            return StreamingResponse(
+                stream_until_closed(http_request, events, cancellation),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
+        # Generation runs on the bounded inference executor so it never blocks
+        # the event loop; when its queue is full the request is rejected
+        headers = {}
+        async with cancel_on_disconnect(http_request) as cancellation:
+            completion = await inference_executor.run(
+                chat_process_request, request, headers, cancellation
+            )
+        response.headers.update(headers)
+        return completion
+    except GenerationCancelled as e:
+        raise HTTPException(status_code=CLIENT_CLOSED_REQUEST, detail=str(e))
+    except InferenceRejected as e:
+        raise HTTPException(
+            status_code=429 if isinstance(e, InferenceQueueFull) else 503,
+            detail=str(e),
+            headers={"Retry-After": str(e.retry_after)},
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.post("/batches", response_model=Batch)
+async def create_batch(file: UploadFile):
+    """
+    Endpoint to start an offline batch of chat completions.
+    Upload a JSONL file with one ChatCompletionRequest per line, either bare or as
+    OpenAI batch lines (`custom_id`, `method`, `url`, `body`). Requests are run in
+    large batches in the background; poll the batch and download its output.
+    """
+    try:
+        return batch_jobs.create(await file.read())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+@router.get("/batches", response_model=BatchList)
+async def list_batches():
+    """
+    Endpoint to list offline batches, newest first.
+    """
+    return BatchList(data=batch_jobs.list())
+
+
+@router.get("/batches/{batch_id}", response_model=Batch)
+async def get_batch(batch_id: str):
+    """
+    Endpoint to report the status and request counts of an offline batch.
+    """
+    try:
+        return batch_jobs.get(batch_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Batch '{batch_id}' not found")
+
+
+@router.get("/batches/{batch_id}/output")
+async def get_batch_output(batch_id: str):
+    """
+    Endpoint to download the results of an offline batch as JSONL, one line per
+    request in completion order. While the batch runs this holds the results so far.
+    """
+    try:
+        path = batch_jobs.output_path(batch_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Batch '{batch_id}' not found")
+    if not os.path.exists(path):
+        return Response(content=b"", media_type="application/jsonl")
+    return FileResponse(path, media_type="application/jsonl", filename=f"{batch_id}.jsonl")
+
+
+@router.post("/batches/{batch_id}/cancel", response_model=Batch)
+async def cancel_batch(batch_id: str):
+    """
+    Endpoint to cancel an offline batch. Results written so far are kept.
+    """
+    try:
+        return batch_jobs.cancel(batch_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Batch '{batch_id}' not found")
+
+
+@router.get("/models/stats")
+async def models_stats():
+    """
+    Endpoint to report model registry statistics, together with those of the
+    subsystems serving requests: generation admission, the JSON schema
+    automaton cache, cancellations and the speech caches.
+    """
+    return {
+        **model_registry.stats(),
+        "admission": admission_controller.get_stats(),
+        "json_schema_cache": automaton_cache.get_stats(),
+        "cancellation": cancellation_stats.get_stats(),
+        "speech_segment_cache": segment_cache.get_stats(),
+        "speech_response_cache": speech_cache.get_stats(),
+    }
+
+
 @router.post("/images/generations", response_model=ImageResponse)
 async def image_generations(request: ImageRequest):
     """
@@ -0,0 +1,49 @@
+import json
+from typing import Dict, Iterator, Optional
+
+from core.inference.cancellation import CancellationToken
+from model.chat_completions import (
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+    ChatCompletions,
+)
+
+
+def process_request(
+    request: ChatCompletionRequest,
+    response_headers: Optional[Dict[str, str]] = None,
+    cancellation: Optional[CancellationToken] = None,
+) -> ChatCompletionResponse:
+    """
+    Process a non-streamed chat completion request.
+    """
+    return ChatCompletions.create(
+        request, response_headers=response_headers, cancellation=cancellation
+    )
+
+
+def stream_request(
+    request: ChatCompletionRequest, cancellation: Optional[CancellationToken] = None
+) -> Iterator[str]:
+    """
+    Start a streamed chat completion and return it as server-sent events.
+
+    Each chunk is sent as a `data:` event as soon as it is decoded, and the
+    stream is terminated with `data: [DONE]` like OpenAI's API. Closing the
+    events early cancels the generation.
+    """
+    chunks = ChatCompletions.stream(request, cancellation=cancellation)
+
+    def events() -> Iterator[str]:
+        try:
+            for chunk in chunks:
+                yield f"data: {chunk.model_dump_json(exclude_none=True)}\n\n"
+        except GeneratorExit:
+            chunks.close()
+            raise
+        except Exception as e:
+            # Headers are already sent, so report the failure in-band
+            yield f"data: {json.dumps({'error': {'message': str(e)}})}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return events()
@@ -1,12 +1,22 @@
+from itertools import chain
+from typing import Iterator, Optional
+
+from core.inference.cancellation import CancellationToken, GenerationCancelled
+from core.tts.encoders import Chunk
 from core.tts.kokoro import KokotoTTS
+from core.tts.response_cache import speech_cache
 from model.speech import CreateSpeechRequest
 
 kokoro_tts = KokotoTTS()
 
 
-def process_request(request: CreateSpeechRequest):
+def process_request(
+    request: CreateSpeechRequest, cancellation: Optional[CancellationToken] = None
+):
     """
     Process the TTS request and return the audio file path.
+
+    The encoded audio is also stored in the speech response cache.
     """
 
     audio = kokoro_tts.process_request(
@@ -14,6 +24,58 @@ def process_request(request: CreateSpeechRequest):
         lang_code=request.lang_code,
         voice=request.voice,
         speed=request.speed,
+        output_format=request.response_format,
+        cancellation=cancellation,
     )
+    if audio is not None and speech_cache.enabled:
+        speech_cache.put(speech_cache.make_key(request), audio.getbuffer())
 
     return audio
+
+
+def stream_request(
+    request: CreateSpeechRequest, cancellation: Optional[CancellationToken] = None
+) -> Iterator[Chunk]:
+    """
+    Start a streamed TTS request and return its audio, one sentence at a time.
+
+    The first sentence is synthesized before returning, so errors are raised
+    here rather than once the response has started. Closing the audio early
+    stops the synthesis. Audio streamed to the end is also stored in the
+    speech response cache, encoded as a complete file.
+    """
+    file = speech_cache.create()
+    audio = kokoro_tts.stream_audio(
+        text=request.input,
+        lang_code=request.lang_code or "a",
+        voice=request.voice,
+        speed=request.speed,
+        output_format=request.response_format,
+        cancellation=cancellation,
+        file=file,
+    )
+    try:
+        first = next(audio)
+    except BaseException:
+        if file is not None:
+            speech_cache.discard(file)
+        raise
+
+    def chunks() -> Iterator[Chunk]:
+        finished = False
+        try:
+            yield from chain([first], audio)
+            finished = True
+        except GeneratorExit:
+            audio.close()
+            raise
+        except GenerationCancelled:
+            # Only cancelled once the client is gone, so there is nobody to tell
+            return
+        finally:
+            if file is not None and finished:
+                speech_cache.commit(speech_cache.make_key(request), file)
+            elif file is not None:
+                speech_cache.discard(file)
+
+    return chunks()
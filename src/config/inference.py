@@ -0,0 +1,149 @@
+import os
+
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Memory budget (in MB) for chat models kept resident by the model registry.
+# Least recently used models are evicted once the budget is exceeded; 0 disables eviction.
+MODEL_MEMORY_BUDGET_MB = float(os.getenv("DEGEN_MODEL_MEMORY_BUDGET_MB", "0"))
+
+# Micro-batching of chat requests: the largest batch handed to the model and how long
+# a request may wait for others to join its batch.
+BATCH_MAX_SIZE = int(os.getenv("DEGEN_BATCH_MAX_SIZE", "8"))
+BATCH_MAX_DELAY_MS = float(os.getenv("DEGEN_BATCH_MAX_DELAY_MS", "10"))
+
+# Memory budget (in MB) for each model's shared-prefix key/value cache; 0 disables it.
+PREFIX_CACHE_MB = float(os.getenv("DEGEN_PREFIX_CACHE_MB", "256"))
+
+# Exact-match cache of deterministic chat completions (temperature 0 or fixed seed):
+# in-memory entries, time to live, and an optional SQLite file for the persistent tier.
+COMPLETION_CACHE_SIZE = int(os.getenv("DEGEN_COMPLETION_CACHE_SIZE", "1024"))
+COMPLETION_CACHE_TTL_S = float(os.getenv("DEGEN_COMPLETION_CACHE_TTL_S", "3600"))
+COMPLETION_CACHE_DB = os.getenv("DEGEN_COMPLETION_CACHE_DB", "")
+
+# Bounded inference executor: concurrent generation jobs and how many more may wait
+# before requests are rejected with 429. Keep the concurrency at or above
+# DEGEN_BATCH_MAX_SIZE so the scheduler can fill its batches.
+INFERENCE_MAX_CONCURRENCY = int(os.getenv("DEGEN_INFERENCE_MAX_CONCURRENCY", "16"))
+INFERENCE_MAX_QUEUE = int(os.getenv("DEGEN_INFERENCE_MAX_QUEUE", "64"))
+
+
+def _parse_model_map(name: str) -> dict:
+    """Parse a comma-separated list of model=value pairs from an environment variable"""
+    pairs = (entry.partition("=") for entry in os.getenv(name, "").split(","))
+    return {
+        model.strip(): value.strip()
+        for model, _, value in pairs
+        if model.strip() and value.strip()
+    }
+
+
+# Per-model CPU quantization, as comma-separated model=mode pairs with mode one of
+# int8 or bf16, e.g. "gpt2=int8,gpt2-medium=bf16". Unlisted models load in float32.
+MODEL_QUANTIZATION = _parse_model_map("DEGEN_MODEL_QUANTIZATION")
+
+# Speculative decoding: draft model paired with each target model, as comma-separated
+# target=draft pairs sharing a tokenizer, e.g. "gpt2-medium=gpt2". Greedy requests to
+# a paired model are drafted by the small model and verified by the large one.
+DRAFT_MODELS = _parse_model_map("DEGEN_DRAFT_MODELS")
+
+# Tokens the draft model proposes per verification step of the target model.
+SPECULATIVE_TOKENS = int(os.getenv("DEGEN_SPECULATIVE_TOKENS", "4"))
+
+# Log the per-stage timings and token counts of every chat request.
+LOG_CHAT_TIMINGS = os.getenv("DEGEN_LOG_CHAT_TIMINGS", "false").lower() in ("1", "true", "yes")
+
+# Tokenized prompt pieces (one per message) cached per chat model, so the history of
+# a multi-turn conversation is not re-tokenized every turn; 0 disables the cache.
+TOKEN_CACHE_SIZE = int(os.getenv("DEGEN_TOKEN_CACHE_SIZE", "4096"))
+
+# Memory available for generation (key/value caches and activations, not weights) in
+# MB. Requests are admitted while their estimated needs fit, queue otherwise and are
+# rejected if they could never fit. 0 uses 90% of the free GPU memory measured when
+# the first request arrives, and no limit on CPU. With DEGEN_INFERENCE_WORKERS, each
+# worker admits its own requests within an even share of the budget, so a model's
+# workers together never exceed it.
+ADMISSION_BUDGET_MB = float(os.getenv("DEGEN_ADMISSION_BUDGET_MB", "0"))
+
+# Seconds a request waits for memory to free up before it is rejected with a 503.
+ADMISSION_TIMEOUT_S = float(os.getenv("DEGEN_ADMISSION_TIMEOUT_S", "30"))
+
+# Worker processes running each chat model on CPU, sharing one memory-mapped copy of
+# the weights; requests are sent to them over pipes. 0 runs models in the API process.
+INFERENCE_WORKERS = int(os.getenv("DEGEN_INFERENCE_WORKERS", "0"))
+
+# Intra-op threads split evenly across the worker processes of a model; 0 uses one
+# per CPU core.
+INFERENCE_THREADS = int(os.getenv("DEGEN_INFERENCE_THREADS", "0"))
+
+# Directory of model weights converted to safetensors for memory-mapped loading.
+WEIGHTS_CACHE_DIR = os.path.expanduser(
+    os.getenv("DEGEN_WEIGHTS_CACHE_DIR", "~/.cache/degenerousai/weights")
+)
+
+# Compiled JSON-schema automata kept per tokenizer for constrained decoding.
+SCHEMA_CACHE_SIZE = int(os.getenv("DEGEN_SCHEMA_CACHE_SIZE", "128"))
+
+# Automaton states whose token masks (one byte per vocabulary entry) and token
+# transitions are memoized per schema; the least recently used are recomputed.
+SCHEMA_STATE_CACHE_SIZE = int(os.getenv("DEGEN_SCHEMA_STATE_CACHE_SIZE", "128"))
+
+# Deepest nesting generated for schema-less JSON (json_object, bare "object" types) and
+# the most times a recursive $ref is expanded under constrained decoding.
+JSON_MAX_DEPTH = int(os.getenv("DEGEN_JSON_MAX_DEPTH", "4"))
+
+# Offline batch jobs (/v1/batches and the batch CLI): the most requests per generate
+# call, and the most padded tokens (rows x longest prompt plus max_tokens) per call.
+OFFLINE_BATCH_SIZE = int(os.getenv("DEGEN_OFFLINE_BATCH_SIZE", "32"))
+OFFLINE_BATCH_MAX_TOKENS = int(os.getenv("DEGEN_OFFLINE_BATCH_MAX_TOKENS", "32768"))
+
+# Directory holding the input, results and status of offline batch jobs.
+BATCH_DIR = os.path.expanduser(os.getenv("DEGEN_BATCH_DIR", "~/.cache/degenerousai/batches"))
+
+# Keep every loaded chat model in DEGEN_WEIGHTS_CACHE_DIR in its runtime precision, and
+# map it from there on later starts instead of resolving and converting it again.
+WEIGHT_CACHE = os.getenv("DEGEN_WEIGHT_CACHE", "true").lower() in ("1", "true", "yes")
+
+# Compiled execution (torch.compile) of chat and TTS models. Chat decoding then runs
+# on a static key/value cache sized to the smallest of DEGEN_COMPILE_BUCKETS that holds
+# the prompt and max_tokens, so each bucket compiles once; longer requests run eagerly.
+# Models fall back to eager execution if compilation fails.
+COMPILE = os.getenv("DEGEN_COMPILE", "false").lower() in ("1", "true", "yes")
+COMPILE_BUCKETS = [
+    int(length) for length in os.getenv("DEGEN_COMPILE_BUCKETS", "256,512,1024,2048").split(",")
+]
+
+# torch.compile mode: "default", "reduce-overhead" (CUDA graphs) or "max-autotune".
+COMPILE_MODE = os.getenv("DEGEN_COMPILE_MODE", "default")
+
+# Directory of compiled kernels and graphs kept across restarts, so a restarted
+# process reuses them instead of compiling again.
+COMPILE_CACHE_DIR = os.path.expanduser(
+    os.getenv("DEGEN_COMPILE_CACHE_DIR", "~/.cache/degenerousai/compile")
+)
+
+# Language codes of the Kokoro speech pipelines built when the API starts, together
+# with the shared Kokoro model, comma-separated (a: English, j: Japanese, z: Chinese).
+# Other languages are built on their first request; empty loads everything lazily.
+TTS_PRELOAD_LANGS = [
+    lang.strip() for lang in os.getenv("DEGEN_TTS_PRELOAD_LANGS", "a").split(",") if lang.strip()
+]
+
+# Cache of synthesized speech per sentence, keyed on the normalised sentence, language,
+# voice and speed, so repeated sentences are not synthesized again: memory budget in MB
+# (0 disables it), and an optional directory that entries evicted from memory spill to,
+# with its own budget in MB.
+TTS_SEGMENT_CACHE_MB = float(os.getenv("DEGEN_TTS_SEGMENT_CACHE_MB", "256"))
+TTS_SEGMENT_CACHE_DIR = os.path.expanduser(os.getenv("DEGEN_TTS_SEGMENT_CACHE_DIR", ""))
+TTS_SEGMENT_CACHE_DISK_MB = float(os.getenv("DEGEN_TTS_SEGMENT_CACHE_DISK_MB", "2048"))
+
+# Cache of whole /audio/speech responses, stored encoded as files named after the hash
+# of the request fields that change the audio: directory and disk budget in MB. Off by
+# default (0); set a budget to serve repeated requests from disk with ETags and 304s.
+# Least recently used files are evicted once over budget.
+TTS_RESPONSE_CACHE_DIR = os.path.expanduser(
+    os.getenv("DEGEN_TTS_RESPONSE_CACHE_DIR", "~/.cache/degenerousai/speech")
+)
+TTS_RESPONSE_CACHE_MB = float(os.getenv("DEGEN_TTS_RESPONSE_CACHE_MB", "0"))
@@ -0,0 +1,479 @@
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from pydantic import ValidationError
+
+from config.inference import BATCH_DIR, OFFLINE_BATCH_MAX_TOKENS, OFFLINE_BATCH_SIZE
+from core.inference.executor import InferenceRejected
+from model.batch import Batch, BatchRequestCounts
+from model.chat_completions import ChatCompletionRequest, ChatCompletions
+
+# Retry pause for a bucket rejected by admission control without a Retry-After
+DEFAULT_RETRY_AFTER_S = 5
+
+
+class BatchItem:
+    """One request line of a batch input file"""
+
+    def __init__(self, custom_id: str, request: ChatCompletionRequest):
+        self.custom_id = custom_id
+        self.request = request
+        self.prompt_tokens = 0
+
+    @property
+    def batchable(self) -> bool:
+        """Whether the request can share a generate call with others"""
+        response_format = self.request.response_format
+        return (self.request.n or 1) == 1 and (
+            response_format is None or response_format.type == "text"
+        )
+
+    @property
+    def key(self) -> Tuple[Any, ...]:
+        """Requests with the same key can share a generate call"""
+        return (self.request.model, self.request.temperature, self.request.seed)
+
+
+def parse_batch_line(line: str, line_number: int) -> BatchItem:
+    """
+    Parse a line of a batch input file.
+
+    A line is either an OpenAI batch request (`custom_id`, `method`, `url` and
+    the request as `body`) or a bare ChatCompletionRequest, whose ID is then
+    `line-<line_number>`.
+
+    Raises:
+        ValueError: If the line is not a valid request
+    """
+    try:
+        payload = json.loads(line)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Line {line_number} is not valid JSON: {e}")
+    if not isinstance(payload, dict):
+        raise ValueError(f"Line {line_number} is not a JSON object")
+
+    custom_id = f"line-{line_number}"
+    if "body" in payload:
+        custom_id = str(payload.get("custom_id") or custom_id)
+        url = payload.get("url", "/v1/chat/completions")
+        if not url.rstrip("/").endswith("/chat/completions"):
+            raise ValueError(f"Line {line_number}: unsupported url {url!r}")
+        payload = payload["body"]
+
+    try:
+        request = ChatCompletionRequest.model_validate(payload)
+    except ValidationError as e:
+        raise ValueError(f"Line {line_number}: invalid request: {e}")
+    return BatchItem(custom_id, request)
+
+
+def result_record(
+    custom_id: str,
+    response: Optional[Dict[str, Any]] = None,
+    error: Optional[str] = None,
+    status_code: int = 200,
+) -> Dict[str, Any]:
+    """Build a line of a batch results file, in the shape of OpenAI's batch output"""
+    record: Dict[str, Any] = {
+        "id": f"batch_req_{uuid.uuid4().hex[:24]}",
+        "custom_id": custom_id,
+        "response": None,
+        "error": None,
+    }
+    if error is None:
+        record["response"] = {
+            "status_code": status_code,
+            "request_id": response["id"],
+            "body": response,
+        }
+    else:
+        code = "server_error" if status_code >= 500 else "invalid_request"
+        record["error"] = {"code": code, "message": error}
+    return record
+
+
+def read_results(path: str) -> Dict[str, bool]:
+    """
+    Read which requests a results file already holds, and whether each succeeded.
+
+    A line left incomplete by a crash is cut off, so the file can be appended to.
+    """
+    done: Dict[str, bool] = {}
+    if not os.path.exists(path):
+        return done
+
+    with open(path, "rb+") as f:
+        valid_end = 0
+        for line in f:
+            try:
+                record = json.loads(line)
+                done[record["custom_id"]] = record["error"] is None
+            except (ValueError, KeyError):
+                break
+            valid_end += len(line)
+        f.truncate(valid_end)
+    return done
+
+
+class BatchRunner:
+    """
+    Runs a JSONL file of chat completion requests in large batches.
+
+    Requests that can share a generate call (same model, temperature and
+    seed; one free-text choice) are sorted by prompt length and cut into
+    buckets of similar length, so little compute goes to padding. Buckets run
+    one at a time straight on the model, and their results are appended to
+    the output file and synced to disk as each bucket finishes. The output
+    file doubles as the checkpoint: running again skips the requests it
+    already holds, so an interrupted run resumes where it stopped.
+    """
+
+    def __init__(
+        self,
+        input_path: str,
+        output_path: str,
+        batch_size: Optional[int] = None,
+        max_batch_tokens: Optional[int] = None,
+        cancel_event: Optional[threading.Event] = None,
+        on_progress: Optional[Callable[[BatchRequestCounts], None]] = None,
+    ):
+        """
+        Initialize the runner.
+
+        Args:
+            input_path: JSONL file with one request per line
+            output_path: JSONL file the results are appended to
+            batch_size: Most requests per generate call. Defaults to
+                DEGEN_OFFLINE_BATCH_SIZE.
+            max_batch_tokens: Most padded tokens (rows times the longest prompt
+                plus max_tokens) per generate call. Defaults to
+                DEGEN_OFFLINE_BATCH_MAX_TOKENS.
+            cancel_event: Stops the run after the current bucket when set
+            on_progress: Called with the request counts after every bucket
+        """
+        self.input_path = input_path
+        self.output_path = output_path
+        self.batch_size = max(1, batch_size or OFFLINE_BATCH_SIZE)
+        self.max_batch_tokens = max_batch_tokens or OFFLINE_BATCH_MAX_TOKENS
+        self.cancel_event = cancel_event or threading.Event()
+        self.on_progress = on_progress
+        self.counts = BatchRequestCounts()
+
+    def run(self) -> BatchRequestCounts:
+        """
+        Run every request not yet in the output file.
+
+        Returns:
+            Request counts, including those completed by earlier runs
+        """
+        done = read_results(self.output_path)
+        self.counts = BatchRequestCounts()
+
+        with open(self.output_path, "a", encoding="utf-8") as output:
+            records, items = self._read_input(done)
+            self._write(output, records)
+
+            batchable = [item for item in items if item.batchable]
+            buckets = self._buckets(batchable, output)
+            buckets.extend([item] for item in items if not item.batchable)
+
+            started = time.perf_counter()
+            for bucket in buckets:
+                if self.cancel_event.is_set():
+                    break
+                self._write(output, self._run_bucket(bucket))
+
+            elapsed = time.perf_counter() - started
+            print(
+                f"Batch {os.path.basename(self.input_path)}: {self.counts.completed} completed, "
+                f"{self.counts.failed} failed of {self.counts.total} in {elapsed:.1f}s"
+            )
+        return self.counts
+
+    def _read_input(
+        self, done: Dict[str, bool]
+    ) -> Tuple[List[Dict[str, Any]], List[BatchItem]]:
+        """Parse the input file into pending requests and error records for invalid lines"""
+        records: List[Dict[str, Any]] = []
+        items: List[BatchItem] = []
+        seen: Set[str] = set()
+
+        with open(self.input_path, encoding="utf-8") as f:
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                self.counts.total += 1
+                item, error = None, None
+                try:
+                    item = parse_batch_line(line, line_number)
+                    if item.custom_id in seen:
+                        raise ValueError(
+                            f"Line {line_number}: duplicate custom_id {item.custom_id!r}"
+                        )
+                except ValueError as e:
+                    item, error = None, str(e)
+                custom_id = f"line-{line_number}" if item is None else item.custom_id
+                seen.add(custom_id)
+
+                if custom_id in done:
+                    if done[custom_id]:
+                        self.counts.completed += 1
+                    else:
+                        self.counts.failed += 1
+                elif item is None:
+                    records.append(result_record(custom_id, error=error, status_code=400))
+                else:
+                    items.append(item)
+        return records, items
+
+    def _buckets(self, items: List[BatchItem], output: Any) -> List[List[BatchItem]]:
+        """Group requests by sampling settings and cut each group into buckets of similar length"""
+        groups: Dict[Tuple[Any, ...], List[BatchItem]] = {}
+        failed: List[Dict[str, Any]] = []
+        for item in items:
+            try:
+                item.prompt_tokens = ChatCompletions.count_prompt_tokens(item.request)
+            except Exception as e:
+                failed.append(result_record(item.custom_id, error=str(e), status_code=400))
+                continue
+            groups.setdefault(item.key, []).append(item)
+        self._write(output, failed)
+
+        buckets: List[List[BatchItem]] = []
+        for group in groups.values():
+            # Longest first, so a bucket that cannot fit in memory shows up early
+            group.sort(key=lambda item: item.prompt_tokens, reverse=True)
+            bucket: List[BatchItem] = []
+            max_new_tokens = 0
+            for item in group:
+                # Rows are padded to the first (longest) prompt of the bucket
+                longest = bucket[0].prompt_tokens if bucket else item.prompt_tokens
+                new_tokens = max(max_new_tokens, item.request.max_tokens or 256)
+                padded = (len(bucket) + 1) * (longest + new_tokens)
+                if bucket and (len(bucket) >= self.batch_size or padded > self.max_batch_tokens):
+                    buckets.append(bucket)
+                    bucket, new_tokens = [], item.request.max_tokens or 256
+                bucket.append(item)
+                max_new_tokens = new_tokens
+            if bucket:
+                buckets.append(bucket)
+        return buckets
+
+    def _run_bucket(self, bucket: List[BatchItem]) -> List[Dict[str, Any]]:
+        """Run a bucket, falling back to one request at a time if it fails as a whole"""
+        while True:
+            try:
+                if len(bucket) == 1 and not bucket[0].batchable:
+                    responses = [ChatCompletions.create(bucket[0].request)]
+                else:
+                    responses = ChatCompletions.create_batch([item.request for item in bucket])
+                return [
+                    result_record(item.custom_id, response.model_dump(mode="json"))
+                    for item, response in zip(bucket, responses)
+                ]
+            except InferenceRejected as e:
+                # Offline work has no deadline; wait for memory or a queue slot
+                if self.cancel_event.wait(e.retry_after or DEFAULT_RETRY_AFTER_S):
+                    return []
+            except Exception as e:
+                if len(bucket) > 1:
+                    return [record for item in bucket for record in self._run_bucket([item])]
+                status_code = 400 if isinstance(e, ValueError) else 500
+                return [result_record(bucket[0].custom_id, error=str(e), status_code=status_code)]
+
+    def _write(self, output: Any, records: List[Dict[str, Any]]) -> None:
+        """Append result records and sync them to disk"""
+        if not records:
+            return
+        for record in records:
+            output.write(json.dumps(record) + "\n")
+            if record["error"] is None:
+                self.counts.completed += 1
+            else:
+                self.counts.failed += 1
+        output.flush()
+        os.fsync(output.fileno())
+        if self.on_progress is not None:
+            self.on_progress(self.counts)
+
+
+class BatchJobs:
+    """
+    Offline batch jobs submitted through the API.
+
+    Each job lives in its own directory under `root` with its input file,
+    results file and status (`batch.json`). Jobs run one at a time on a
+    background thread, and jobs left unfinished by a restart are picked up
+    again by `resume`.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        """
+        Initialize the job store.
+
+        Args:
+            root: Directory of the jobs. Defaults to DEGEN_BATCH_DIR.
+        """
+        self.root = root or BATCH_DIR
+        self._lock = threading.Lock()
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._cancel_events: Dict[str, threading.Event] = {}
+
+    def create(self, input_data: bytes) -> Batch:
+        """
+        Store an input file and queue it as a new job.
+
+        Raises:
+            ValueError: If the file is empty or not UTF-8 text
+        """
+        try:
+            text = input_data.decode("utf-8")
+        except UnicodeDecodeError:
+            raise ValueError("Batch input must be a UTF-8 JSONL file")
+        if not text.strip():
+            raise ValueError("Batch input file is empty")
+
+        batch = Batch(
+            id=f"batch_{uuid.uuid4().hex[:24]}",
+            status="validating",
+            created_at=int(time.time()),
+        )
+        os.makedirs(self._path(batch.id), exist_ok=True)
+        with open(self._path(batch.id, "input.jsonl"), "w", encoding="utf-8") as f:
+            f.write(text)
+        self._save(batch)
+        self._enqueue(batch.id)
+        return batch
+
+    def get(self, batch_id: str) -> Batch:
+        """
+        Get the status of a job.
+
+        Raises:
+            KeyError: If there is no such job
+        """
+        path = self._path(batch_id, "batch.json")
+        if os.path.basename(os.path.dirname(path)) != batch_id or not os.path.exists(path):
+            raise KeyError(batch_id)
+        with open(path, encoding="utf-8") as f:
+            return Batch.model_validate_json(f.read())
+
+    def list(self) -> List[Batch]:
+        """Get every job, newest first"""
+        batches = []
+        for batch_id in self._batch_ids():
+            try:
+                batches.append(self.get(batch_id))
+            except (KeyError, ValueError):
+                continue
+        return sorted(batches, key=lambda batch: batch.created_at, reverse=True)
+
+    def output_path(self, batch_id: str) -> str:
+        """
+        Get the results file of a job, which grows while the job runs.
+
+        Raises:
+            KeyError: If there is no such job
+        """
+        self.get(batch_id)
+        return self._path(batch_id, "output.jsonl")
+
+    def cancel(self, batch_id: str) -> Batch:
+        """
+        Stop a job after its current bucket; results so far are kept.
+
+        Raises:
+            KeyError: If there is no such job
+        """
+        with self._lock:
+            batch = self.get(batch_id)
+            if batch.status in ("validating", "in_progress"):
+                batch.status = "cancelling"
+                self._save(batch)
+                self._cancel_events.setdefault(batch_id, threading.Event()).set()
+            return batch
+
+    def resume(self) -> None:
+        """Queue the jobs that were unfinished when the process last stopped"""
+        for batch in sorted(self.list(), key=lambda batch: batch.created_at):
+            if batch.status in ("validating", "in_progress", "cancelling"):
+                print(f"Resuming batch {batch.id}")
+                self._enqueue(batch.id)
+
+    def _enqueue(self, batch_id: str) -> None:
+        with self._lock:
+            self._cancel_events.setdefault(batch_id, threading.Event())
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="batch-jobs", daemon=True
+                )
+                self._thread.start()
+        self._queue.put(batch_id)
+
+    def _run(self) -> None:
+        while True:
+            batch_id = self._queue.get()
+            try:
+                self._run_job(batch_id)
+            except Exception as e:
+                print(f"Batch {batch_id} failed: {e}")
+                self._update(batch_id, status="failed", failed_at=int(time.time()), errors=[str(e)])
+
+    def _run_job(self, batch_id: str) -> None:
+        cancel_event = self._cancel_events[batch_id]
+        batch = self.get(batch_id)
+        if batch.status == "cancelling" or cancel_event.is_set():
+            self._update(batch_id, status="cancelled", cancelled_at=int(time.time()))
+            return
+        self._update(batch_id, status="in_progress", in_progress_at=int(time.time()))
+
+        runner = BatchRunner(
+            self._path(batch_id, "input.jsonl"),
+            self._path(batch_id, "output.jsonl"),
+            cancel_event=cancel_event,
+            on_progress=lambda counts: self._update(batch_id, request_counts=counts),
+        )
+        counts = runner.run()
+
+        if cancel_event.is_set():
+            self._update(
+                batch_id, status="cancelled", cancelled_at=int(time.time()), request_counts=counts
+            )
+        else:
+            self._update(
+                batch_id, status="completed", completed_at=int(time.time()), request_counts=counts
+            )
+
+    def _update(self, batch_id: str, **changes: Any) -> Batch:
+        """Apply changes to a job's status; a cancel request is never overwritten by progress"""
+        with self._lock:
+            batch = self.get(batch_id)
+            if batch.status == "cancelling" and changes.get("status") == "in_progress":
+                changes.pop("status")
+            batch = batch.model_copy(update=changes)
+            self._save(batch)
+            return batch
+
+    def _save(self, batch: Batch) -> None:
+        path = self._path(batch.id, "batch.json")
+        partial = f"{path}.partial"
+        with open(partial, "w", encoding="utf-8") as f:
+            f.write(batch.model_dump_json(indent=2))
+        os.replace(partial, path)
+
+    def _batch_ids(self) -> Iterator[str]:
+        if os.path.isdir(self.root):
+            yield from os.listdir(self.root)
+
+    def _path(self, batch_id: str, *names: str) -> str:
+        return os.path.join(self.root, os.path.basename(batch_id), *names)
+
+
+# Shared job store used by the API
+batch_jobs = BatchJobs()
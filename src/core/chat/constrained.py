@@ -0,0 +1,749 @@
+import hashlib
+import json
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from typing import Any, Callable, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+import torch
+from transformers import LogitsProcessor
+
+from config.inference import JSON_MAX_DEPTH, SCHEMA_CACHE_SIZE, SCHEMA_STATE_CACHE_SIZE
+
+# Automaton state with no way to continue
+DEAD = -1
+# Row that has finished with an end-of-sequence token
+DONE = -2
+
+# Bounded repetitions (string lengths, array sizes) above this are unrolled only
+# up to their minimum and left open after it
+MAX_UNROLLED = 64
+# Digits allowed in the integer, fraction and exponent parts of a number
+MAX_DIGITS = 16
+
+_CONTROL_CHARS = frozenset(chr(code) for code in range(0x20))
+_DIGITS = frozenset("0123456789")
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
+Fragment = Tuple[int, int]
+
+
+class _CharSet:
+    """Characters an NFA edge accepts: a set, or everything outside a set"""
+
+    __slots__ = ("chars", "negated")
+
+    def __init__(self, chars: Iterable[str], negated: bool = False):
+        self.chars = frozenset(chars)
+        self.negated = negated
+
+    def matches(self, char: str) -> bool:
+        return (char in self.chars) != self.negated
+
+
+class _NFA:
+    """Character-level NFA with epsilon moves"""
+
+    def __init__(self):
+        self.edges: List[List[Tuple[_CharSet, int]]] = []
+        self.epsilons: List[List[int]] = []
+
+    def state(self) -> int:
+        self.edges.append([])
+        self.epsilons.append([])
+        return len(self.edges) - 1
+
+    def edge(self, source: int, chars: _CharSet, target: int) -> None:
+        self.edges[source].append((chars, target))
+
+    def epsilon(self, source: int, target: int) -> None:
+        self.epsilons[source].append(target)
+
+
+class _SchemaCompiler:
+    """
+    Thompson construction of a character NFA for the JSON texts matching a schema.
+
+    Supported: type (single or list), properties with required, items,
+    minItems/maxItems, minLength/maxLength, enum, const, anyOf/oneOf, single
+    allOf and local $ref. Objects produce only the listed properties, in schema
+    order. Constraints on values (minimum, pattern, format, ...) are not
+    enforced. Schema-less values (`{}` or a bare `"type": "object"`) are any
+    JSON nested at most `max_depth` levels, and recursive references are
+    expanded at most `max_depth` times. Whitespace is limited to a single
+    optional space between tokens.
+    """
+
+    def __init__(self, schema: Any, max_depth: int):
+        self.root = schema
+        self.max_depth = max_depth
+        self.nfa = _NFA()
+        self._ref_depth: Dict[str, int] = {}
+
+    def compile(self) -> Tuple[_NFA, int, int]:
+        start, end = self._seq(self._ws, lambda: self._value(self.root))
+        return self.nfa, start, end
+
+    # Combinators; each call builds a fresh copy of its fragment
+
+    def _empty(self) -> Fragment:
+        state = self.nfa.state()
+        return state, state
+
+    def _never(self) -> Fragment:
+        return self.nfa.state(), self.nfa.state()
+
+    def _chars(self, chars: Iterable[str], negated: bool = False) -> Fragment:
+        start, end = self.nfa.state(), self.nfa.state()
+        self.nfa.edge(start, _CharSet(chars, negated), end)
+        return start, end
+
+    def _literal(self, text: str) -> Fragment:
+        start = state = self.nfa.state()
+        for char in text:
+            target = self.nfa.state()
+            self.nfa.edge(state, _CharSet(char), target)
+            state = target
+        return start, state
+
+    def _seq(self, *parts: Callable[[], Fragment]) -> Fragment:
+        start, end = self._empty()
+        for part in parts:
+            part_start, part_end = part()
+            self.nfa.epsilon(end, part_start)
+            end = part_end
+        return start, end
+
+    def _alt(self, options: List[Callable[[], Fragment]]) -> Fragment:
+        start, end = self.nfa.state(), self.nfa.state()
+        for option in options:
+            option_start, option_end = option()
+            self.nfa.epsilon(start, option_start)
+            self.nfa.epsilon(option_end, end)
+        return start, end
+
+    def _repeat(
+        self, part: Callable[[], Fragment], minimum: int = 0, maximum: Optional[int] = None
+    ) -> Fragment:
+        """`part` repeated between `minimum` and `maximum` (unbounded if None) times"""
+        if maximum is not None and maximum > MAX_UNROLLED:
+            maximum = None
+        minimum = min(minimum, MAX_UNROLLED)
+
+        start, end = self._empty()
+        for _ in range(minimum):
+            part_start, part_end = part()
+            self.nfa.epsilon(end, part_start)
+            end = part_end
+
+        if maximum is None:
+            loop_start, loop_end = part()
+            self.nfa.epsilon(end, loop_start)
+            self.nfa.epsilon(loop_end, end)
+            return start, end
+
+        done = self.nfa.state()
+        self.nfa.epsilon(end, done)
+        for _ in range(maximum - minimum):
+            part_start, part_end = part()
+            self.nfa.epsilon(end, part_start)
+            self.nfa.epsilon(part_end, done)
+            end = part_end
+        return start, done
+
+    def _ws(self) -> Fragment:
+        return self._repeat(lambda: self._literal(" "), 0, 1)
+
+    # JSON
+
+    def _value(self, schema: Any, depth: Optional[int] = None) -> Fragment:
+        depth = self.max_depth if depth is None else depth
+        if schema is True or schema == {}:
+            return self._any(depth)
+        if schema is False:
+            return self._never()
+        if not isinstance(schema, dict):
+            raise ValueError(f"Invalid JSON schema: {schema!r}")
+
+        if "$ref" in schema:
+            return self._ref(schema["$ref"], depth)
+        if "const" in schema:
+            return self._literal(json.dumps(schema["const"]))
+        if "enum" in schema:
+            return self._alt(
+                [lambda value=value: self._literal(json.dumps(value)) for value in schema["enum"]]
+            )
+        for keyword in ("anyOf", "oneOf"):
+            if keyword in schema:
+                return self._alt(
+                    [lambda option=option: self._value(option, depth) for option in schema[keyword]]
+                )
+        if "allOf" in schema:
+            if len(schema["allOf"]) != 1:
+                raise ValueError("allOf with more than one schema is not supported")
+            return self._value(schema["allOf"][0], depth)
+
+        schema_type = schema.get("type")
+        if schema_type is None:
+            if "properties" in schema:
+                schema_type = "object"
+            elif "items" in schema:
+                schema_type = "array"
+            else:
+                return self._any(depth)
+        if isinstance(schema_type, list):
+            return self._alt(
+                [
+                    lambda single=single: self._value({**schema, "type": single}, depth)
+                    for single in schema_type
+                ]
+            )
+
+        if schema_type == "string":
+            return self._string(schema.get("minLength", 0), schema.get("maxLength"))
+        if schema_type == "integer":
+            return self._integer()
+        if schema_type == "number":
+            return self._number()
+        if schema_type == "boolean":
+            return self._alt([lambda: self._literal("true"), lambda: self._literal("false")])
+        if schema_type == "null":
+            return self._literal("null")
+        if schema_type == "array":
+            items = schema.get("items", True)
+            return self._array(
+                lambda: self._value(items, depth - 1 if items is True else depth),
+                schema.get("minItems", 0),
+                schema.get("maxItems"),
+            )
+        if schema_type == "object":
+            if "properties" not in schema:
+                return self._any_object(depth)
+            return self._object(schema["properties"], set(schema.get("required", [])), depth)
+        raise ValueError(f"Unsupported JSON schema type: {schema_type!r}")
+
+    def _ref(self, ref: str, depth: int) -> Fragment:
+        if not ref.startswith("#"):
+            raise ValueError(f"Only local $ref is supported, got {ref!r}")
+        target = self.root
+        for part in filter(None, ref[1:].split("/")):
+            part = part.replace("~1", "/").replace("~0", "~")
+            try:
+                target = target[int(part)] if isinstance(target, list) else target[part]
+            except (KeyError, IndexError, ValueError, TypeError):
+                raise ValueError(f"Unresolvable $ref {ref!r}")
+
+        # Recursive schemas are cut off once expanded max_depth times
+        if self._ref_depth.get(ref, 0) >= self.max_depth:
+            return self._never()
+        self._ref_depth[ref] = self._ref_depth.get(ref, 0) + 1
+        try:
+            return self._value(target, depth)
+        finally:
+            self._ref_depth[ref] -= 1
+
+    def _any(self, depth: int) -> Fragment:
+        options = [
+            lambda: self._string(),
+            self._number,
+            lambda: self._literal("true"),
+            lambda: self._literal("false"),
+            lambda: self._literal("null"),
+        ]
+        if depth > 0:
+            options.append(lambda: self._any_object(depth))
+            options.append(lambda: self._array(lambda: self._any(depth - 1)))
+        return self._alt(options)
+
+    def _any_object(self, depth: int) -> Fragment:
+        if depth <= 0:
+            return self._never()
+
+        def member() -> Fragment:
+            return self._seq(
+                self._string,
+                self._ws,
+                lambda: self._literal(":"),
+                self._ws,
+                lambda: self._any(depth - 1),
+            )
+
+        def members() -> Fragment:
+            return self._seq(
+                member,
+                lambda: self._repeat(
+                    lambda: self._seq(self._ws, lambda: self._literal(","), self._ws, member)
+                ),
+            )
+
+        return self._seq(
+            lambda: self._literal("{"),
+            self._ws,
+            lambda: self._repeat(members, 0, 1),
+            self._ws,
+            lambda: self._literal("}"),
+        )
+
+    def _object(self, properties: Dict[str, Any], required: Set[str], depth: int) -> Fragment:
+        start, opened = self._seq(lambda: self._literal("{"), self._ws)
+
+        # Two tracks through the properties: none written yet, or at least one
+        # written, so the next one needs a comma
+        none_written, some_written = opened, self.nfa.state()
+        for name, schema in properties.items():
+            member_start, member_end = self._seq(
+                lambda: self._literal(json.dumps(name)),
+                self._ws,
+                lambda: self._literal(":"),
+                self._ws,
+                lambda: self._value(schema, depth),
+            )
+            comma_start, comma_end = self._seq(
+                self._ws, lambda: self._literal(","), self._ws
+            )
+            self.nfa.epsilon(none_written, member_start)
+            self.nfa.epsilon(some_written, comma_start)
+            self.nfa.epsilon(comma_end, member_start)
+
+            next_none, next_some = self.nfa.state(), self.nfa.state()
+            self.nfa.epsilon(member_end, next_some)
+            if name not in required:
+                self.nfa.epsilon(none_written, next_none)
+                self.nfa.epsilon(some_written, next_some)
+            none_written, some_written = next_none, next_some
+
+        close_start, end = self._seq(self._ws, lambda: self._literal("}"))
+        self.nfa.epsilon(none_written, close_start)
+        self.nfa.epsilon(some_written, close_start)
+        return start, end
+
+    def _array(
+        self, item: Callable[[], Fragment], minimum: int = 0, maximum: Optional[int] = None
+    ) -> Fragment:
+        def items() -> Fragment:
+            return self._seq(
+                item,
+                lambda: self._repeat(
+                    lambda: self._seq(self._ws, lambda: self._literal(","), self._ws, item),
+                    max(0, minimum - 1),
+                    None if maximum is None else maximum - 1,
+                ),
+            )
+
+        if maximum == 0:
+            body = self._empty
+        elif minimum > 0:
+            body = items
+        else:
+            body = lambda: self._repeat(items, 0, 1)
+        return self._seq(
+            lambda: self._literal("["),
+            self._ws,
+            body,
+            self._ws,
+            lambda: self._literal("]"),
+        )
+
+    def _string(self, minimum: int = 0, maximum: Optional[int] = None) -> Fragment:
+        def char() -> Fragment:
+            return self._alt(
+                [
+                    lambda: self._chars(_CONTROL_CHARS | {'"', "\\"}, negated=True),
+                    lambda: self._seq(
+                        lambda: self._literal("\\"), lambda: self._chars('"\\/bfnrt')
+                    ),
+                    lambda: self._seq(
+                        lambda: self._literal("\\u"),
+                        lambda: self._repeat(lambda: self._chars(_HEX_DIGITS), 4, 4),
+                    ),
+                ]
+            )
+
+        return self._seq(
+            lambda: self._literal('"'),
+            lambda: self._repeat(char, minimum, maximum),
+            lambda: self._literal('"'),
+        )
+
+    def _digits(self, minimum: int = 1) -> Fragment:
+        return self._repeat(lambda: self._chars(_DIGITS), minimum, MAX_DIGITS)
+
+    def _integer(self) -> Fragment:
+        return self._seq(
+            lambda: self._repeat(lambda: self._literal("-"), 0, 1),
+            lambda: self._alt(
+                [
+                    lambda: self._literal("0"),
+                    lambda: self._seq(lambda: self._chars("123456789"), lambda: self._digits(0)),
+                ]
+            ),
+        )
+
+    def _number(self) -> Fragment:
+        return self._seq(
+            self._integer,
+            lambda: self._repeat(lambda: self._seq(lambda: self._literal("."), self._digits), 0, 1),
+            lambda: self._repeat(
+                lambda: self._seq(
+                    lambda: self._chars("eE"),
+                    lambda: self._repeat(lambda: self._chars("+-"), 0, 1),
+                    self._digits,
+                ),
+                0,
+                1,
+            ),
+        )
+
+
+class CharAutomaton:
+    """
+    DFA over characters, determinized lazily from an NFA.
+
+    A DFA state is the set of NFA states reachable after the characters read
+    so far; states and transitions are created on first use and memoized.
+    """
+
+    def __init__(self, nfa: _NFA, start: int, accept: int):
+        self._nfa = nfa
+        self._accept = accept
+        self._lock = threading.Lock()
+        self._sets: List[FrozenSet[int]] = []
+        self._ids: Dict[FrozenSet[int], int] = {}
+        self._transitions: List[Dict[str, int]] = []
+        self.initial = self._add(self._closure([start]))
+
+    @property
+    def num_states(self) -> int:
+        return len(self._sets)
+
+    def step(self, state: int, char: str) -> int:
+        """Get the state after reading `char` in `state`, or DEAD"""
+        transitions = self._transitions[state]
+        target = transitions.get(char)
+        if target is None:
+            nfa_targets = [
+                nfa_target
+                for nfa_state in self._sets[state]
+                for chars, nfa_target in self._nfa.edges[nfa_state]
+                if chars.matches(char)
+            ]
+            target = self._add(self._closure(nfa_targets)) if nfa_targets else DEAD
+            transitions[char] = target
+        return target
+
+    def walk(self, state: int, text: str) -> int:
+        """Get the state after reading `text` in `state`, or DEAD"""
+        for char in text:
+            state = self.step(state, char)
+            if state == DEAD:
+                break
+        return state
+
+    def accepting(self, state: int) -> bool:
+        return state >= 0 and self._accept in self._sets[state]
+
+    def _closure(self, states: Iterable[int]) -> FrozenSet[int]:
+        closure = set(states)
+        stack = list(closure)
+        while stack:
+            for target in self._nfa.epsilons[stack.pop()]:
+                if target not in closure:
+                    closure.add(target)
+                    stack.append(target)
+        return frozenset(closure)
+
+    def _add(self, states: FrozenSet[int]) -> int:
+        with self._lock:
+            state = self._ids.get(states)
+            if state is None:
+                state = len(self._sets)
+                self._sets.append(states)
+                self._transitions.append({})
+                self._ids[states] = state
+            return state
+
+
+class _TrieNode:
+    __slots__ = ("children", "token_ids")
+
+    def __init__(self):
+        self.children: Dict[str, "_TrieNode"] = {}
+        self.token_ids: List[int] = []
+
+
+class Vocabulary:
+    """
+    The text of every token of a tokenizer, arranged in a character trie.
+
+    Special tokens and tokens that decode to partial characters are left out,
+    so constrained output is made of complete characters only.
+    """
+
+    def __init__(self, tokenizer: Any):
+        self.size = len(tokenizer)
+        special_ids = set(tokenizer.all_special_ids)
+        self.eos_token_ids = {tokenizer.eos_token_id} - {None}
+
+        # Decode each token after an anchor token, so tokenizers that drop a
+        # leading space at the start of the text keep it here
+        anchor = tokenizer("0", add_special_tokens=False)["input_ids"][-1:]
+        anchor_text = tokenizer.decode(anchor)
+        texts = tokenizer.batch_decode([anchor + [token_id] for token_id in range(self.size)])
+
+        self.root = _TrieNode()
+        for token_id, text in enumerate(texts):
+            if token_id in special_ids or not text.startswith(anchor_text):
+                continue
+            text = text[len(anchor_text) :]
+            if not text or "�" in text:
+                continue
+            node = self.root
+            for char in text:
+                node = node.children.setdefault(char, _TrieNode())
+            node.token_ids.append(token_id)
+
+        self.texts: Dict[int, str] = {}
+        stack = [(self.root, "")]
+        while stack:
+            node, prefix = stack.pop()
+            for token_id in node.token_ids:
+                self.texts[token_id] = prefix
+            stack.extend((child, prefix + char) for char, child in node.children.items())
+
+
+class TokenAutomaton:
+    """
+    Token-level view of a CharAutomaton: which tokens may follow in each state.
+
+    The allowed tokens of a state are found by walking the vocabulary trie
+    along live transitions, and are memoized per state together with the
+    state reached after each token, for the `max_states` most recently used
+    states. End-of-sequence is allowed once the text is a complete match.
+
+    Automata are shared by concurrent requests, so the memo tables are guarded
+    by a lock; the work of filling them is done outside it.
+    """
+
+    def __init__(
+        self, chars: CharAutomaton, vocabulary: Vocabulary, max_states: Optional[int] = None
+    ):
+        self.chars = chars
+        self.vocabulary = vocabulary
+        self.initial = chars.initial
+        self.max_states = SCHEMA_STATE_CACHE_SIZE if max_states is None else max_states
+        self._lock = threading.Lock()
+        # (mask, dead end) by (state, logits size)
+        self._masks: "OrderedDict[Tuple[int, int], Tuple[torch.Tensor, bool]]" = OrderedDict()
+        self._next: "OrderedDict[int, Dict[int, int]]" = OrderedDict()
+
+    def advance(self, state: int, token_id: int) -> int:
+        """Get the state after `token_id`, DONE after end-of-sequence, DEAD if not allowed"""
+        if state == DONE or token_id in self.vocabulary.eos_token_ids:
+            return DONE if state == DONE or self.chars.accepting(state) else DEAD
+        if state == DEAD:
+            return DEAD
+
+        with self._lock:
+            targets = self._next.get(state)
+            target = None if targets is None else targets.get(token_id)
+            if targets is not None:
+                self._next.move_to_end(state)
+        if target is None:
+            text = self.vocabulary.texts.get(token_id)
+            target = DEAD if text is None else self.chars.walk(state, text)
+            with self._lock:
+                self._next.setdefault(state, {})[token_id] = target
+                self._next.move_to_end(state)
+                while len(self._next) > self.max_states:
+                    self._next.popitem(last=False)
+        return target
+
+    def allowed_tokens(self, state: int) -> List[int]:
+        """
+        Get the tokens that keep the text on track to a match.
+
+        Empty at a dead end: a state whose text is incomplete but that no
+        token continues.
+        """
+        if state in (DONE, DEAD):
+            return sorted(self.vocabulary.eos_token_ids)
+
+        allowed: List[int] = []
+        stack = [(self.vocabulary.root, state)]
+        while stack:
+            node, node_state = stack.pop()
+            for char, child in node.children.items():
+                target = self.chars.step(node_state, char)
+                if target == DEAD:
+                    continue
+                allowed.extend(child.token_ids)
+                if child.children:
+                    stack.append((child, target))
+
+        if self.chars.accepting(state):
+            allowed.extend(self.vocabulary.eos_token_ids)
+        return allowed
+
+    def mask(self, state: int, size: int) -> torch.Tensor:
+        """
+        Get a boolean mask over `size` logits, True for the allowed tokens.
+
+        At a dead end only end-of-sequence is allowed, so generation stops
+        rather than sampling from nothing; see `dead_end`.
+        """
+        return self._entry(state, size)[0]
+
+    def dead_end(self, state: int, size: int) -> bool:
+        """Check whether the text of `state` is incomplete and no token continues it"""
+        return state == DEAD or self._entry(state, size)[1]
+
+    def _entry(self, state: int, size: int) -> Tuple[torch.Tensor, bool]:
+        key = (state, size)
+        with self._lock:
+            entry = self._masks.get(key)
+            if entry is not None:
+                self._masks.move_to_end(key)
+                return entry
+
+        mask = torch.zeros(size, dtype=torch.bool)
+        allowed = [token_id for token_id in self.allowed_tokens(state) if token_id < size]
+        dead_end = not allowed
+        if dead_end:
+            allowed = [token_id for token_id in self.vocabulary.eos_token_ids if token_id < size]
+        mask[allowed] = True
+        entry = (mask, dead_end)
+        with self._lock:
+            self._masks[key] = entry
+            while len(self._masks) > self.max_states:
+                self._masks.popitem(last=False)
+        return entry
+
+
+class JSONSchemaLogitsProcessor(LogitsProcessor):
+    """
+    Logits processor that only lets generation produce JSON matching a schema.
+
+    Each row of the batch tracks its own automaton state, advanced by the
+    token generated since the previous call; disallowed tokens get -inf. A row
+    that reaches a dead end is made to end and recorded in `dead_ends`, since
+    its text does not match the schema.
+    """
+
+    def __init__(self, automaton: TokenAutomaton):
+        self.automaton = automaton
+        self._states: Optional[List[int]] = None
+        self.dead_ends: Set[int] = set()
+
+    @property
+    def rows(self) -> int:
+        """Number of rows generated, once generation has started"""
+        return len(self._states or [])
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        if self._states is None:
+            self._states = [self.automaton.initial] * input_ids.shape[0]
+        else:
+            last_tokens = input_ids[:, -1].tolist()
+            self._states = [
+                self.automaton.advance(state, token_id)
+                for state, token_id in zip(self._states, last_tokens)
+            ]
+
+        size = scores.shape[-1]
+        for row, state in enumerate(self._states):
+            if state != DONE and self.automaton.dead_end(state, size):
+                self.dead_ends.add(row)
+        masks = torch.stack([self.automaton.mask(state, size) for state in self._states])
+        return scores.masked_fill(~masks.to(scores.device), float("-inf"))
+
+
+class AutomatonCache:
+    """
+    LRU cache of compiled schema automata per tokenizer.
+
+    Compiling a schema and mapping a vocabulary onto it is the expensive part
+    of constrained decoding, and the lazily built states and token masks keep
+    paying off across requests, so automata are kept per (tokenizer, schema
+    hash). Each tokenizer's vocabulary trie is built once.
+    """
+
+    def __init__(self, max_entries: Optional[int] = None, max_depth: Optional[int] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Schemas kept per tokenizer. Defaults to DEGEN_SCHEMA_CACHE_SIZE.
+            max_depth: Nesting allowed in schema-less JSON and recursive schemas.
+                Defaults to DEGEN_JSON_MAX_DEPTH.
+        """
+        self.max_entries = SCHEMA_CACHE_SIZE if max_entries is None else max_entries
+        self.max_depth = JSON_MAX_DEPTH if max_depth is None else max_depth
+
+        self._lock = threading.Lock()
+        self._vocabularies: "weakref.WeakKeyDictionary[Any, Vocabulary]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._automata: "weakref.WeakKeyDictionary[Any, OrderedDict[str, TokenAutomaton]]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self.stats = {"hits": 0, "misses": 0, "compile_seconds": 0.0}
+
+    def get(self, tokenizer: Any, schema: Any) -> TokenAutomaton:
+        """
+        Get the automaton for `schema` over `tokenizer`'s vocabulary, compiling it on a miss.
+
+        Raises:
+            ValueError: If the schema uses unsupported features
+        """
+        key = self.schema_key(schema)
+        with self._lock:
+            automata = self._automata.setdefault(tokenizer, OrderedDict())
+            automaton = automata.get(key)
+            if automaton is not None:
+                automata.move_to_end(key)
+                self.stats["hits"] += 1
+                return automaton
+
+        start = time.perf_counter()
+        nfa, initial, accept = _SchemaCompiler(schema, self.max_depth).compile()
+        chars = CharAutomaton(nfa, initial, accept)
+        automaton = TokenAutomaton(chars, self._vocabulary(tokenizer))
+        elapsed = time.perf_counter() - start
+
+        with self._lock:
+            self.stats["misses"] += 1
+            self.stats["compile_seconds"] += elapsed
+            automata[key] = automaton
+            while len(automata) > self.max_entries:
+                automata.popitem(last=False)
+        return automaton
+
+    def schema_key(self, schema: Any) -> str:
+        """Hash a schema independently of key order"""
+        canonical = json.dumps([schema, self.max_depth], sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit-rate, compile time and size counters"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": sum(len(automata) for automata in self._automata.values()),
+                "max_entries": self.max_entries,
+            }
+
+    def _vocabulary(self, tokenizer: Any) -> Vocabulary:
+        with self._lock:
+            vocabulary = self._vocabularies.get(tokenizer)
+        if vocabulary is None:
+            vocabulary = Vocabulary(tokenizer)
+            with self._lock:
+                vocabulary = self._vocabularies.setdefault(tokenizer, vocabulary)
+        return vocabulary
+
+
+# Shared cache used by all chat models
+automaton_cache = AutomatonCache()
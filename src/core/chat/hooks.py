@@ -0,0 +1,58 @@
+from typing import Any, Callable, Dict, List, Optional, Type, TypeVar
+
+from transformers import (
+    LogitsProcessor,
+    LogitsProcessorList,
+    StoppingCriteria,
+    StoppingCriteriaList,
+)
+
+T = TypeVar("T")
+
+
+class GenerationHooks:
+    """
+    Factories of the logits processors and stopping criteria of one generation.
+
+    Processors and criteria keep state while a generation runs (schema
+    automaton states, seeded random generators, the first-token time), so a
+    generation that is run again, e.g. eagerly after a failed compiled
+    attempt, must start from new ones. Every `build` makes a fresh set and
+    keeps it, so the caller can read the state of the run whose output it got.
+    """
+
+    def __init__(self):
+        self.processors: List[Callable[[], LogitsProcessor]] = []
+        self.criteria: List[Callable[[], StoppingCriteria]] = []
+        self._built: List[Any] = []
+
+    def add_processor(self, factory: Callable[[], LogitsProcessor]) -> None:
+        """Add a logits processor; processors run in the order they are added"""
+        self.processors.append(factory)
+
+    def add_criterion(self, factory: Callable[[], StoppingCriteria]) -> None:
+        """Add a stopping criterion"""
+        self.criteria.append(factory)
+
+    def build(self) -> Dict[str, Any]:
+        """
+        Build new processors and criteria for a run of `generate`.
+
+        Returns:
+            The `logits_processor` and `stopping_criteria` keyword arguments,
+            each only if there is something to pass
+        """
+        processors = [factory() for factory in self.processors]
+        criteria = [factory() for factory in self.criteria]
+        self._built = [*processors, *criteria]
+
+        kwargs: Dict[str, Any] = {}
+        if processors:
+            kwargs["logits_processor"] = LogitsProcessorList(processors)
+        if criteria:
+            kwargs["stopping_criteria"] = StoppingCriteriaList(criteria)
+        return kwargs
+
+    def latest(self, cls: Type[T]) -> Optional[T]:
+        """Get the processor or criterion of type `cls` built last, if any"""
+        return next((hook for hook in self._built if isinstance(hook, cls)), None)
@@ -1,15 +1,90 @@
 import gc
-from typing import List, Dict, Any
+import os
+import time
+from typing import List, Dict, Any, Optional, Tuple, Union
 
 import torch
-from transformers import pipeline
+from transformers import (
+    AutoTokenizer,
+    CompileConfig,
+    DynamicCache,
+    StaticCache,
+    pipeline,
+)
+
+from config.inference import (
+    BATCH_MAX_SIZE,
+    COMPILE,
+    COMPILE_BUCKETS,
+    PREFIX_CACHE_MB,
+    SPECULATIVE_TOKENS,
+    TOKEN_CACHE_SIZE,
+    WEIGHT_CACHE,
+)
+from core.chat.constrained import JSONSchemaLogitsProcessor, automaton_cache
+from core.chat.hooks import GenerationHooks
+from core.chat.prefix_cache import PrefixCache
+from core.chat.quantization import (
+    QUANTIZATION_MODES,
+    cpu_supports_bf16,
+    quantize_dynamic_int8,
+)
+from core.chat.sampling import SeededSampler
+from core.chat.speculative import SpeculativeDecoder
+from core.chat.stopping import (
+    MaxNewTokensPerRow,
+    StopOnCancel,
+    StopOnSequences,
+    find_stop_sequence,
+)
+from core.chat.tokens import TokenCache
+from core.inference.admission import admission_controller, estimate_generation_bytes
+from core.inference.cancellation import (
+    CancellationToken,
+    GenerationCancelled,
+    cancellation_stats,
+    check_cancelled,
+)
+from core.inference.compile import CompiledExecution, bucket_length
+from core.inference.executor import InferenceRejected
+from core.inference.mmap_weights import (
+    load_cached_model,
+    load_mmap_model,
+    load_tokenizer,
+    save_mmap_weights,
+    weights_path,
+)
+from core.inference.timing import FirstTokenClock, StageTimer
+
+# Speaker prefixes of the prompt transcript; a model that starts one is writing
+# the next turn itself, so generation stops there
+TURN_MARKERS = ["\nHuman:", "\nSystem:", "\nAssistant:"]
+
+# Generation settings the speculative decoder can honour; anything else falls
+# back to regular generation
+SPECULATIVE_KWARGS = {
+    "max_new_tokens",
+    "do_sample",
+    "pad_token_id",
+    "streamer",
+}
 
 
 class OpenAIChat:
     """OpenAI-compatible chat interface using transformers with memory optimization"""
 
     def __init__(
-        self, model="openai/gpt-oss-20b", device=None, use_cpu=False, **kwargs
+        self,
+        model="openai/gpt-oss-20b",
+        device=None,
+        use_cpu=False,
+        prefix_cache_mb: Optional[float] = None,
+        quantization: Optional[str] = None,
+        draft_model: Optional[str] = None,
+        num_draft_tokens: Optional[int] = None,
+        mmap_weights: Optional[str] = None,
+        compile: Optional[bool] = None,
+        **kwargs,
     ):
         """
         Initialize the chat model with memory optimization options.
@@ -18,11 +93,39 @@ class OpenAIChat:
             model: The model name to use
             device: Specific device to use ('cuda', 'cpu', etc.)
             use_cpu: Force CPU usage to avoid CUDA memory issues
+            prefix_cache_mb: Memory budget for reusing key/values of shared prompt
+                prefixes. Defaults to DEGEN_PREFIX_CACHE_MB; 0 disables it.
+            quantization: CPU-only precision mode: 'int8' (dynamic int8 Linear
+                layers) or 'bf16'. None keeps float32.
+            draft_model: Smaller model sharing this model's tokenizer, used for
+                speculative decoding of greedy requests
+            num_draft_tokens: Tokens drafted per verification step. Defaults to
+                DEGEN_SPECULATIVE_TOKENS.
+            mmap_weights: Safetensors file written by `save_mmap_weights` to map
+                the weights from instead of loading them (CPU only), so processes
+                serving the same model share one copy. Without one, the weights
+                cache (DEGEN_WEIGHT_CACHE) is used.
+            compile: Decode with a compiled model on static key/value caches.
+                Defaults to DEGEN_COMPILE.
             **kwargs: Additional arguments for the pipeline
         """
+        if quantization is not None and quantization not in QUANTIZATION_MODES:
+            raise ValueError(
+                f"Unknown quantization mode '{quantization}', "
+                f"expected one of {', '.join(QUANTIZATION_MODES)}"
+            )
+
         self.model = model
         self.use_cpu = use_cpu
 
+        if prefix_cache_mb is None:
+            prefix_cache_mb = PREFIX_CACHE_MB
+        self.prefix_cache: Optional[PrefixCache] = (
+            PrefixCache(max_bytes=int(prefix_cache_mb * 1024**2))
+            if prefix_cache_mb > 0
+            else None
+        )
+
         # Determine device
         if use_cpu or not torch.cuda.is_available():
             self.device = "cpu"
@@ -62,11 +165,118 @@ class OpenAIChat:
 
         print(f"Using device: {self.device}")
 
+        # Precision used whenever the model ends up on CPU
+        cpu_dtype = torch.float32
+        if quantization == "bf16":
+            if cpu_supports_bf16():
+                cpu_dtype = torch.bfloat16
+            else:
+                print("Warning: CPU has no native bfloat16 support, using float32")
+                quantization = None
+
         # Clear GPU cache before loading
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
             gc.collect()
 
+        # Time spent per loading stage, reported by the model registry
+        self.load_timer = StageTimer()
+
+        # Models already in the weights cache are mapped from it in their
+        # runtime precision; others are loaded and then written to it
+        runtime_dtype = cpu_dtype if self.device == "cpu" else torch.float16
+        cache_path = self._weights_cache_path(mmap_weights, runtime_dtype)
+        self.pipe = None
+        if cache_path is not None and os.path.exists(cache_path):
+            try:
+                self.pipe = self._load_cached_pipeline(cache_path, **kwargs)
+            except Exception as e:
+                print(f"Warning: Failed to load cached weights {cache_path}: {e}")
+
+        if self.pipe is None:
+            with self.load_timer.stage("load"):
+                self._load_pipeline(cpu_dtype, **kwargs)
+            if (
+                cache_path is not None
+                and self.model == model
+                and self.pipe.model.dtype == runtime_dtype
+            ):
+                with self.load_timer.stage("cache_write"):
+                    try:
+                        save_mmap_weights(self.pipe.model, cache_path, self.pipe.tokenizer)
+                        print(f"Cached {model} weights at {cache_path}")
+                    except Exception as e:
+                        print(f"Warning: Failed to cache {model} weights: {e}")
+
+        if quantization is not None and self.device != "cpu":
+            print(f"Quantization '{quantization}' only applies on CPU, ignoring it")
+            quantization = None
+        if quantization == "int8":
+            with self.load_timer.stage("quantize"):
+                quantize_dynamic_int8(self.pipe.model)
+        self.quantization = quantization
+
+        self._prepare_tokenizer()
+        self.token_cache = TokenCache(self.pipe.tokenizer, TOKEN_CACHE_SIZE)
+
+        self.speculative: Optional[SpeculativeDecoder] = None
+        if draft_model:
+            with self.load_timer.stage("draft"):
+                self.speculative = self._load_draft_model(
+                    draft_model, num_draft_tokens or SPECULATIVE_TOKENS
+                )
+
+        self.compiled: Optional[CompiledExecution] = None
+        if COMPILE if compile is None else compile:
+            self.compiled = CompiledExecution(self.model)
+            self._compile_config = CompileConfig(
+                fullgraph=False, dynamic=False, mode=self.compiled.mode
+            )
+            # Transformers only compiles on CUDA unless told otherwise
+            self._compile_config._compile_all_devices = True
+            # One graph per static cache bucket and batch size
+            torch._dynamo.config.recompile_limit = max(
+                torch._dynamo.config.recompile_limit,
+                len(COMPILE_BUCKETS) * BATCH_MAX_SIZE,
+            )
+
+    @property
+    def tokenizer(self) -> Any:
+        """The model's tokenizer"""
+        return self.pipe.tokenizer
+
+    def _weights_cache_path(
+        self, mmap_weights: Optional[str], dtype: torch.dtype
+    ) -> Optional[str]:
+        """Get the weights cache file of this model, or None if it is not cached"""
+        if mmap_weights is not None:
+            return mmap_weights if self.device == "cpu" else None
+        if not WEIGHT_CACHE:
+            return None
+        # Models spread over several GPUs are loaded with a device map instead
+        if self.device != "cpu" and torch.cuda.device_count() > 1:
+            return None
+        return weights_path(self.model, dtype)
+
+    def _load_cached_pipeline(self, path: str, **kwargs) -> Any:
+        """Build the pipeline around weights mapped from the weights cache"""
+        with self.load_timer.stage("weights"):
+            model = load_mmap_model(path)
+            if self.device != "cpu":
+                model = model.to(self.device)
+        with self.load_timer.stage("tokenizer"):
+            tokenizer = load_tokenizer(path, self.model)
+        with self.load_timer.stage("pipeline"):
+            return pipeline(
+                "text-generation",
+                model=model,
+                tokenizer=tokenizer,
+                device=-1 if self.device == "cpu" else 0,
+                **kwargs,
+            )
+
+    def _load_pipeline(self, cpu_dtype: torch.dtype, **kwargs) -> None:
+        """Resolve and load the model through `pipeline`, falling back to CPU or a smaller model"""
         try:
             # Try to load with memory optimizations
             if self.device == "cpu":
@@ -75,7 +285,7 @@ class OpenAIChat:
                     "text-generation",
                     model=self.model,
                     device=-1,  # Force CPU
-                    torch_dtype=torch.float32,  # Use float32 for CPU
+                    torch_dtype=cpu_dtype,
                     **kwargs,
                 )
             else:
@@ -104,136 +314,183 @@ class OpenAIChat:
                 "text-generation",
                 model=self.model,
                 device=-1,  # Force CPU
-                torch_dtype=torch.float32,
+                torch_dtype=cpu_dtype,
                 **kwargs,
             )
 
         except Exception as e:
             # Final fallback to a smaller model
             print(
-                f"Warning: Failed to load model {model}, falling back to smaller model: {e}"
+                f"Warning: Failed to load model {self.model}, falling back to smaller model: {e}"
             )
-            fallback_model = "gpt2" if "gpt" in model else "microsoft/DialoGPT-small"
+            fallback_model = "gpt2" if "gpt" in self.model else "microsoft/DialoGPT-small"
 
             self.pipe = pipeline(
                 "text-generation",
                 model=fallback_model,
                 device=-1 if self.device == "cpu" else 0,
-                torch_dtype=torch.float32 if self.device == "cpu" else torch.float16,
+                torch_dtype=cpu_dtype if self.device == "cpu" else torch.float16,
                 **kwargs,
             )
             self.model = fallback_model
 
+    def _prepare_tokenizer(self):
+        """Configure the tokenizer for batched (left-padded) generation"""
+        tokenizer = self.pipe.tokenizer
+        if tokenizer is None:
+            return
+        if tokenizer.pad_token_id is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        # Decoder-only models continue from the last position, so pad on the left
+        tokenizer.padding_side = "left"
+
+    def _load_draft_model(
+        self, draft_model: str, num_draft_tokens: int
+    ) -> Optional[SpeculativeDecoder]:
+        """
+        Load the draft model for speculative decoding.
+
+        The draft is loaded on the same device and in the same precision as the
+        target. Models whose tokenizer differs from the target's cannot be used.
+
+        Returns:
+            The speculative decoder, or None if the draft cannot be used
+        """
+        from transformers import AutoModelForCausalLM
+
+        target = self.pipe.model
+        try:
+            if WEIGHT_CACHE:
+                draft = load_cached_model(draft_model, target.dtype)
+                draft_tokenizer = load_tokenizer(
+                    weights_path(draft_model, target.dtype), draft_model
+                )
+            else:
+                draft = AutoModelForCausalLM.from_pretrained(draft_model, torch_dtype=target.dtype)
+                draft_tokenizer = AutoTokenizer.from_pretrained(draft_model)
+            if draft_tokenizer.get_vocab() != self.pipe.tokenizer.get_vocab():
+                print(
+                    f"Warning: Draft model {draft_model} does not share the tokenizer "
+                    f"of {self.model}, speculative decoding disabled"
+                )
+                return None
+            draft = draft.to(target.device)
+        except Exception as e:
+            print(
+                f"Warning: Failed to load draft model {draft_model}, "
+                f"speculative decoding disabled: {e}"
+            )
+            return None
+
+        draft.eval()
+        if self.quantization == "int8":
+            quantize_dynamic_int8(draft)
+
+        print(f"Speculative decoding with draft model {draft_model}")
+        return SpeculativeDecoder(target, draft, num_draft_tokens)
+
     def chat(
         self,
         messages: List[Dict[str, Any]],
         max_tokens: int = 256,
         temperature: float = 1.0,
         top_p: float = 1.0,
+        seed: Optional[int] = None,
+        stop: Optional[Union[str, List[str]]] = None,
+        timer: Optional[StageTimer] = None,
+        n: int = 1,
+        json_schema: Optional[Dict[str, Any]] = None,
+        cancellation: Optional[CancellationToken] = None,
         **kwargs,
     ) -> Dict[str, Any]:
         """
-        Generate a chat completion with memory optimization.
+        Generate a chat completion.
+
+        The generation waits until its estimated memory fits in the admission
+        budget, and `max_tokens` is limited to what fits in the context window.
+        With `n` > 1 the prompt is prefilled once and its key/values are shared
+        by `n` continuations sampled in one batch. With a `json_schema` every
+        token that would take the output off the schema is masked, so the
+        completion is JSON matching it unless its finish_reason is "length":
+        cut short by `max_tokens`, or by a point in the schema no token of the
+        vocabulary can continue.
+        Once `cancellation` is set, decoding stops after the current token.
 
         Args:
             messages: List of message dictionaries with 'role' and 'content'
             max_tokens: Maximum tokens to generate
-            temperature: Sampling temperature
+            temperature: Sampling temperature (0 for greedy decoding)
             top_p: Top-p sampling parameter
-            **kwargs: Additional generation parameters
+            seed: Seed of the random generator the completion is sampled from
+            stop: Sequences that end the completion, in addition to the turn markers
+            timer: Receives the time spent per stage. Without one, the stages are
+                timed and reported here.
+            n: Number of completions (choices) to generate
+            json_schema: JSON schema the completion must match
+            cancellation: Token set when the caller no longer wants the completion
+            **kwargs: Additional generation parameters, e.g. a `streamer` that
+                receives the decoded text as it is generated (only with n=1)
 
         Returns:
-            Dictionary with OpenAI-compatible structure
+            Dictionary with OpenAI-compatible structure, including token usage
+            summed over all choices
+
+        Raises:
+            ValueError: If the prompt does not fit the model's context, the
+                request can never fit the admission budget or the schema is
+                not supported
+            AdmissionTimeout: If memory for the request did not free up in time
+            GenerationCancelled: If the request was cancelled
         """
-        # Build conversation prompt
-        prompt = self._build_prompt(messages)
+        if n < 1:
+            raise ValueError("n must be at least 1")
+        if n > 1 and kwargs.get("streamer") is not None:
+            raise ValueError("Streaming supports a single choice only")
+        check_cancelled(cancellation, "chat")
 
-        # Clear cache before generation if using GPU
-        if self.device != "cpu" and torch.cuda.is_available():
-            torch.cuda.empty_cache()
+        owns_timer = timer is None
+        timer = timer or StageTimer()
 
-        try:
-            # Generate response with memory-efficient settings
-            generation_kwargs = {
-                "max_new_tokens": min(
-                    max_tokens, 512
-                ),  # Limit max tokens to prevent OOM
-                "temperature": temperature,
-                "top_p": top_p,
-                "do_sample": True,
-                "pad_token_id": (
-                    self.pipe.tokenizer.eos_token_id if self.pipe.tokenizer else None
-                ),
-                "return_full_text": False,  # Only return generated text
-                **kwargs,
-            }
+        # Build conversation prompt
+        with timer.stage("prompt_build"):
+            prompt_pieces = self._prompt_pieces(messages)
+        stop_sequences = self.stop_sequences(stop)
 
-            # Remove None values
+        try:
             generation_kwargs = {
-                k: v for k, v in generation_kwargs.items() if v is not None
+                "max_new_tokens": max_tokens,
+                **self._generation_kwargs(temperature, top_p, **kwargs),
             }
 
-            response = self.pipe(prompt, **generation_kwargs)
+            hooks = GenerationHooks()
+            if json_schema is not None:
+                with timer.stage("constraint"):
+                    automaton = automaton_cache.get(self.tokenizer, json_schema)
+                hooks.add_processor(lambda: JSONSchemaLogitsProcessor(automaton))
+            if seed is not None and generation_kwargs["do_sample"]:
+                # Samples last, from what the schema allows
+                hooks.add_processor(lambda: self._seeded_sampler([seed], temperature, top_p))
 
-            # Extract generated text
-            if isinstance(response, list) and len(response) > 0:
-                generated_text = response[0].get("generated_text", "")
-            else:
-                generated_text = str(response)
-
-            # Clean up the content
-            new_content = generated_text.strip()
-
-            return {
-                "choices": [
-                    {
-                        "message": {"role": "assistant", "content": new_content},
-                        "finish_reason": "stop",
-                    }
-                ]
-            }
-
-        except torch.cuda.OutOfMemoryError:
-            # If we get OOM during generation, try with smaller max_tokens
-            print("CUDA OOM during generation. Reducing max_tokens and retrying...")
-            torch.cuda.empty_cache()
-            gc.collect()
+            result = self._generate(
+                prompt_pieces, generation_kwargs, stop_sequences, timer, n, cancellation, hooks
+            )
+            if cancellation is not None and cancellation.cancelled:
+                raise GenerationCancelled("Request cancelled during generation")
+            schema_processor = hooks.latest(JSONSchemaLogitsProcessor)
+            if schema_processor is not None and schema_processor.dead_ends:
+                # The schema could not be completed, so the JSON is cut short
+                # just as if it had run out of tokens
+                for index, choice in enumerate(result["choices"]):
+                    if schema_processor.rows == 1 or index in schema_processor.dead_ends:
+                        choice["finish_reason"] = "length"
+            if owns_timer:
+                timer.report(self.model, result["usage"])
+            return result
 
-            try:
-                # Retry with much smaller token limit
-                smaller_kwargs = generation_kwargs.copy()
-                smaller_kwargs["max_new_tokens"] = min(50, max_tokens // 4)
-
-                response = self.pipe(prompt, **smaller_kwargs)
-
-                if isinstance(response, list) and len(response) > 0:
-                    generated_text = response[0].get("generated_text", "")
-                else:
-                    generated_text = str(response)
-
-                return {
-                    "choices": [
-                        {
-                            "message": {
-                                "role": "assistant",
-                                "content": generated_text.strip(),
-                            },
-                            "finish_reason": "length",  # Stopped due to memory constraints
-                        }
-                    ]
-                }
-            except Exception as e:
-                return {
-                    "choices": [
-                        {
-                            "message": {
-                                "role": "assistant",
-                                "content": f"Error: Unable to generate response due to memory constraints - {str(e)}",
-                            },
-                            "finish_reason": "error",
-                        }
-                    ]
-                }
+        except (ValueError, InferenceRejected, GenerationCancelled):
+            # Invalid, rejected (e.g. by admission control) or cancelled requests
+            # are the caller's to report
+            raise
 
         except Exception as e:
             print(f"Error during generation: {e}")
@@ -248,10 +505,642 @@ class OpenAIChat:
                     }
                 ]
             }
+
+    def _generate(
+        self,
+        prompt_pieces: List[str],
+        generation_kwargs: Dict[str, Any],
+        stop_sequences: Optional[List[str]] = None,
+        timer: Optional[StageTimer] = None,
+        n: int = 1,
+        cancellation: Optional[CancellationToken] = None,
+        hooks: Optional[GenerationHooks] = None,
+    ) -> Dict[str, Any]:
+        """
+        Run generation for a single prompt.
+
+        Args:
+            prompt_pieces: The conversation prompt, one piece per message
+            generation_kwargs: Keyword arguments for `generate`
+            stop_sequences: Sequences that end the completion
+            timer: Receives the tokenize, admission, prefill, decode and
+                postprocess stages
+            n: Number of completions. Greedy decoding would produce the same
+                completion every time, so it runs once and is repeated.
+            cancellation: Token that stops decoding after the current token
+            hooks: Logits processors of the generation; the stopping criteria
+                are added here
+
+        Returns:
+            Dictionary with OpenAI-compatible structure, including token usage.
+            A cancelled generation returns what was generated until then.
+
+        Raises:
+            ValueError: If the prompt does not fit the model's context or the
+                request can never fit the admission budget
+            AdmissionTimeout: If memory for the request did not free up in time
+            GenerationCancelled: If the request was cancelled before generation
+        """
+        tokenizer = self.pipe.tokenizer
+        timer = timer or StageTimer()
+
+        with timer.stage("tokenize"):
+            prompt_ids = self.token_cache.encode(prompt_pieces)
+        prompt_length = len(prompt_ids)
+        max_new_tokens = self._fit_context(prompt_length, generation_kwargs["max_new_tokens"])
+
+        rows = n if generation_kwargs.get("do_sample") else 1
+
+        stop_sequences = stop_sequences or []
+        hooks = hooks or GenerationHooks()
+        hooks.add_criterion(FirstTokenClock)
+        if stop_sequences:
+            hooks.add_criterion(
+                lambda: StopOnSequences(tokenizer, prompt_length, [stop_sequences] * rows)
+            )
+        if cancellation is not None:
+            hooks.add_criterion(lambda: StopOnCancel([cancellation]))
+        generation_kwargs = {**generation_kwargs, "max_new_tokens": max_new_tokens}
+
+        reserved = self.estimate_memory(prompt_length, max_new_tokens, batch_size=rows)
+        with timer.stage("admission"):
+            admission_controller.acquire(reserved)
+        try:
+            # The caller may have left while the request waited for memory
+            check_cancelled(cancellation, "chat")
+            if rows > 1:
+                result = self._run_choices(
+                    prompt_ids, rows, generation_kwargs, stop_sequences, hooks, timer
+                )
+            else:
+                result = self._run_generation(
+                    prompt_ids, generation_kwargs, stop_sequences, hooks, timer
+                )
+                result = self._merge_choices([result] * n) if n > 1 else result
         finally:
-            # Clean up after generation
-            if self.device != "cpu" and torch.cuda.is_available():
-                torch.cuda.empty_cache()
+            admission_controller.release(reserved)
+
+        if cancellation is not None and cancellation.cancelled:
+            cancellation_stats.record(
+                "chat", "running", n * max_new_tokens - result["usage"]["completion_tokens"]
+            )
+        return result
+
+    def _run_generation(
+        self,
+        prompt_ids: List[int],
+        generation_kwargs: Dict[str, Any],
+        stop_sequences: List[str],
+        hooks: GenerationHooks,
+        timer: StageTimer,
+    ) -> Dict[str, Any]:
+        """Generate a completion for an admitted prompt"""
+        model = self.pipe.model
+        prompt_length = len(prompt_ids)
+        input_ids = torch.tensor([prompt_ids], device=model.device)
+
+        # Only the part of the prompt not covered by a cached prefix is prefilled
+        started_at = time.perf_counter()
+        _, past_key_values = self._lookup_prefix(prompt_ids)
+
+        if self._use_speculative(generation_kwargs, hooks):
+            tokens, cache = self.speculative.generate(
+                prompt_ids,
+                max_new_tokens=generation_kwargs["max_new_tokens"],
+                eos_token_ids=self._eos_token_ids(),
+                past_key_values=past_key_values,
+                stopping_criteria=hooks.build().get("stopping_criteria"),
+                streamer=generation_kwargs.get("streamer"),
+            )
+            hooks.latest(FirstTokenClock).split(timer, started_at)
+            with timer.stage("postprocess"):
+                self._store_prefix(prompt_ids, cache)
+                return self._build_result(tokens, prompt_length, stop_sequences)
+
+        with torch.inference_mode():
+            output = self._model_generate(
+                hooks,
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past_key_values,
+                return_dict_in_generate=True,
+                **generation_kwargs,
+            )
+        hooks.latest(FirstTokenClock).split(timer, started_at)
+
+        with timer.stage("postprocess"):
+            self._store_prefix(prompt_ids, output.past_key_values)
+            return self._build_result(
+                output.sequences[0, prompt_length:].tolist(), prompt_length, stop_sequences
+            )
+
+    def _run_choices(
+        self,
+        prompt_ids: List[int],
+        n: int,
+        generation_kwargs: Dict[str, Any],
+        stop_sequences: List[str],
+        hooks: GenerationHooks,
+        timer: StageTimer,
+    ) -> Dict[str, Any]:
+        """Sample `n` completions of an admitted prompt from a single prefill"""
+        model = self.pipe.model
+        prompt_length = len(prompt_ids)
+
+        # Prefill the prompt once, up to the last token, which `generate` runs
+        # for every row to produce the first sampled token
+        started_at = time.perf_counter()
+        cached, past_key_values = self._lookup_prefix(prompt_ids)
+        if past_key_values is None:
+            past_key_values = DynamicCache()
+        with torch.inference_mode():
+            if cached < prompt_length - 1:
+                model(
+                    input_ids=torch.tensor([prompt_ids[cached:-1]], device=model.device),
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                )
+            past_key_values.batch_repeat_interleave(n)
+
+            input_ids = torch.tensor([prompt_ids] * n, device=model.device)
+            output = model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past_key_values,
+                return_dict_in_generate=True,
+                **hooks.build(),
+                **generation_kwargs,
+            )
+        hooks.latest(FirstTokenClock).split(timer, started_at)
+
+        with timer.stage("postprocess"):
+            self._store_prefix(prompt_ids, output.past_key_values)
+            return self._merge_choices(
+                [
+                    self._build_result(row.tolist(), prompt_length, stop_sequences)
+                    for row in output.sequences[:, prompt_length:]
+                ]
+            )
+
+    @staticmethod
+    def _merge_choices(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        Combine single-choice results for the same prompt into one result.
+
+        The prompt is counted once and the completion tokens of every choice
+        are added up.
+        """
+        prompt_tokens = results[0]["usage"]["prompt_tokens"]
+        completion_tokens = sum(result["usage"]["completion_tokens"] for result in results)
+        return {
+            "choices": [
+                {"index": index, **result["choices"][0]} for index, result in enumerate(results)
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+            },
+        }
+
+    def estimate_memory(
+        self, prompt_tokens: int, max_new_tokens: int, batch_size: int = 1
+    ) -> int:
+        """
+        Estimate the memory a generation needs besides the weights, in bytes.
+
+        Includes the draft model's key/values when speculative decoding is on.
+        """
+        model = self.pipe.model
+        nbytes = estimate_generation_bytes(
+            model.config, model.dtype, prompt_tokens, max_new_tokens, batch_size
+        )
+        if self.speculative is not None:
+            draft = self.speculative.draft
+            nbytes += estimate_generation_bytes(
+                draft.config, draft.dtype, prompt_tokens, max_new_tokens, batch_size
+            )
+        return nbytes
+
+    def _fit_context(self, prompt_tokens: int, max_new_tokens: int) -> int:
+        """
+        Limit a token budget to what fits in the model's context window.
+
+        Raises:
+            ValueError: If the prompt alone fills the context window
+        """
+        context = getattr(self.pipe.model.config, "max_position_embeddings", None)
+        if not context:
+            return max_new_tokens
+        if prompt_tokens >= context:
+            raise ValueError(
+                f"Prompt is {prompt_tokens} tokens but {self.model} has a "
+                f"context window of {context} tokens"
+            )
+        return min(max_new_tokens, context - prompt_tokens)
+
+    def _use_speculative(
+        self, generation_kwargs: Dict[str, Any], hooks: Optional[GenerationHooks] = None
+    ) -> bool:
+        """Check whether a generation can run on the speculative decoder"""
+        return (
+            self.speculative is not None
+            and not generation_kwargs.get("do_sample")
+            and set(generation_kwargs) <= SPECULATIVE_KWARGS
+            and (hooks is None or not hooks.processors)
+        )
+
+    def _eos_token_ids(self) -> set:
+        """Get every token ID that ends a completion"""
+        eos_token_ids = {self.pipe.tokenizer.eos_token_id}
+        configured = self.pipe.model.generation_config.eos_token_id
+        if isinstance(configured, int):
+            eos_token_ids.add(configured)
+        elif configured:
+            eos_token_ids.update(configured)
+        eos_token_ids.discard(None)
+        return eos_token_ids
+
+    def _model_generate(
+        self, hooks: GenerationHooks, past_key_values: Any = None, **generate_kwargs
+    ) -> Any:
+        """
+        Run `generate`, decoding with the compiled model when compilation is on.
+
+        Compiled decoding needs fixed shapes, so it runs on a static key/value
+        cache of the smallest bucket that holds the prompt and the new tokens;
+        each bucket and batch size is compiled once. Requests that reuse a
+        cached prefix or fit no bucket decode eagerly. Streamed requests wait
+        until compilation is known to work, since a failed compiled attempt
+        would have streamed text already.
+
+        The compiled attempt and the eager fallback each get their own logits
+        processors and stopping criteria from `hooks`, so state left by a
+        failed attempt does not carry over into the one that is returned.
+        """
+        model = self.pipe.model
+        input_ids = generate_kwargs["input_ids"]
+        length = bucket_length(input_ids.shape[1] + generate_kwargs["max_new_tokens"])
+        if (
+            self.compiled is None
+            or past_key_values is not None
+            or length is None
+            or (generate_kwargs.get("streamer") is not None and not self.compiled.verified)
+        ):
+            return model.generate(
+                past_key_values=past_key_values, **hooks.build(), **generate_kwargs
+            )
+
+        def compiled() -> Any:
+            cache = StaticCache(
+                config=model.config, max_batch_size=input_ids.shape[0], max_cache_len=length
+            )
+            return model.generate(
+                past_key_values=cache,
+                compile_config=self._compile_config,
+                **hooks.build(),
+                **generate_kwargs,
+            )
+
+        return self.compiled.run(
+            compiled, lambda: model.generate(**hooks.build(), **generate_kwargs)
+        )
+
+    def _lookup_prefix(self, tokens: List[int], batch_size: int = 1) -> Tuple[int, Any]:
+        """Get cached key/values for the longest known prefix of `tokens`"""
+        if self.prefix_cache is None:
+            return 0, None
+        return self.prefix_cache.lookup(tokens, batch_size=batch_size)
+
+    def _store_prefix(self, tokens: List[int], cache: Any, row: int = 0) -> None:
+        """Remember the key/values of a prompt so later requests can skip its prefill"""
+        if self.prefix_cache is not None and cache is not None:
+            self.prefix_cache.insert(tokens, cache, row=row)
+
+    def _build_result(
+        self,
+        tokens: List[int],
+        prompt_tokens: int,
+        stop_sequences: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Decode generated token IDs into an OpenAI-compatible result.
+
+        Generation is cut at the first end-of-sequence token or stop sequence,
+        which also decides whether the completion stopped naturally or ran out of
+        tokens. The stop sequence itself is not part of the content.
+        """
+        tokenizer = self.pipe.tokenizer
+
+        finish_reason = "length"
+        if tokenizer.eos_token_id in tokens:
+            tokens = tokens[: tokens.index(tokenizer.eos_token_id)]
+            finish_reason = "stop"
+
+        content = tokenizer.decode(tokens, skip_special_tokens=True)
+        stop_index = find_stop_sequence(content, stop_sequences or [])
+        if stop_index is not None:
+            content = content[:stop_index]
+            tokens = tokens[: self._tokens_until_stop(tokens, stop_sequences)]
+            finish_reason = "stop"
+        content = content.strip()
+        return {
+            "choices": [
+                {
+                    "message": {"role": "assistant", "content": content},
+                    "finish_reason": finish_reason,
+                }
+            ],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": len(tokens),
+                "total_tokens": prompt_tokens + len(tokens),
+            },
+        }
+
+    def _tokens_until_stop(self, tokens: List[int], stop_sequences: List[str]) -> int:
+        """Get how many tokens were generated up to and including a stop sequence"""
+        tokenizer = self.pipe.tokenizer
+        low, high = 1, len(tokens)
+        while low < high:
+            middle = (low + high) // 2
+            text = tokenizer.decode(tokens[:middle], skip_special_tokens=True)
+            if find_stop_sequence(text, stop_sequences) is None:
+                low = middle + 1
+            else:
+                high = middle
+        return high
+
+    def stop_sequences(self, stop: Optional[Union[str, List[str]]] = None) -> List[str]:
+        """
+        Get the sequences that end a completion: the transcript's turn markers plus
+        any requested by the caller.
+        """
+        if isinstance(stop, str):
+            stop = [stop]
+        sequences = []
+        for sequence in TURN_MARKERS + list(stop or []):
+            if sequence and sequence not in sequences:
+                sequences.append(sequence)
+        return sequences
+
+    def count_prompt_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        """Count the tokens of the prompt built from `messages`"""
+        return len(self.token_cache.encode(self._prompt_pieces(messages)))
+
+    def chat_batch(
+        self,
+        batch: List[List[Dict[str, Any]]],
+        max_tokens: Union[int, List[int]] = 256,
+        temperature: float = 1.0,
+        top_p: float = 1.0,
+        seed: Optional[int] = None,
+        stop: Optional[List[Optional[Union[str, List[str]]]]] = None,
+        timers: Optional[List[Optional[StageTimer]]] = None,
+        cancellations: Optional[List[Optional[CancellationToken]]] = None,
+        **kwargs,
+    ) -> List[Dict[str, Any]]:
+        """
+        Generate chat completions for several conversations in one batched generate call.
+
+        All conversations share the sampling settings; each one keeps its own token budget.
+        A cancelled conversation stops decoding after the current token while the
+        others carry on; its result holds what was generated until then.
+
+        Args:
+            batch: List of conversations, each a list of message dictionaries
+            max_tokens: Maximum tokens to generate, either shared or one per conversation
+            temperature: Sampling temperature (0 for greedy decoding)
+            top_p: Top-p sampling parameter
+            seed: Seed of the random generator the completion is sampled from
+            stop: Stop sequences of each conversation, in addition to the turn markers
+            timers: Timer of each conversation; every one receives the stages of
+                the whole batch
+            cancellations: Cancellation token of each conversation
+            **kwargs: Additional generation parameters
+
+        Returns:
+            One OpenAI-compatible dictionary per conversation, in input order
+        """
+        cancellations = cancellations or [None] * len(batch)
+        if isinstance(max_tokens, int):
+            max_tokens = [max_tokens] * len(batch)
+        stop_sequences = [self.stop_sequences(row) for row in stop or [None] * len(batch)]
+        batch_timer = StageTimer()
+
+        # A lone greedy conversation gains more from speculative decoding than
+        # from the batched path
+        if len(batch) == 1:
+            generation_kwargs = {
+                "max_new_tokens": max_tokens[0],
+                **self._generation_kwargs(temperature, top_p, **kwargs),
+            }
+            if self._use_speculative(generation_kwargs):
+                with batch_timer.stage("prompt_build"):
+                    prompt_pieces = self._prompt_pieces(batch[0])
+                result = self._generate(
+                    prompt_pieces,
+                    generation_kwargs,
+                    stop_sequences[0],
+                    batch_timer,
+                    cancellation=cancellations[0],
+                )
+                self._share_timings(batch_timer, timers)
+                return [result]
+
+        with batch_timer.stage("prompt_build"):
+            prompt_pieces = [self._prompt_pieces(messages) for messages in batch]
+        with batch_timer.stage("tokenize"):
+            prompt_ids = [self.token_cache.encode(pieces) for pieces in prompt_pieces]
+
+        max_tokens = [
+            self._fit_context(len(ids), limit) for ids, limit in zip(prompt_ids, max_tokens)
+        ]
+        if all(token is not None and token.cancelled for token in cancellations):
+            # Nobody is waiting for the batch any more
+            for _ in batch:
+                cancellation_stats.record("chat", "queued")
+            self._share_timings(batch_timer, timers)
+            return [self._build_result([], len(ids)) for ids in prompt_ids]
+        reserved = self.estimate_memory(
+            max(len(ids) for ids in prompt_ids), max(max_tokens), batch_size=len(batch)
+        )
+
+        # A batch too large for the memory budget as a whole runs in halves
+        if len(batch) > 1 and not admission_controller.fits(reserved):
+            self._share_timings(batch_timer, timers)
+            half = len(batch) // 2
+            stop = stop or [None] * len(batch)
+            timers = timers or [None] * len(batch)
+            return [
+                result
+                for rows in (slice(None, half), slice(half, None))
+                for result in self.chat_batch(
+                    batch[rows],
+                    max_tokens[rows],
+                    temperature,
+                    top_p,
+                    seed,
+                    stop=stop[rows],
+                    timers=timers[rows],
+                    cancellations=cancellations[rows],
+                    **kwargs,
+                )
+            ]
+
+        with batch_timer.stage("admission"):
+            admission_controller.acquire(reserved)
+        try:
+            results = self._run_batch(
+                prompt_ids,
+                max_tokens,
+                temperature,
+                top_p,
+                seed,
+                stop_sequences,
+                batch_timer,
+                cancellations,
+                **kwargs,
+            )
+        finally:
+            admission_controller.release(reserved)
+
+        for token, limit, result in zip(cancellations, max_tokens, results):
+            if token is not None and token.cancelled:
+                cancellation_stats.record(
+                    "chat", "running", limit - result["usage"]["completion_tokens"]
+                )
+
+        self._share_timings(batch_timer, timers)
+        return results
+
+    def _run_batch(
+        self,
+        prompt_ids: List[List[int]],
+        max_tokens: List[int],
+        temperature: float,
+        top_p: float,
+        seed: Optional[int],
+        stop_sequences: List[List[str]],
+        batch_timer: StageTimer,
+        cancellations: List[Optional[CancellationToken]],
+        **kwargs,
+    ) -> List[Dict[str, Any]]:
+        """Generate completions for tokenized prompts admitted together"""
+        tokenizer = self.pipe.tokenizer
+        model = self.pipe.model
+        started_at = time.perf_counter()
+
+        # Rows share the key/values of their longest common cached prefix. It is
+        # placed first in every row and the remaining suffixes are left-padded
+        # after it; position IDs follow the attention mask, so padding in the
+        # middle does not shift positions.
+        common = self._common_prefix_length(prompt_ids)
+        shortest = min(len(ids) for ids in prompt_ids)
+        probe = prompt_ids[0][: common + 1] if common < shortest else prompt_ids[0][:common]
+        cached, past_key_values = self._lookup_prefix(probe, batch_size=len(prompt_ids))
+
+        suffix_length = max(len(ids) for ids in prompt_ids) - cached
+        rows, masks = [], []
+        for ids in prompt_ids:
+            padding = suffix_length - (len(ids) - cached)
+            rows.append(ids[:cached] + [tokenizer.pad_token_id] * padding + ids[cached:])
+            masks.append([1] * cached + [0] * padding + [1] * (len(ids) - cached))
+        input_ids = torch.tensor(rows, device=model.device)
+        attention_mask = torch.tensor(masks, device=model.device)
+        prompt_length = input_ids.shape[1]
+
+        generation_kwargs = self._generation_kwargs(temperature, top_p, **kwargs)
+        hooks = GenerationHooks()
+        if seed is not None and generation_kwargs["do_sample"]:
+            hooks.add_processor(
+                lambda: self._seeded_sampler([seed] * len(prompt_ids), temperature, top_p)
+            )
+
+        hooks.add_criterion(FirstTokenClock)
+        hooks.add_criterion(lambda: MaxNewTokensPerRow(prompt_length, max_tokens))
+        hooks.add_criterion(lambda: StopOnSequences(tokenizer, prompt_length, stop_sequences))
+        if any(token is not None for token in cancellations):
+            hooks.add_criterion(lambda: StopOnCancel(cancellations))
+        with torch.inference_mode():
+            output = self._model_generate(
+                hooks,
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                past_key_values=past_key_values,
+                return_dict_in_generate=True,
+                max_new_tokens=max(max_tokens),
+                **generation_kwargs,
+            )
+        hooks.latest(FirstTokenClock).split(batch_timer, started_at)
+
+        with batch_timer.stage("postprocess"):
+            # Unpadded rows hold their whole prompt contiguously and can be stored
+            for row, ids in enumerate(prompt_ids):
+                if len(ids) == prompt_length:
+                    self._store_prefix(ids, output.past_key_values, row=row)
+                    break
+
+            results = []
+            for row, limit, ids, stops in zip(
+                output.sequences[:, prompt_length:], max_tokens, prompt_ids, stop_sequences
+            ):
+                results.append(self._build_result(row[:limit].tolist(), len(ids), stops))
+        return results
+
+    @staticmethod
+    def _share_timings(
+        batch_timer: StageTimer, timers: Optional[List[Optional[StageTimer]]]
+    ) -> None:
+        """Add the stages of a batch to the timer of every request in it"""
+        for timer in timers or []:
+            if timer is not None:
+                timer.merge(batch_timer)
+
+    @staticmethod
+    def _common_prefix_length(sequences: List[List[int]]) -> int:
+        """Get the length of the longest prefix shared by all token sequences"""
+        first = sequences[0]
+        length = min(len(ids) for ids in sequences)
+        for ids in sequences[1:]:
+            position = 0
+            while position < length and ids[position] == first[position]:
+                position += 1
+            length = position
+        return length
+
+    def _generation_kwargs(
+        self, temperature: float, top_p: float, **kwargs
+    ) -> Dict[str, Any]:
+        """
+        Build `generate` keyword arguments for the given sampling settings.
+
+        A temperature of 0 selects greedy decoding.
+        """
+        tokenizer = self.pipe.tokenizer
+        generation_kwargs: Dict[str, Any] = {
+            "pad_token_id": tokenizer.pad_token_id if tokenizer else None,
+        }
+        if temperature and temperature > 0:
+            generation_kwargs.update(
+                {"do_sample": True, "temperature": temperature, "top_p": top_p}
+            )
+        else:
+            generation_kwargs["do_sample"] = False
+        generation_kwargs.update(kwargs)
+
+        # Remove None values
+        return {k: v for k, v in generation_kwargs.items() if v is not None}
+
+    def _seeded_sampler(
+        self, seeds: List[int], temperature: float, top_p: float
+    ) -> SeededSampler:
+        """
+        Build the sampler of seeded requests, with the model's default top-k
+        so they sample from the same distribution as unseeded ones.
+        """
+        top_k = self.pipe.model.generation_config.top_k
+        return SeededSampler(seeds, temperature, top_p, top_k)
 
     def _build_prompt(self, messages: List[Dict[str, Any]]) -> str:
         """
@@ -263,6 +1152,21 @@ class OpenAIChat:
         Returns:
             Formatted prompt string
         """
+        return "".join(self._prompt_pieces(messages))
+
+    def _prompt_pieces(self, messages: List[Dict[str, Any]]) -> List[str]:
+        """
+        Build a conversation prompt from messages, one piece per message.
+
+        The pieces joined together are the prompt; keeping them apart lets the
+        token cache reuse the tokens of messages it has seen before.
+
+        Args:
+            messages: List of message dictionaries
+
+        Returns:
+            Prompt pieces, each but the first starting with a newline
+        """
         prompt_parts = []
 
         for msg in messages:
@@ -279,9 +1183,10 @@ class OpenAIChat:
                 function_name = msg.get("name", "unknown")
                 prompt_parts.append(f"Function {function_name}: {content}")
 
+        pieces = [part if i == 0 else f"\n{part}" for i, part in enumerate(prompt_parts)]
         # Add prompt for assistant response
-        prompt = "\n".join(prompt_parts) + "\nAssistant:"
-        return prompt
+        pieces.append("\nAssistant:")
+        return pieces
 
     @classmethod
     def get_available_models(cls) -> List[str]:
@@ -0,0 +1,273 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import torch
+from transformers import DynamicCache
+from transformers.cache_utils import DynamicLayer
+
+# Per-layer (key, value) tensors shaped [1, num_heads, seq_len, head_dim]
+KeyValues = List[Tuple[torch.Tensor, torch.Tensor]]
+
+
+class _PrefixEntry:
+    """Key/values stored for one token sequence"""
+
+    def __init__(self, node: "_RadixNode", key_values: KeyValues, length: int):
+        self.node = node
+        self.key_values = key_values
+        self.length = length
+        self.nbytes = sum(
+            k.numel() * k.element_size() + v.numel() * v.element_size()
+            for k, v in key_values
+        )
+
+
+class _RadixNode:
+    """Radix tree node; `tokens` is the label of the edge leading to it"""
+
+    def __init__(self, tokens: Tuple[int, ...] = (), parent: Optional["_RadixNode"] = None):
+        self.tokens = tokens
+        self.parent = parent
+        self.children: Dict[int, "_RadixNode"] = {}
+        self.entry: Optional[_PrefixEntry] = None
+
+
+class PrefixCache:
+    """
+    Radix tree of past key/values keyed on prompt token IDs.
+
+    Every stored sequence keeps the key/values of all its tokens, so a lookup
+    can reuse any stored sequence that shares a prefix with the new prompt: the
+    shared part is cut from the stored tensors and only the unseen suffix has to
+    be prefilled. Entries are evicted least recently used first once the stored
+    tensors exceed `max_bytes`.
+    """
+
+    def __init__(self, max_bytes: int, min_prefix_tokens: int = 8):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes: Memory budget for stored key/values
+            min_prefix_tokens: Shorter matches are not worth reusing
+        """
+        self.max_bytes = max_bytes
+        self.min_prefix_tokens = min_prefix_tokens
+
+        self._lock = threading.Lock()
+        self._root = _RadixNode()
+        self._entries: "OrderedDict[int, _PrefixEntry]" = OrderedDict()
+        self._bytes = 0
+
+        self.stats = {
+            "lookups": 0,
+            "hits": 0,
+            "tokens_saved": 0,
+            "insertions": 0,
+            "evictions": 0,
+        }
+
+    def lookup(
+        self, tokens: Sequence[int], batch_size: int = 1
+    ) -> Tuple[int, Optional[DynamicCache]]:
+        """
+        Find the longest stored prefix of `tokens`.
+
+        At least one token is always left uncached so the model has something to
+        run on and produce logits for.
+
+        Args:
+            tokens: Prompt token IDs
+            batch_size: Number of rows the returned cache is expanded to
+
+        Returns:
+            Tuple of (number of cached tokens, cache holding their key/values),
+            or (0, None) on a miss
+        """
+        with self._lock:
+            self.stats["lookups"] += 1
+
+            matched, entry = self._match(tokens[:-1])
+            if entry is None or matched < self.min_prefix_tokens:
+                return 0, None
+
+            self._entries.move_to_end(id(entry))
+            self.stats["hits"] += 1
+            self.stats["tokens_saved"] += matched * batch_size
+
+            # Views into the stored tensors; generation concatenates onto them
+            # and never writes in place, so entries stay intact
+            cache = DynamicCache(
+                ddp_cache_data=[
+                    (
+                        k[..., :matched, :].expand(batch_size, -1, -1, -1),
+                        v[..., :matched, :].expand(batch_size, -1, -1, -1),
+                    )
+                    for k, v in entry.key_values
+                ]
+            )
+            return matched, cache
+
+    def insert(self, tokens: Sequence[int], cache: Any, row: int = 0) -> bool:
+        """
+        Store the key/values of `tokens` taken from a generation cache.
+
+        Args:
+            tokens: Token IDs whose key/values are the first `len(tokens)`
+                positions of `cache`
+            cache: The `past_key_values` returned by generation
+            row: Batch row of `cache` to store
+
+        Returns:
+            True if the sequence was stored
+        """
+        if len(tokens) < self.min_prefix_tokens:
+            return False
+
+        key_values = self.extract(cache, len(tokens), row)
+        if key_values is None:
+            return False
+
+        with self._lock:
+            node = self._insert_node(tuple(tokens))
+            if node.entry is not None:
+                self._entries.move_to_end(id(node.entry))
+                return False
+
+            entry = _PrefixEntry(node, key_values, len(tokens))
+            if entry.nbytes > self.max_bytes:
+                self._prune(node)
+                return False
+
+            node.entry = entry
+            self._entries[id(entry)] = entry
+            self._bytes += entry.nbytes
+            self.stats["insertions"] += 1
+
+            while self._bytes > self.max_bytes:
+                _, oldest = self._entries.popitem(last=False)
+                self._remove_entry(oldest)
+                self.stats["evictions"] += 1
+
+        return True
+
+    @staticmethod
+    def extract(cache: Any, length: int, row: int = 0) -> Optional[KeyValues]:
+        """
+        Copy the first `length` positions of one row out of a generation cache.
+
+        Only full-attention dynamic caches can be cut at an arbitrary position;
+        anything else (sliding window, static or quantized caches) is skipped.
+        """
+        layers = getattr(cache, "layers", None)
+        if not isinstance(cache, DynamicCache) or not layers:
+            return None
+        if any(type(layer) is not DynamicLayer or layer.keys is None for layer in layers):
+            return None
+        if cache.get_seq_length() < length:
+            return None
+
+        return [
+            (
+                layer.keys[row : row + 1, :, :length, :].clone(),
+                layer.values[row : row + 1, :, :length, :].clone(),
+            )
+            for layer in layers
+        ]
+
+    def clear(self) -> None:
+        """Drop all stored key/values"""
+        with self._lock:
+            self._root = _RadixNode()
+            self._entries.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit-rate, tokens-saved and memory counters"""
+        with self._lock:
+            lookups = self.stats["lookups"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+    def _match(self, tokens: Sequence[int]) -> Tuple[int, Optional[_PrefixEntry]]:
+        """Walk the tree as far as `tokens` matches and pick an entry below that point"""
+        node = self._root
+        matched = 0
+        while matched < len(tokens):
+            child = node.children.get(tokens[matched])
+            if child is None:
+                break
+            edge = child.tokens
+            common = 0
+            while (
+                common < len(edge)
+                and matched + common < len(tokens)
+                and edge[common] == tokens[matched + common]
+            ):
+                common += 1
+            matched += common
+            node = child
+            if common < len(edge):
+                break
+
+        if matched == 0:
+            return 0, None
+
+        # Any sequence stored at or below `node` starts with the matched tokens
+        stack = [node]
+        while stack:
+            candidate = stack.pop()
+            if candidate.entry is not None:
+                return matched, candidate.entry
+            stack.extend(candidate.children.values())
+        return 0, None
+
+    def _insert_node(self, tokens: Tuple[int, ...]) -> _RadixNode:
+        node = self._root
+        position = 0
+        while position < len(tokens):
+            child = node.children.get(tokens[position])
+            if child is None:
+                leaf = _RadixNode(tokens[position:], node)
+                node.children[tokens[position]] = leaf
+                return leaf
+
+            edge = child.tokens
+            common = 0
+            while (
+                common < len(edge)
+                and position + common < len(tokens)
+                and edge[common] == tokens[position + common]
+            ):
+                common += 1
+
+            if common < len(edge):
+                # Split the edge so the shared part gets its own node
+                middle = _RadixNode(edge[:common], node)
+                node.children[edge[0]] = middle
+                child.tokens = edge[common:]
+                child.parent = middle
+                middle.children[child.tokens[0]] = child
+                child = middle
+
+            node = child
+            position += common
+        return node
+
+    def _remove_entry(self, entry: _PrefixEntry) -> None:
+        self._bytes -= entry.nbytes
+        entry.node.entry = None
+        self._prune(entry.node)
+
+    def _prune(self, node: _RadixNode) -> None:
+        """Remove nodes that no longer lead to any stored sequence"""
+        while node is not self._root and node.entry is None and not node.children:
+            parent = node.parent
+            del parent.children[node.tokens[0]]
+            node = parent
@@ -0,0 +1,75 @@
+import warnings
+
+import torch
+from torch import nn
+
+# Supported values of OpenAIChat(quantization=...)
+QUANTIZATION_MODES = ("int8", "bf16")
+
+
+def cpu_supports_bf16() -> bool:
+    """Check whether the CPU has native bfloat16 matmul support (AVX512-BF16 / AMX)"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def convert_conv1d_to_linear(model: nn.Module) -> int:
+    """
+    Replace transformers' Conv1D layers (GPT-2 family) with equivalent nn.Linear.
+
+    Conv1D is a linear layer with a transposed weight; dynamic quantization only
+    recognises nn.Linear, so it has to be converted first.
+
+    Returns:
+        Number of replaced layers
+    """
+    from transformers.pytorch_utils import Conv1D
+
+    replaced = 0
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if not isinstance(child, Conv1D):
+                continue
+            in_features, out_features = child.weight.shape
+            linear = nn.Linear(
+                in_features,
+                out_features,
+                bias=child.bias is not None,
+                device=child.weight.device,
+                dtype=child.weight.dtype,
+            )
+            with torch.no_grad():
+                linear.weight.copy_(child.weight.t())
+                if child.bias is not None:
+                    linear.bias.copy_(child.bias)
+            setattr(parent, name, linear)
+            replaced += 1
+    return replaced
+
+
+def quantize_dynamic_int8(model: nn.Module) -> nn.Module:
+    """
+    Apply int8 dynamic quantization to the Linear layers of a causal LM in place.
+
+    Weights are stored as int8 and activations are quantized on the fly, which
+    roughly quarters the weight memory of those layers and uses int8 matmuls on
+    CPU. The output projection is left in full precision: it is usually tied to
+    the input embeddings and is the most sensitive layer for output quality.
+    """
+    convert_conv1d_to_linear(model)
+
+    output_embeddings = model.get_output_embeddings()
+    qconfig_spec = {
+        name: torch.ao.quantization.default_dynamic_qconfig
+        for name, module in model.named_modules()
+        if isinstance(module, nn.Linear) and module is not output_embeddings
+    }
+
+    with warnings.catch_warnings():
+        # torch.ao eager quantization warns about its migration to torchao
+        warnings.simplefilter("ignore")
+        return torch.ao.quantization.quantize_dynamic(
+            model, qconfig_spec, dtype=torch.qint8, inplace=True
+        )
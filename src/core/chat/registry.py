@@ -0,0 +1,291 @@
+import gc
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Union
+
+import torch
+
+from config.inference import (
+    DRAFT_MODELS,
+    INFERENCE_WORKERS,
+    MODEL_MEMORY_BUDGET_MB,
+    MODEL_QUANTIZATION,
+)
+from core.chat.openai import OpenAIChat
+from core.inference.metrics import metrics
+from core.inference.workers import WorkerPool
+
+
+def model_resident_bytes(chat: Union[OpenAIChat, WorkerPool]) -> int:
+    """
+    Estimate the memory held by a loaded chat model's weights and buffers.
+
+    Includes the draft model used for speculative decoding, if any. Tied tensors
+    (e.g. GPT-2's shared embedding / lm_head) are only counted once.
+    Dynamically quantized layers store their packed weights as a tuple, which is
+    unpacked so int8 weights are counted at their real size. A worker pool
+    counts its shared weights once.
+    """
+    if isinstance(chat, WorkerPool):
+        return chat.resident_bytes()
+
+    seen = set()
+    total = 0
+    values = list(chat.pipe.model.state_dict().values())
+    if chat.speculative is not None:
+        values.extend(chat.speculative.draft.state_dict().values())
+    while values:
+        value = values.pop()
+        if isinstance(value, (tuple, list)):
+            values.extend(value)
+            continue
+        if not isinstance(value, torch.Tensor):
+            continue
+        key = (value.device, value.data_ptr())
+        if key in seen:
+            continue
+        seen.add(key)
+        total += value.numel() * value.element_size()
+    return total
+
+
+class ModelRegistry:
+    """
+    Process-wide cache of loaded OpenAIChat instances.
+
+    Each model is loaded once and the same instance is handed to every caller.
+    Concurrent callers asking for a model that is still loading wait for that
+    load instead of starting their own. When a memory budget is set, the least
+    recently used models are evicted until the resident size fits again.
+    """
+
+    def __init__(self, memory_budget_mb: Optional[float] = None):
+        """
+        Initialize the registry.
+
+        Args:
+            memory_budget_mb: Maximum resident size of all loaded models in MB.
+                Defaults to DEGEN_MODEL_MEMORY_BUDGET_MB; 0 or None disables eviction.
+        """
+        if memory_budget_mb is None:
+            memory_budget_mb = MODEL_MEMORY_BUDGET_MB
+        self.memory_budget_bytes = int(memory_budget_mb * 1024**2)
+
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._models: "OrderedDict[str, OpenAIChat]" = OrderedDict()
+        self._options: Dict[str, Dict[str, Any]] = {}
+        for model, mode in MODEL_QUANTIZATION.items():
+            self._options.setdefault(model, {})["quantization"] = mode
+        for model, draft_model in DRAFT_MODELS.items():
+            self._options.setdefault(model, {})["draft_model"] = draft_model
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        metrics.describe("model_load_seconds", "Time model loads spent in each stage")
+
+    def configure(self, model: str, **options) -> None:
+        """
+        Set OpenAIChat keyword arguments used the next time `model` is loaded.
+
+        Options are merged into those already set for the model (including the
+        quantization mode and draft model from DEGEN_MODEL_QUANTIZATION and
+        DEGEN_DRAFT_MODELS); pass None to unset one. `workers` overrides
+        DEGEN_INFERENCE_WORKERS for the model.
+        Already loaded instances are not affected until they are evicted.
+        """
+        with self._lock:
+            merged = {**self._options.get(model, {}), **options}
+            self._options[model] = {
+                key: value for key, value in merged.items() if value is not None
+            }
+
+    def get(self, model: str) -> Union[OpenAIChat, WorkerPool]:
+        """
+        Return the shared OpenAIChat for `model`, loading it on first use.
+
+        Args:
+            model: The model name to load
+
+        Returns:
+            The shared OpenAIChat instance, or a WorkerPool serving the model
+            from worker processes when workers are configured
+        """
+        with self._lock:
+            chat = self._hit(model)
+            if chat is not None:
+                return chat
+            load_lock = self._load_locks.setdefault(model, threading.Lock())
+
+        with load_lock:
+            # Another caller may have finished loading while we were waiting
+            with self._lock:
+                chat = self._hit(model)
+                if chat is not None:
+                    return chat
+                options = dict(self._options.get(model, {}))
+
+            start = time.perf_counter()
+            workers = options.pop("workers", INFERENCE_WORKERS)
+            if workers > 0:
+                chat = WorkerPool(model, num_workers=workers, **options)
+            else:
+                chat = OpenAIChat(model=model, **options)
+            load_time = time.perf_counter() - start
+            resident_bytes = model_resident_bytes(chat)
+
+            with self._lock:
+                stats = self._get_stats(model)
+                stats["misses"] += 1
+                stats["loads"] += 1
+                stats["last_load_time_s"] = load_time
+                stats["total_load_time_s"] += load_time
+                stats["resident_bytes"] = resident_bytes
+                stats["last_load_stages"] = dict(chat.load_timer.stages)
+                stats["loaded_model"] = chat.model
+                stats["quantization"] = chat.quantization
+                stats["last_used"] = time.time()
+                self._models[model] = chat
+                evicted = self._evict_over_budget(keep=model)
+
+            if evicted:
+                self._release_memory()
+
+            for stage, seconds in chat.load_timer.stages.items():
+                metrics.observe("model_load_seconds", seconds, {"model": model, "stage": stage})
+            metrics.observe("model_load_seconds", load_time, {"model": model, "stage": "total"})
+            stages = " ".join(
+                f"{stage}={seconds:.2f}s" for stage, seconds in chat.load_timer.stages.items()
+            )
+            print(
+                f"Model registry loaded {model} in {load_time:.2f}s "
+                f"({resident_bytes / 1024**2:.1f} MB resident; {stages})"
+            )
+            return chat
+
+    def evict(self, model: str) -> bool:
+        """
+        Drop a loaded model from the registry.
+
+        Callers still holding the instance keep using it; memory is reclaimed once
+        they release it.
+
+        Returns:
+            True if the model was loaded and has been evicted
+        """
+        with self._lock:
+            evicted = self._remove(model)
+        if evicted:
+            self._release_memory()
+        return evicted
+
+    def clear(self) -> None:
+        """Evict every loaded model"""
+        with self._lock:
+            for model in list(self._models):
+                self._remove(model)
+        self._release_memory()
+
+    def loaded_models(self) -> List[str]:
+        """Get the loaded models, least recently used first"""
+        with self._lock:
+            return list(self._models)
+
+    def resident_bytes(self) -> int:
+        """Get the total resident size of all loaded models"""
+        with self._lock:
+            return self._resident_bytes()
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get registry statistics.
+
+        Returns:
+            Dictionary with the memory budget, total resident size and
+            per-model hits, misses, load times (with the last load's stages),
+            resident size, quantization mode, prefix cache, token cache,
+            speculative decoding, compiled execution and worker pool counters
+        """
+        with self._lock:
+            models = {}
+            for model, stats in self._stats.items():
+                models[model] = {**stats, "loaded": model in self._models}
+                chat = self._models.get(model)
+                if chat is not None and chat.prefix_cache is not None:
+                    models[model]["prefix_cache"] = chat.prefix_cache.get_stats()
+                if chat is not None and chat.token_cache is not None:
+                    models[model]["token_cache"] = chat.token_cache.get_stats()
+                if chat is not None and chat.speculative is not None:
+                    models[model]["speculative"] = chat.speculative.get_stats()
+                if chat is not None and chat.compiled is not None:
+                    models[model]["compile"] = chat.compiled.get_stats()
+                if isinstance(chat, WorkerPool):
+                    models[model]["workers"] = chat.get_stats()
+            return {
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "resident_bytes": self._resident_bytes(),
+                "models": models,
+            }
+
+    def _hit(self, model: str) -> Optional[OpenAIChat]:
+        chat = self._models.get(model)
+        if chat is None:
+            return None
+        self._models.move_to_end(model)
+        stats = self._get_stats(model)
+        stats["hits"] += 1
+        stats["last_used"] = time.time()
+        return chat
+
+    def _get_stats(self, model: str) -> Dict[str, Any]:
+        if model not in self._stats:
+            self._stats[model] = {
+                "hits": 0,
+                "misses": 0,
+                "loads": 0,
+                "evictions": 0,
+                "last_load_time_s": 0.0,
+                "last_load_stages": {},
+                "total_load_time_s": 0.0,
+                "resident_bytes": 0,
+                "loaded_model": None,
+                "quantization": None,
+                "last_used": None,
+            }
+        return self._stats[model]
+
+    def _resident_bytes(self) -> int:
+        return sum(self._stats[model]["resident_bytes"] for model in self._models)
+
+    def _evict_over_budget(self, keep: str) -> List[str]:
+        evicted = []
+        if not self.memory_budget_bytes:
+            return evicted
+
+        for model in list(self._models):
+            if self._resident_bytes() <= self.memory_budget_bytes:
+                break
+            if model == keep:
+                continue
+            self._remove(model)
+            evicted.append(model)
+            print(f"Model registry evicted {model} to stay within memory budget")
+
+        return evicted
+
+    def _remove(self, model: str) -> bool:
+        chat = self._models.pop(model, None)
+        if chat is None:
+            return False
+        if isinstance(chat, WorkerPool):
+            chat.close()
+        self._get_stats(model)["evictions"] += 1
+        return True
+
+    def _release_memory(self) -> None:
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+# Shared registry used by the API
+model_registry = ModelRegistry()
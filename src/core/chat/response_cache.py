@@ -0,0 +1,150 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from config.inference import (
+    COMPLETION_CACHE_DB,
+    COMPLETION_CACHE_SIZE,
+    COMPLETION_CACHE_TTL_S,
+)
+from database.completion_cache import CompletionCacheDB
+from model.chat_completions import ChatCompletionRequest, ChatCompletionResponse
+
+# Request fields that do not change the generated completion
+_NON_SEMANTIC_FIELDS = {"stream"}
+
+
+class CompletionCache:
+    """
+    Exact-match cache of chat completion responses.
+
+    Only deterministic requests are cached: greedy decoding (temperature 0) or
+    a fixed seed. Responses live in an in-memory LRU tier and, when a database
+    is configured, in a persistent SQLite tier that also survives restarts.
+    Both tiers expire entries after `ttl_s` seconds.
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl_s: Optional[float] = None,
+        db: Optional[CompletionCacheDB] = None,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            max_entries: Size of the in-memory tier. Defaults to DEGEN_COMPLETION_CACHE_SIZE;
+                0 disables caching.
+            ttl_s: Time to live of an entry. Defaults to DEGEN_COMPLETION_CACHE_TTL_S.
+            db: Persistent tier. Defaults to one at DEGEN_COMPLETION_CACHE_DB when set.
+        """
+        self.max_entries = COMPLETION_CACHE_SIZE if max_entries is None else max_entries
+        self.ttl_s = COMPLETION_CACHE_TTL_S if ttl_s is None else ttl_s
+        if db is None and COMPLETION_CACHE_DB:
+            db = CompletionCacheDB(COMPLETION_CACHE_DB)
+        self.db = db
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+        self.stats = {"hits": 0, "memory_hits": 0, "db_hits": 0, "misses": 0, "stores": 0}
+
+    @staticmethod
+    def is_cacheable(request: ChatCompletionRequest) -> bool:
+        """Check whether a request always produces the same completion"""
+        return request.seed is not None or request.temperature == 0
+
+    @staticmethod
+    def make_key(request: ChatCompletionRequest) -> str:
+        """
+        Hash the fields of a request that affect its completion.
+
+        The request is dumped with defaults filled in and keys sorted, so
+        equivalent requests hash the same regardless of how they were written.
+        """
+        payload = request.model_dump(mode="json", exclude=_NON_SEMANTIC_FIELDS)
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or self.db is not None
+
+    def get(self, key: str) -> Optional[ChatCompletionResponse]:
+        """
+        Look up a cached response.
+
+        Returns:
+            The cached response, or None if missing or expired
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, payload = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    self.stats["memory_hits"] += 1
+                    return ChatCompletionResponse.model_validate_json(payload)
+                del self._entries[key]
+
+        if self.db is not None:
+            row = self.db.get_response(key)
+            if row is not None:
+                payload, expires_at = row
+                with self._lock:
+                    # Promote to memory for the rest of its lifetime
+                    self._store_memory(key, expires_at, payload)
+                    self.stats["hits"] += 1
+                    self.stats["db_hits"] += 1
+                return ChatCompletionResponse.model_validate_json(payload)
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def set(self, key: str, response: ChatCompletionResponse) -> None:
+        """Store a response in every configured tier"""
+        payload = response.model_dump_json()
+        expires_at = time.time() + self.ttl_s
+
+        with self._lock:
+            self._store_memory(key, expires_at, payload)
+            self.stats["stores"] += 1
+
+        if self.db is not None:
+            self.db.set_response(key, payload, expires_at)
+
+    def clear(self) -> None:
+        """Drop the in-memory tier"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and the in-memory tier size"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "persistent": self.db is not None,
+            }
+
+    def _store_memory(self, key: str, expires_at: float, payload: str) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = (expires_at, payload)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+# Shared cache used by the API
+completion_cache = CompletionCache()
@@ -0,0 +1,74 @@
+from typing import List, Optional
+
+import torch
+from transformers import (
+    LogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+
+
+class SeededSampler(LogitsProcessor):
+    """
+    Sample the next token of seeded requests from their own random generators.
+
+    `generate` samples from torch's global generator, which every thread and
+    every row of a batch draws from, so seeding it cannot make a request
+    reproducible. This processor instead draws each row's token from a
+    generator seeded for its request and masks every other token, leaving
+    `generate` a single token to pick. The rows of one request (its choices)
+    share a generator, drawn from in row order.
+
+    It has to run after any processor that masks tokens (e.g. a JSON schema),
+    and applies the temperature, top-k and top-p warpers itself since
+    `generate` only applies them after the processors it is given.
+    """
+
+    def __init__(
+        self,
+        seeds: List[int],
+        temperature: float,
+        top_p: float = 1.0,
+        top_k: Optional[int] = None,
+    ):
+        """
+        Args:
+            seeds: Seed of each request in the batch
+            temperature: Sampling temperature
+            top_p: Top-p sampling parameter
+            top_k: Top-k sampling parameter; None or 0 keeps every token
+        """
+        self.seeds = list(seeds)
+        self._generators: Optional[List[torch.Generator]] = None
+        self.warpers = [TemperatureLogitsWarper(temperature)]
+        if top_k:
+            self.warpers.append(TopKLogitsWarper(top_k))
+        if top_p < 1.0:
+            self.warpers.append(TopPLogitsWarper(top_p))
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor
+    ) -> torch.FloatTensor:
+        if self._generators is None:
+            self._generators = [
+                torch.Generator(device=scores.device).manual_seed(seed) for seed in self.seeds
+            ]
+        for warper in self.warpers:
+            scores = warper(input_ids, scores)
+        probs = torch.softmax(scores.float(), dim=-1)
+
+        # Rows are split evenly between requests: each has as many choices
+        rows_per_request = scores.shape[0] // len(self._generators)
+        tokens = torch.cat(
+            [
+                torch.multinomial(
+                    probs[index * rows_per_request : (index + 1) * rows_per_request],
+                    num_samples=1,
+                    generator=generator,
+                )
+                for index, generator in enumerate(self._generators)
+            ]
+        )
+        sampled = torch.full_like(scores, -float("inf"))
+        return sampled.scatter_(1, tokens, 0.0)
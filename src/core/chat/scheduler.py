@@ -0,0 +1,322 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from config.inference import BATCH_MAX_DELAY_MS, BATCH_MAX_SIZE
+from core.chat.registry import ModelRegistry, model_registry
+from core.inference.cancellation import (
+    CancellationToken,
+    GenerationCancelled,
+    cancellation_stats,
+)
+from core.inference.workers import WorkerPool
+from core.inference.metrics import metrics
+from core.inference.timing import StageTimer
+
+
+class _PendingChat:
+    """A queued chat request waiting to be grouped into a batch"""
+
+    def __init__(
+        self,
+        key: Tuple[Any, ...],
+        messages: List[Dict[str, Any]],
+        max_tokens: int,
+        stop: Optional[Union[str, List[str]]],
+        timer: Optional[StageTimer],
+        cancellation: Optional[CancellationToken],
+        kwargs: Dict[str, Any],
+    ):
+        self.key = key
+        self.messages = messages
+        self.max_tokens = max_tokens
+        self.stop = stop
+        self.timer = timer
+        self.cancellation = cancellation
+        self.kwargs = kwargs
+        self.enqueued_at = time.perf_counter()
+        self.future: Future = Future()
+
+
+class BatchScheduler:
+    """
+    Micro-batching scheduler in front of OpenAIChat.
+
+    Incoming chat requests are queued and grouped by model and sampling mode.
+    A group is dispatched as one `OpenAIChat.chat_batch` call as soon as it
+    reaches `max_batch_size` requests or its oldest request has waited
+    `max_queue_delay_ms`, and each caller receives its own result through a Future.
+    Requests cancelled while queued are dropped from their batch.
+
+    Grouping runs on one dispatcher thread, which hands ready batches to a
+    generation thread per model, so a slow model (or one waiting for
+    admission) does not hold up the batches of the others.
+    """
+
+    def __init__(
+        self,
+        registry: Optional[ModelRegistry] = None,
+        max_batch_size: Optional[int] = None,
+        max_queue_delay_ms: Optional[float] = None,
+    ):
+        """
+        Initialize the scheduler.
+
+        Args:
+            registry: Registry to take models from. Defaults to the shared registry.
+            max_batch_size: Maximum requests per batch. Defaults to DEGEN_BATCH_MAX_SIZE.
+            max_queue_delay_ms: Maximum time a request waits for others to batch with.
+                Defaults to DEGEN_BATCH_MAX_DELAY_MS.
+        """
+        self.registry = registry or model_registry
+        self.max_batch_size = max(1, max_batch_size or BATCH_MAX_SIZE)
+        self.max_queue_delay = (
+            BATCH_MAX_DELAY_MS if max_queue_delay_ms is None else max_queue_delay_ms
+        ) / 1000
+
+        self._queue: "queue.Queue[Optional[_PendingChat]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._running = False
+        # Ready batches of each model and the thread generating them
+        self._model_queues: Dict[str, "queue.Queue[Optional[List[_PendingChat]]]"] = {}
+        self._model_threads: Dict[str, threading.Thread] = {}
+
+        self.stats = {"requests": 0, "batches": 0, "max_batch_size_seen": 0}
+        metrics.describe(
+            "chat_batch_size",
+            "Requests per dispatched chat batch",
+            buckets=(1, 2, 4, 8, 16, 32, 64),
+        )
+        metrics.describe("chat_batch_wait_seconds", "Time requests waited to be batched")
+
+    def submit(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        max_tokens: int = 256,
+        temperature: float = 1.0,
+        top_p: float = 1.0,
+        seed: Optional[int] = None,
+        stop: Optional[Union[str, List[str]]] = None,
+        timer: Optional[StageTimer] = None,
+        cancellation: Optional[CancellationToken] = None,
+    ) -> Future:
+        """
+        Queue a chat request.
+
+        Args:
+            model: The model name to use
+            messages: List of message dictionaries with 'role' and 'content'
+            max_tokens: Maximum tokens to generate
+            temperature: Sampling temperature (0 for greedy decoding)
+            top_p: Top-p sampling parameter
+            seed: Seed for sampling; only requests with the same seed are batched together
+            stop: Sequences that end the completion; may differ within a batch
+            timer: Receives the time spent waiting for a batch ("queue") and the
+                stages of the batch it ran in
+            cancellation: Token set when the caller no longer wants the result
+
+        Returns:
+            Future resolving to the OpenAI-compatible result dictionary of
+            `OpenAIChat.chat_batch`, or failing with GenerationCancelled
+        """
+        self._ensure_started()
+
+        # Requests can only share a generate call if they sample the same way
+        sampling = (temperature, top_p) if temperature and temperature > 0 else None
+        pending = _PendingChat(
+            key=(model, sampling, seed),
+            messages=messages,
+            max_tokens=max_tokens,
+            stop=stop,
+            timer=timer,
+            cancellation=cancellation,
+            kwargs={"temperature": temperature, "top_p": top_p, "seed": seed},
+        )
+        self._queue.put(pending)
+        return pending.future
+
+    def chat(self, model: str, messages: List[Dict[str, Any]], **kwargs) -> Dict[str, Any]:
+        """Queue a chat request and wait for its result"""
+        return self.submit(model, messages, **kwargs).result()
+
+    def shutdown(self) -> None:
+        """Stop the scheduler threads after the queued requests have been served"""
+        with self._lock:
+            if not self._running:
+                return
+            self._running = False
+            thread = self._thread
+        self._queue.put(None)
+        if thread is not None:
+            thread.join()
+
+        with self._lock:
+            model_queues = list(self._model_queues.values())
+            model_threads = list(self._model_threads.values())
+            self._model_queues.clear()
+            self._model_threads.clear()
+        for model_queue in model_queues:
+            model_queue.put(None)
+        for model_thread in model_threads:
+            model_thread.join()
+
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self._thread = threading.Thread(
+                target=self._run, name="chat-batch-scheduler", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self) -> None:
+        groups: Dict[Tuple[Any, ...], List[_PendingChat]] = {}
+        stopping = False
+
+        while not stopping or groups:
+            timeout = None
+            if groups:
+                oldest = min(group[0].enqueued_at for group in groups.values())
+                timeout = max(0.0, oldest + self.max_queue_delay - time.perf_counter())
+
+            # Wait for the next request, then drain everything that queued up
+            # meanwhile so it is grouped before any deadline is checked
+            block = not stopping
+            while True:
+                try:
+                    pending = self._queue.get(block=block, timeout=timeout)
+                except queue.Empty:
+                    break
+                block = False
+                if pending is None:
+                    stopping = True
+                else:
+                    groups.setdefault(pending.key, []).append(pending)
+
+            now = time.perf_counter()
+            for key in list(groups):
+                group = groups[key]
+                full = len(group) >= self.max_batch_size
+                expired = now - group[0].enqueued_at >= self.max_queue_delay
+                if not (full or expired or stopping):
+                    continue
+
+                batch = group[: self.max_batch_size]
+                rest = group[self.max_batch_size :]
+                if rest:
+                    groups[key] = rest
+                else:
+                    del groups[key]
+                self._dispatch(batch)
+
+    def _model_queue(self, model: str) -> "queue.Queue[Optional[List[_PendingChat]]]":
+        """Get the queue of ready batches of a model, starting its thread on first use"""
+        with self._lock:
+            model_queue = self._model_queues.get(model)
+            if model_queue is None:
+                model_queue = queue.Queue()
+                thread = threading.Thread(
+                    target=self._run_model,
+                    args=(model_queue,),
+                    name=f"chat-batch-{model}",
+                    daemon=True,
+                )
+                self._model_queues[model] = model_queue
+                self._model_threads[model] = thread
+                thread.start()
+            return model_queue
+
+    def _run_model(self, model_queue: "queue.Queue[Optional[List[_PendingChat]]]") -> None:
+        """Generate the batches of one model in the order they were dispatched"""
+        while True:
+            batch = model_queue.get()
+            if batch is None:
+                return
+            try:
+                self._generate(batch)
+            except Exception as e:
+                for pending in batch:
+                    if not pending.future.done():
+                        pending.future.set_exception(e)
+
+    def _dispatch(self, batch: List[_PendingChat]) -> None:
+        self.stats["requests"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["max_batch_size_seen"] = max(
+            self.stats["max_batch_size_seen"], len(batch)
+        )
+
+        metrics.observe("chat_batch_size", len(batch))
+        now = time.perf_counter()
+        for pending in batch:
+            metrics.observe("chat_batch_wait_seconds", now - pending.enqueued_at)
+            if pending.timer is not None:
+                pending.timer.add("queue", now - pending.enqueued_at)
+
+        self._model_queue(batch[0].key[0]).put(batch)
+
+    def _generate(self, batch: List[_PendingChat]) -> None:
+        live = []
+        for pending in batch:
+            if pending.cancellation is not None and pending.cancellation.cancelled:
+                cancellation_stats.record("chat", "queued")
+                pending.future.set_exception(
+                    GenerationCancelled("Request cancelled before it started")
+                )
+            else:
+                live.append(pending)
+        if not live:
+            return
+        batch = live
+
+        model = batch[0].key[0]
+        batch_kwargs = {
+            "max_tokens": [pending.max_tokens for pending in batch],
+            "stop": [pending.stop for pending in batch],
+            "timers": [pending.timer for pending in batch],
+            "cancellations": [pending.cancellation for pending in batch],
+            **batch[0].kwargs,
+        }
+        messages = [pending.messages for pending in batch]
+
+        try:
+            chat_model = self.registry.get(model)
+            if isinstance(chat_model, WorkerPool):
+                # Worker processes generate in parallel, so only hand the batch over
+                results: Future = chat_model.submit_batch(messages, **batch_kwargs)
+            else:
+                results = Future()
+                results.set_result(chat_model.chat_batch(messages, **batch_kwargs))
+        except Exception as e:
+            results = Future()
+            results.set_exception(e)
+
+        results.add_done_callback(lambda done: self._deliver(batch, done))
+
+    def _deliver(self, batch: List[_PendingChat], results: Future) -> None:
+        error = results.exception()
+        if error is None:
+            for pending, result in zip(batch, results.result()):
+                if pending.cancellation is not None and pending.cancellation.cancelled:
+                    # Its row stopped early; the partial completion is not wanted
+                    pending.future.set_exception(
+                        GenerationCancelled("Request cancelled during generation")
+                    )
+                else:
+                    pending.future.set_result(result)
+        elif len(batch) > 1:
+            # Retry each request alone so the one at fault (e.g. a prompt
+            # longer than the context) does not fail the others
+            for pending in batch:
+                self._generate([pending])
+        else:
+            batch[0].future.set_exception(error)
+
+
+# Shared scheduler used by the API
+chat_scheduler = BatchScheduler()
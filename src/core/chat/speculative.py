@@ -0,0 +1,179 @@
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+import torch
+from transformers import DynamicCache
+
+
+class SpeculativeDecoder:
+    """
+    Greedy speculative decoding with a small draft model.
+
+    Each round the draft model proposes up to `num_draft_tokens` tokens one at a
+    time, then the target model scores all of them in a single forward pass. The
+    longest run of proposals matching the target's own greedy choices is kept,
+    followed by the target's token at the first mismatch (or one past the last
+    proposal), so every round yields at least one token and the output is
+    exactly what greedy decoding with the target model alone would produce.
+    Both models keep a key/value cache that is cut back to the accepted tokens
+    after each round.
+
+    The draft model must share the target's tokenizer.
+    """
+
+    def __init__(self, target: Any, draft: Any, num_draft_tokens: int = 4):
+        """
+        Initialize the decoder.
+
+        Args:
+            target: The model whose greedy output is reproduced
+            draft: Smaller model of the same family proposing tokens
+            num_draft_tokens: Tokens proposed per round
+        """
+        self.target = target
+        self.draft = draft
+        self.num_draft_tokens = max(1, num_draft_tokens)
+
+        self._lock = threading.Lock()
+        self.stats = {
+            "generations": 0,
+            "rounds": 0,
+            "draft_tokens": 0,
+            "accepted_tokens": 0,
+            "generated_tokens": 0,
+        }
+
+    def generate(
+        self,
+        prompt_ids: Sequence[int],
+        max_new_tokens: int,
+        eos_token_ids: Set[int],
+        past_key_values: Optional[DynamicCache] = None,
+        stopping_criteria: Optional[Any] = None,
+        streamer: Optional[Any] = None,
+    ) -> Tuple[List[int], DynamicCache]:
+        """
+        Greedily generate a completion for one prompt.
+
+        Args:
+            prompt_ids: Prompt token IDs
+            max_new_tokens: Maximum tokens to generate
+            eos_token_ids: Tokens that end the completion
+            past_key_values: Target key/values of a prefix of the prompt, e.g.
+                from the prefix cache
+            stopping_criteria: `StoppingCriteriaList` checked after every token
+            streamer: Receives the generated tokens like it would from `generate`
+
+        Returns:
+            Tuple of (generated token IDs, target cache covering the prompt and
+            the accepted tokens)
+        """
+        sequence = list(prompt_ids)
+        generated: List[int] = []
+        target_cache = past_key_values if past_key_values is not None else DynamicCache()
+        draft_cache = DynamicCache()
+        rounds = draft_tokens = accepted_tokens = 0
+
+        if streamer is not None:
+            streamer.put(torch.tensor([sequence]))
+
+        with torch.inference_mode():
+            done = max_new_tokens <= 0
+            while not done:
+                # Leave room for the target's own token at the end of the round
+                budget = min(self.num_draft_tokens, max_new_tokens - len(generated) - 1)
+                proposals = self._propose(sequence, draft_cache, budget, eos_token_ids)
+
+                logits = self._forward(
+                    self.target,
+                    sequence[target_cache.get_seq_length() :] + proposals,
+                    target_cache,
+                )
+                predictions = logits[-(len(proposals) + 1) :].argmax(dim=-1).tolist()
+
+                accepted = 0
+                while accepted < len(proposals) and proposals[accepted] == predictions[accepted]:
+                    accepted += 1
+
+                # Drop key/values of rejected proposals from both caches
+                target_cache.crop(len(sequence) + accepted)
+                draft_cache.crop(len(sequence) + accepted)
+
+                rounds += 1
+                draft_tokens += len(proposals)
+                accepted_tokens += accepted
+
+                new_tokens = []
+                for token in proposals[:accepted] + [predictions[accepted]]:
+                    sequence.append(token)
+                    generated.append(token)
+                    new_tokens.append(token)
+                    if (
+                        token in eos_token_ids
+                        or len(generated) >= max_new_tokens
+                        or self._should_stop(stopping_criteria, sequence)
+                    ):
+                        done = True
+                        break
+
+                if streamer is not None:
+                    streamer.put(torch.tensor(new_tokens))
+
+        if streamer is not None:
+            streamer.end()
+
+        with self._lock:
+            self.stats["generations"] += 1
+            self.stats["rounds"] += rounds
+            self.stats["draft_tokens"] += draft_tokens
+            self.stats["accepted_tokens"] += accepted_tokens
+            self.stats["generated_tokens"] += len(generated)
+
+        return generated, target_cache
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get acceptance-rate and tokens-per-round counters"""
+        with self._lock:
+            return {
+                **self.stats,
+                "acceptance_rate": (
+                    self.stats["accepted_tokens"] / self.stats["draft_tokens"]
+                    if self.stats["draft_tokens"]
+                    else 0.0
+                ),
+                "tokens_per_round": (
+                    self.stats["generated_tokens"] / self.stats["rounds"]
+                    if self.stats["rounds"]
+                    else 0.0
+                ),
+            }
+
+    def _propose(
+        self,
+        sequence: List[int],
+        draft_cache: DynamicCache,
+        budget: int,
+        eos_token_ids: Set[int],
+    ) -> List[int]:
+        """Greedily draft up to `budget` tokens following `sequence`"""
+        proposals: List[int] = []
+        tokens = sequence[draft_cache.get_seq_length() :]
+        while len(proposals) < budget:
+            token = int(self._forward(self.draft, tokens, draft_cache)[-1].argmax())
+            proposals.append(token)
+            if token in eos_token_ids:
+                break
+            tokens = [token]
+        return proposals
+
+    @staticmethod
+    def _forward(model: Any, tokens: List[int], cache: DynamicCache) -> torch.Tensor:
+        """Run `tokens` through `model` on top of `cache` and return their logits"""
+        input_ids = torch.tensor([tokens], device=model.device)
+        return model(input_ids=input_ids, past_key_values=cache, use_cache=True).logits[0]
+
+    @staticmethod
+    def _should_stop(stopping_criteria: Optional[Any], sequence: List[int]) -> bool:
+        if not stopping_criteria:
+            return False
+        return bool(stopping_criteria(torch.tensor([sequence]), None).any())
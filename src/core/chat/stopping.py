@@ -0,0 +1,148 @@
+from typing import Any, List, Optional, Sequence
+
+import torch
+from transformers import StoppingCriteria
+
+from core.inference.cancellation import CancellationToken
+
+
+class MaxNewTokensPerRow(StoppingCriteria):
+    """
+    Stop each row of a batch once it has produced its own token budget.
+
+    `generate` only accepts a single `max_new_tokens` for the whole batch, so the
+    batch runs to the largest budget while rows with smaller ones are finished
+    (and padded) as soon as they reach theirs.
+    """
+
+    def __init__(self, prompt_length: int, max_new_tokens: List[int]):
+        self.prompt_length = prompt_length
+        self.max_new_tokens = torch.tensor(max_new_tokens, dtype=torch.long)
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
+    ) -> torch.BoolTensor:
+        generated = input_ids.shape[1] - self.prompt_length
+        return (self.max_new_tokens <= generated).to(input_ids.device)
+
+
+class StopOnCancel(StoppingCriteria):
+    """
+    Stop each row of a batch once its request is cancelled.
+
+    Checked after every decoded token, so a caller that went away costs at
+    most one more token; the other rows of the batch carry on.
+    """
+
+    def __init__(self, cancellations: Sequence[Optional[CancellationToken]]):
+        self.cancellations = list(cancellations)
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
+    ) -> torch.BoolTensor:
+        cancelled = [token is not None and token.cancelled for token in self.cancellations]
+        if len(cancelled) == 1:
+            # Several choices of one request are all rows of the same request
+            cancelled = cancelled * input_ids.shape[0]
+        return torch.tensor(cancelled, dtype=torch.bool, device=input_ids.device)
+
+
+def find_stop_sequence(text: str, stop_sequences: Sequence[str]) -> Optional[int]:
+    """
+    Find where the earliest stop sequence starts in `text`.
+
+    Returns:
+        Character index of the first match, or None if no stop sequence occurs
+    """
+    positions = [text.find(stop) for stop in stop_sequences if stop]
+    positions = [position for position in positions if position >= 0]
+    return min(positions) if positions else None
+
+
+class StopOnSequences(StoppingCriteria):
+    """
+    Stop each row of a batch once its generated text contains one of its stop sequences.
+
+    Only the trailing tokens of each row are decoded at every step, enough to
+    hold the longest stop sequence, so the check stays cheap for long outputs.
+    """
+
+    def __init__(
+        self, tokenizer: Any, prompt_length: int, stop_sequences: List[List[str]]
+    ):
+        """
+        Args:
+            tokenizer: Tokenizer used to decode generated tokens
+            prompt_length: Length of the (padded) prompt in every row
+            stop_sequences: Stop sequences of each row
+        """
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stop_sequences = stop_sequences
+        longest = max((len(stop) for row in stop_sequences for stop in row), default=0)
+        # A token decodes to at least one character, plus slack for a token
+        # straddling the start of the match
+        self.window = longest + 2
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
+    ) -> torch.BoolTensor:
+        generated = input_ids[:, self.prompt_length :]
+        tails = self.tokenizer.batch_decode(
+            generated[:, -self.window :], skip_special_tokens=True
+        )
+        return torch.tensor(
+            [
+                find_stop_sequence(tail, stops) is not None
+                for tail, stops in zip(tails, self.stop_sequences)
+            ],
+            dtype=torch.bool,
+            device=input_ids.device,
+        )
+
+
+class StopSequenceFilter:
+    """
+    Filter streamed text so stop sequences never reach the client.
+
+    Text that could be the beginning of a stop sequence is held back until the
+    following text shows whether the sequence completes. Once a stop sequence
+    is seen, everything from its start onwards is dropped.
+    """
+
+    def __init__(self, stop_sequences: Sequence[str]):
+        self.stop_sequences = [stop for stop in stop_sequences if stop]
+        self.stopped = False
+        self._pending = ""
+
+    def feed(self, text: str) -> str:
+        """Add newly streamed text and get the part that is safe to emit"""
+        if self.stopped:
+            return ""
+        self._pending += text
+
+        index = find_stop_sequence(self._pending, self.stop_sequences)
+        if index is not None:
+            self.stopped = True
+            safe, self._pending = self._pending[:index], ""
+            return safe
+
+        held = self._partial_match_length(self._pending)
+        safe = self._pending[: len(self._pending) - held]
+        self._pending = self._pending[len(safe) :]
+        return safe
+
+    def flush(self) -> str:
+        """Get the held back text once the stream has ended"""
+        safe, self._pending = self._pending, ""
+        return safe
+
+    def _partial_match_length(self, text: str) -> int:
+        """Length of the longest suffix of `text` that starts some stop sequence"""
+        longest = 0
+        for stop in self.stop_sequences:
+            for length in range(min(len(stop) - 1, len(text)), longest, -1):
+                if text.endswith(stop[:length]):
+                    longest = length
+                    break
+        return longest
@@ -0,0 +1,117 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Sequence, Tuple
+
+# Transcript used to check that a tokenizer encodes pieces independently
+_PROBE_PIECES = ["System: Be brief.", "\nHuman: Hello there!", "\nAssistant: Hi.", "\nAssistant:"]
+
+
+class TokenCache:
+    """
+    LRU cache of token IDs for the pieces of a chat prompt.
+
+    A prompt is encoded piece by piece (one piece per message) and the token IDs
+    are concatenated, so the messages of a multi-turn history, which repeat in
+    every request of the conversation, are only tokenized once.
+
+    Concatenating per-piece encodings only equals encoding the whole prompt if
+    the tokenizer never merges across piece boundaries. This is checked once
+    per tokenizer. Tokenizers that fail the check always encode the whole
+    prompt, and pieces ending in whitespace are kept together with the next one.
+    """
+
+    def __init__(self, tokenizer: Any, max_entries: int):
+        """
+        Initialize the cache.
+
+        Args:
+            tokenizer: Tokenizer of the chat model
+            max_entries: Maximum number of cached pieces; 0 disables caching
+        """
+        self.tokenizer = tokenizer
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[int, ...]]" = OrderedDict()
+        self._special_prefix = list(tokenizer("")["input_ids"])
+        self.enabled = max_entries > 0 and self._pieces_encode_independently()
+
+        self.stats = {"hits": 0, "misses": 0, "tokens_saved": 0}
+
+    def encode(self, pieces: Sequence[str]) -> List[int]:
+        """
+        Get the token IDs of the prompt made of `pieces` joined together.
+
+        Returns:
+            Exactly what the tokenizer produces for `"".join(pieces)`
+        """
+        if not self.enabled:
+            return list(self.tokenizer("".join(pieces))["input_ids"])
+
+        token_ids = list(self._special_prefix)
+        for piece in self._merge_pieces(pieces):
+            token_ids.extend(self._encode_piece(piece))
+        return token_ids
+
+    def clear(self) -> None:
+        """Drop all cached pieces"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit-rate and size counters"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "enabled": self.enabled,
+            }
+
+    def _encode_piece(self, piece: str) -> Tuple[int, ...]:
+        with self._lock:
+            token_ids = self._entries.get(piece)
+            if token_ids is not None:
+                self._entries.move_to_end(piece)
+                self.stats["hits"] += 1
+                self.stats["tokens_saved"] += len(token_ids)
+                return token_ids
+
+        token_ids = tuple(self.tokenizer(piece, add_special_tokens=False)["input_ids"])
+
+        with self._lock:
+            self.stats["misses"] += 1
+            self._entries[piece] = token_ids
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return token_ids
+
+    @staticmethod
+    def _merge_pieces(pieces: Sequence[str]) -> List[str]:
+        """
+        Join pieces whose boundary the tokenizer could merge across.
+
+        Regex pre-tokenizers (GPT-2 style byte-level BPE) always split between a
+        non-space character and following whitespace, but may group a run of
+        whitespace or attach a space to the next word. Pieces are therefore only
+        kept apart where the next one starts with whitespace (the prompt's
+        newline before each role) and the previous one does not end with it.
+        """
+        merged: List[str] = []
+        for piece in pieces:
+            if not piece:
+                continue
+            if merged and (merged[-1][-1].isspace() or not piece[0].isspace()):
+                merged[-1] += piece
+            else:
+                merged.append(piece)
+        return merged
+
+    def _pieces_encode_independently(self) -> bool:
+        expected = list(self.tokenizer("".join(_PROBE_PIECES))["input_ids"])
+        actual = list(self._special_prefix)
+        for piece in _PROBE_PIECES:
+            actual.extend(self.tokenizer(piece, add_special_tokens=False)["input_ids"])
+        return actual == expected
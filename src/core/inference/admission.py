@@ -0,0 +1,226 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import torch
+
+from config.inference import ADMISSION_BUDGET_MB, ADMISSION_TIMEOUT_S
+from core.inference.executor import InferenceRejected
+from core.inference.metrics import metrics
+
+
+class RequestTooLarge(ValueError):
+    """The request needs more memory than the whole admission budget"""
+
+
+class AdmissionTimeout(InferenceRejected):
+    """The request waited too long for memory to free up"""
+
+
+def estimate_generation_bytes(
+    config: Any,
+    dtype: torch.dtype,
+    prompt_tokens: int,
+    max_new_tokens: int,
+    batch_size: int = 1,
+) -> int:
+    """
+    Estimate the peak memory one generate call needs on top of the model weights.
+
+    Counts the key/value cache for every prompt and generated position plus the
+    largest prefill activations: hidden states and MLP intermediates of the
+    whole prompt, one layer's attention scores and the final logits.
+
+    Args:
+        config: Hugging Face model config
+        dtype: Precision of the activations and key/value cache
+        prompt_tokens: Prompt length (padded length for batches)
+        max_new_tokens: Maximum tokens to generate
+        batch_size: Rows generated together
+
+    Returns:
+        Estimated bytes
+    """
+    element_size = torch.empty((), dtype=dtype).element_size()
+
+    hidden_size = config.hidden_size
+    num_layers = config.num_hidden_layers
+    num_heads = config.num_attention_heads
+    num_kv_heads = getattr(config, "num_key_value_heads", None) or num_heads
+    head_dim = getattr(config, "head_dim", None) or hidden_size // num_heads
+    intermediate_size = (
+        getattr(config, "intermediate_size", None)
+        or getattr(config, "n_inner", None)
+        or 4 * hidden_size
+    )
+
+    sequence_length = prompt_tokens + max_new_tokens
+    kv_cache = 2 * num_layers * num_kv_heads * head_dim * sequence_length * element_size
+
+    activations = prompt_tokens * (4 * hidden_size + intermediate_size) * element_size
+    attention_scores = num_heads * prompt_tokens * prompt_tokens * element_size
+    # Logits are computed in float32 for the last position of every row
+    logits = config.vocab_size * 4
+
+    return batch_size * (kv_cache + activations + attention_scores + logits)
+
+
+class AdmissionController:
+    """
+    Memory budget shared by all generation running in the process.
+
+    Each generate call asks for its estimated memory before it starts. Calls
+    that fit next to the ones already running are admitted immediately, others
+    wait in FIFO order until enough memory is released or `timeout_s` passes,
+    and calls that could never fit are rejected outright. This replaces
+    reacting to out-of-memory errors with predictable queueing.
+    """
+
+    def __init__(self, budget_mb: Optional[float] = None, timeout_s: Optional[float] = None):
+        """
+        Initialize the controller.
+
+        Args:
+            budget_mb: Memory available for generation in MB. Defaults to
+                DEGEN_ADMISSION_BUDGET_MB. With 0 the budget is 90% of the free GPU
+                memory when the first request arrives, or unlimited on CPU.
+            timeout_s: Longest a request waits for memory. Defaults to
+                DEGEN_ADMISSION_TIMEOUT_S.
+        """
+        if budget_mb is None:
+            budget_mb = ADMISSION_BUDGET_MB
+        self.budget_bytes: Optional[int] = int(budget_mb * 1024**2) if budget_mb > 0 else None
+        self.timeout_s = ADMISSION_TIMEOUT_S if timeout_s is None else timeout_s
+
+        self._condition = threading.Condition()
+        self._waiters: "deque[object]" = deque()
+        self._in_use = 0
+
+        self.stats = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "peak_bytes": 0,
+        }
+        metrics.describe("admission_in_use_bytes", "Estimated memory of running generations")
+        metrics.describe("admission_waiting", "Generations waiting for memory")
+        metrics.describe("admission_wait_seconds", "Time generations waited for memory")
+        metrics.describe("admission_rejected_total", "Generations rejected by admission control")
+
+    @contextmanager
+    def admit(self, nbytes: int) -> Iterator[None]:
+        """Hold `nbytes` of the budget while the enclosed block runs"""
+        self.acquire(nbytes)
+        try:
+            yield
+        finally:
+            self.release(nbytes)
+
+    def set_budget(self, budget_mb: float) -> None:
+        """Change the budget; with 0 it is measured as on startup (unlimited on CPU)"""
+        with self._condition:
+            self.budget_bytes = int(budget_mb * 1024**2) if budget_mb > 0 else None
+            self._condition.notify_all()
+
+    def fits(self, nbytes: int) -> bool:
+        """Check whether a request of `nbytes` could ever be admitted"""
+        budget = self._budget()
+        return budget is None or nbytes <= budget
+
+    def acquire(self, nbytes: int, timeout_s: Optional[float] = None) -> None:
+        """
+        Reserve `nbytes` of the budget, waiting for running generations if needed.
+
+        Raises:
+            RequestTooLarge: If `nbytes` exceeds the whole budget
+            AdmissionTimeout: If the memory did not free up in time
+        """
+        budget = self._budget()
+        if budget is None:
+            with self._condition:
+                self._take(nbytes)
+            return
+
+        if nbytes > budget:
+            with self._condition:
+                self.stats["rejected"] += 1
+            metrics.inc("admission_rejected_total", labels={"reason": "too_large"})
+            raise RequestTooLarge(
+                f"Request needs an estimated {nbytes / 1024**2:.1f} MB for generation, "
+                f"more than the {budget / 1024**2:.1f} MB budget; reduce the prompt "
+                f"or max_tokens"
+            )
+
+        timeout_s = self.timeout_s if timeout_s is None else timeout_s
+        ticket = object()
+        start = time.perf_counter()
+        deadline = start + timeout_s
+
+        with self._condition:
+            self._waiters.append(ticket)
+            waited = False
+            try:
+                # First come, first served, so large requests are not starved
+                while self._waiters[0] is not ticket or self._in_use + nbytes > budget:
+                    if not waited:
+                        waited = True
+                        self.stats["queued"] += 1
+                    self._update_gauges()
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        self.stats["timeouts"] += 1
+                        metrics.inc("admission_rejected_total", labels={"reason": "timeout"})
+                        raise AdmissionTimeout(
+                            "Timed out waiting for memory to run the request",
+                            retry_after=max(1, math.ceil(timeout_s)),
+                        )
+                    self._condition.wait(remaining)
+                self._take(nbytes)
+            finally:
+                self._waiters.remove(ticket)
+                self._condition.notify_all()
+                self._update_gauges()
+
+        metrics.observe("admission_wait_seconds", time.perf_counter() - start)
+
+    def release(self, nbytes: int) -> None:
+        """Return memory reserved by `acquire`"""
+        with self._condition:
+            self._in_use -= nbytes
+            self._condition.notify_all()
+            self._update_gauges()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the budget, memory in use and admission counters"""
+        with self._condition:
+            return {
+                **self.stats,
+                "budget_bytes": self.budget_bytes,
+                "in_use_bytes": self._in_use,
+                "waiting": len(self._waiters),
+            }
+
+    def _budget(self) -> Optional[int]:
+        if self.budget_bytes is None and torch.cuda.is_available():
+            # Measured once, after the first model has been loaded
+            free, _ = torch.cuda.mem_get_info()
+            self.budget_bytes = int(free * 0.9)
+        return self.budget_bytes
+
+    def _take(self, nbytes: int) -> None:
+        self._in_use += nbytes
+        self.stats["admitted"] += 1
+        self.stats["peak_bytes"] = max(self.stats["peak_bytes"], self._in_use)
+        self._update_gauges()
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge("admission_in_use_bytes", self._in_use)
+        metrics.set_gauge("admission_waiting", len(self._waiters))
+
+
+# Shared controller for all chat models in the process
+admission_controller = AdmissionController()
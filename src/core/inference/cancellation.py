@@ -0,0 +1,114 @@
+import threading
+from typing import Callable, Dict, List, Optional
+
+from core.inference.metrics import metrics
+
+# Unit in which the work avoided by cancelling is counted, per kind of request
+WORK_UNITS = {"chat": "tokens", "speech": "characters"}
+
+
+class GenerationCancelled(Exception):
+    """The caller went away, so its request was stopped before it finished"""
+
+
+class CancellationToken:
+    """
+    Flag a request's work checks to find out its caller has gone away.
+
+    The API sets it when the client disconnects; generation checks it after
+    every decoded token and speech synthesis before every sentence. Callbacks
+    forward the cancellation to work running elsewhere, e.g. a worker process.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """Cancel the request; calling it again has no effect"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        """Call `callback` on cancellation, right away if already cancelled"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+
+class CancellationStats:
+    """
+    Counters of cancelled requests and of the work their cancellation saved.
+
+    Requests are counted by the stage they were cancelled in: "queued" before
+    any work started, "running" part way through. Avoided work is what the
+    request would at most still have done: ungenerated tokens of its
+    `max_tokens` budget for chat, unsynthesized characters of the input for speech.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, int]] = {
+            kind: {"queued": 0, "running": 0, f"{unit}_avoided": 0}
+            for kind, unit in WORK_UNITS.items()
+        }
+        # Called with every recorded cancellation, e.g. to forward it from a
+        # worker process to the API process
+        self.on_record: Optional[Callable[[str, str, int], None]] = None
+        metrics.describe("cancelled_requests_total", "Requests stopped because the client left")
+        metrics.describe(
+            "cancelled_work_avoided_total", "Work not done because the client left"
+        )
+
+    def record(self, kind: str, stage: str, avoided: int = 0) -> None:
+        """
+        Count a cancelled request.
+
+        Args:
+            kind: "chat" or "speech"
+            stage: "queued" or "running"
+            avoided: Tokens (chat) or characters (speech) left undone
+        """
+        unit = WORK_UNITS[kind]
+        avoided = max(0, avoided)
+        with self._lock:
+            self.stats[kind][stage] += 1
+            self.stats[kind][f"{unit}_avoided"] += avoided
+        metrics.inc("cancelled_requests_total", labels={"kind": kind, "stage": stage})
+        if avoided:
+            metrics.inc("cancelled_work_avoided_total", avoided, {"kind": kind, "unit": unit})
+        if self.on_record is not None:
+            self.on_record(kind, stage, avoided)
+
+    def get_stats(self) -> Dict[str, Dict[str, int]]:
+        """Get the counters per kind of request"""
+        with self._lock:
+            return {kind: dict(counters) for kind, counters in self.stats.items()}
+
+
+def check_cancelled(cancellation: Optional[CancellationToken], kind: str) -> None:
+    """
+    Stop a request whose caller left before any work on it started.
+
+    Raises:
+        GenerationCancelled: If the request is cancelled
+    """
+    if cancellation is not None and cancellation.cancelled:
+        cancellation_stats.record(kind, "queued")
+        raise GenerationCancelled("Request cancelled before it started")
+
+
+# Shared counters, reported in the model registry stats and as metrics
+cancellation_stats = CancellationStats()
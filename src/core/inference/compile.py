@@ -0,0 +1,132 @@
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+import torch
+
+from config.inference import COMPILE_BUCKETS, COMPILE_CACHE_DIR, COMPILE_MODE
+from core.inference.executor import InferenceRejected
+
+T = TypeVar("T")
+
+_cache_lock = threading.Lock()
+_cache_enabled = False
+
+
+def enable_compile_cache() -> None:
+    """
+    Keep compiled graphs and kernels in DEGEN_COMPILE_CACHE_DIR across restarts.
+
+    Inductor looks its caches up by graph, so a restarted process that traces
+    the same model and shapes loads the compiled code instead of compiling it.
+    """
+    global _cache_enabled
+    with _cache_lock:
+        if _cache_enabled:
+            return
+        os.makedirs(COMPILE_CACHE_DIR, exist_ok=True)
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", COMPILE_CACHE_DIR)
+        import torch._inductor.config
+
+        torch._inductor.config.fx_graph_cache = True
+        _cache_enabled = True
+
+
+def bucket_length(length: int, buckets: Optional[List[int]] = None) -> Optional[int]:
+    """Get the smallest bucket holding `length` positions, or None if none is large enough"""
+    for bucket in sorted(buckets or COMPILE_BUCKETS):
+        if length <= bucket:
+            return bucket
+    return None
+
+
+class CompiledExecution:
+    """
+    Compiled execution of one model, falling back to eager if compilation fails.
+
+    Every call tries the compiled path first. If it raises, the model is
+    switched to eager for good and the call is repeated eagerly, so a
+    compiler problem costs one slow call rather than failing requests.
+    """
+
+    def __init__(self, name: str, mode: Optional[str] = None):
+        """
+        Initialize the compiled execution state.
+
+        Args:
+            name: Model name used in logs
+            mode: torch.compile mode. Defaults to DEGEN_COMPILE_MODE.
+        """
+        enable_compile_cache()
+        self.name = name
+        self.mode = mode or COMPILE_MODE
+        self.enabled = True
+        # Set once a compiled call has succeeded, i.e. the compiler works here
+        self.verified = False
+        self._lock = threading.Lock()
+        self.stats = {
+            "compiled_calls": 0,
+            "eager_calls": 0,
+            "fallbacks": 0,
+            "first_call_s": None,
+        }
+
+    def run(self, compiled: Callable[[], T], eager: Callable[[], T]) -> T:
+        """Run `compiled`, or `eager` if compilation is disabled or fails"""
+        if not self.enabled:
+            with self._lock:
+                self.stats["eager_calls"] += 1
+            return eager()
+
+        start = time.perf_counter()
+        try:
+            result = compiled()
+        except (ValueError, InferenceRejected):
+            raise
+        except Exception as e:
+            print(f"Warning: Compiled execution of {self.name} failed, using eager mode: {e}")
+            with self._lock:
+                self.enabled = False
+                self.stats["fallbacks"] += 1
+                self.stats["eager_calls"] += 1
+            return eager()
+
+        with self._lock:
+            if self.stats["first_call_s"] is None:
+                # Includes compiling (or loading from the compile cache)
+                self.stats["first_call_s"] = time.perf_counter() - start
+            self.verified = True
+            self.stats["compiled_calls"] += 1
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get whether compilation is active and the call counters"""
+        with self._lock:
+            return {**self.stats, "enabled": self.enabled, "mode": self.mode}
+
+
+def compile_module(
+    module: torch.nn.Module, name: str, dynamic: Optional[bool] = None
+) -> CompiledExecution:
+    """
+    Replace a module's forward with a compiled version that falls back to eager.
+
+    Args:
+        module: Module to compile in place
+        name: Name used in logs
+        dynamic: Passed to torch.compile; True compiles one graph for all input
+            shapes instead of one per shape
+
+    Returns:
+        The compiled execution state, for stats
+    """
+    execution = CompiledExecution(name)
+    eager = module.forward
+    compiled = torch.compile(eager, dynamic=dynamic, mode=execution.mode)
+
+    def forward(*args, **kwargs):
+        return execution.run(lambda: compiled(*args, **kwargs), lambda: eager(*args, **kwargs))
+
+    module.forward = forward
+    return execution
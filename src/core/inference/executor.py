@@ -0,0 +1,174 @@
+import asyncio
+import math
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from config.inference import INFERENCE_MAX_CONCURRENCY, INFERENCE_MAX_QUEUE
+from core.inference.metrics import metrics
+
+
+class InferenceRejected(Exception):
+    """Raised when the executor cannot accept more work right now"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+    def __reduce__(self):
+        # Keeps the retry delay when sent between processes
+        return type(self), (str(self), self.retry_after)
+
+
+class InferenceQueueFull(InferenceRejected):
+    """Every worker is busy and the wait queue is full"""
+
+
+class InferenceUnavailable(InferenceRejected):
+    """The executor has been shut down"""
+
+
+class InferenceExecutor:
+    """
+    Bounded thread pool for blocking model inference.
+
+    At most `max_concurrency` jobs run at once and at most `max_queue` more wait
+    for a worker. Anything beyond that is rejected immediately with
+    InferenceQueueFull, carrying a Retry-After estimate, so async routes never
+    block the event loop and overload turns into fast 429s instead of timeouts.
+    Queue depth, in-flight jobs and queue wait times are exported as metrics.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: Optional[int] = None,
+        max_queue: Optional[int] = None,
+        name: str = "inference",
+    ):
+        """
+        Initialize the executor.
+
+        Args:
+            max_concurrency: Worker threads. Defaults to DEGEN_INFERENCE_MAX_CONCURRENCY.
+            max_queue: Jobs allowed to wait for a worker. Defaults to DEGEN_INFERENCE_MAX_QUEUE.
+            name: Label used for metrics and thread names
+        """
+        self.max_concurrency = max(1, max_concurrency or INFERENCE_MAX_CONCURRENCY)
+        self.max_queue = INFERENCE_MAX_QUEUE if max_queue is None else max(0, max_queue)
+        self.name = name
+
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_concurrency, thread_name_prefix=name
+        )
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self._running = 0
+        self._shutdown = False
+        # Moving average of job duration, used to estimate Retry-After
+        self._avg_run_time = 1.0
+
+        self._labels = {"executor": name}
+        metrics.describe("inference_queue_depth", "Jobs waiting for an inference worker")
+        metrics.describe("inference_in_flight", "Jobs running on inference workers")
+        metrics.describe(
+            "inference_queue_wait_seconds", "Time jobs waited for an inference worker"
+        )
+        metrics.describe("inference_run_seconds", "Time jobs ran on an inference worker")
+        metrics.describe("inference_rejected_total", "Jobs rejected by the executor")
+        self._update_gauges()
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """
+        Queue a blocking call.
+
+        Returns:
+            Future resolving to the call's result
+
+        Raises:
+            InferenceQueueFull: If the wait queue is full
+            InferenceUnavailable: If the executor has been shut down
+        """
+        with self._lock:
+            if self._shutdown:
+                self._reject("unavailable")
+                raise InferenceUnavailable(
+                    "Inference executor is shutting down", retry_after=self._retry_after()
+                )
+            if self._waiting + self._running >= self.max_concurrency + self.max_queue:
+                self._reject("queue_full")
+                raise InferenceQueueFull(
+                    "Inference queue is full, please retry later",
+                    retry_after=self._retry_after(),
+                )
+            self._waiting += 1
+            self._update_gauges()
+
+        enqueued_at = time.perf_counter()
+
+        def run():
+            started_at = time.perf_counter()
+            with self._lock:
+                self._waiting -= 1
+                self._running += 1
+                self._update_gauges()
+            metrics.observe(
+                "inference_queue_wait_seconds", started_at - enqueued_at, self._labels
+            )
+
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                run_time = time.perf_counter() - started_at
+                metrics.observe("inference_run_seconds", run_time, self._labels)
+                with self._lock:
+                    self._running -= 1
+                    self._avg_run_time = 0.9 * self._avg_run_time + 0.1 * run_time
+                    self._update_gauges()
+
+        try:
+            return self._pool.submit(run)
+        except RuntimeError:
+            # The pool was shut down between the check and the submit
+            with self._lock:
+                self._waiting -= 1
+                self._update_gauges()
+            raise InferenceUnavailable(
+                "Inference executor is shutting down", retry_after=self._retry_after()
+            )
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run a blocking call on the executor and await its result"""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def queue_depth(self) -> int:
+        """Get the number of jobs waiting for a worker"""
+        with self._lock:
+            return self._waiting
+
+    def in_flight(self) -> int:
+        """Get the number of jobs running on a worker"""
+        with self._lock:
+            return self._running
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting work and optionally wait for queued jobs"""
+        with self._lock:
+            self._shutdown = True
+        self._pool.shutdown(wait=wait)
+
+    def _retry_after(self) -> int:
+        """Estimate how long until a slot frees up, in whole seconds"""
+        waves = (self._waiting + 1) / self.max_concurrency
+        return max(1, math.ceil(waves * self._avg_run_time))
+
+    def _reject(self, reason: str) -> None:
+        metrics.inc("inference_rejected_total", labels={**self._labels, "reason": reason})
+
+    def _update_gauges(self) -> None:
+        metrics.set_gauge("inference_queue_depth", self._waiting, self._labels)
+        metrics.set_gauge("inference_in_flight", self._running, self._labels)
+
+
+# Shared executor for chat generation
+inference_executor = InferenceExecutor()
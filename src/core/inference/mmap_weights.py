@@ -0,0 +1,176 @@
+import json
+import os
+import re
+import shutil
+import struct
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+import torch
+from safetensors.torch import save_file
+from transformers import AutoConfig, AutoModelForCausalLM, AutoTokenizer, GenerationConfig
+
+from config.inference import WEIGHTS_CACHE_DIR
+
+# safetensors dtype names
+_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def weights_path(model: str, dtype: torch.dtype) -> str:
+    """Get the cache file holding the weights of `model` in `dtype`"""
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "--", model.strip("/"))
+    return os.path.join(WEIGHTS_CACHE_DIR, f"{name}.{str(dtype).split('.')[-1]}.safetensors")
+
+
+def tokenizer_dir(path: str) -> str:
+    """Get the directory holding the tokenizer saved next to a weights file"""
+    return f"{path.removesuffix('.safetensors')}.tokenizer"
+
+
+def save_mmap_weights(model: Any, path: str, tokenizer: Optional[Any] = None) -> None:
+    """
+    Write a loaded model's parameters and buffers to a safetensors file.
+
+    Tensors shared by several names (tied embeddings) are stored once and tied
+    again on load. The model and generation configs are stored in the file's
+    metadata, and the tokenizer (if given) in a directory next to it, so the
+    model can be rebuilt without the hub. Files are written next to their
+    destination and renamed into place, so readers never see a partial file.
+    """
+    tensors: Dict[str, torch.Tensor] = {}
+    seen = set()
+    for name, tensor in [*model.named_parameters(), *model.named_buffers()]:
+        if tensor.data_ptr() in seen:
+            continue
+        seen.add(tensor.data_ptr())
+        tensors[name] = tensor.detach().cpu().contiguous()
+
+    metadata = {"config": model.config.to_json_string()}
+    if getattr(model, "generation_config", None) is not None:
+        metadata["generation_config"] = model.generation_config.to_json_string()
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if tokenizer is not None and not os.path.isdir(tokenizer_dir(path)):
+        partial_dir = f"{tokenizer_dir(path)}.{os.getpid()}.partial"
+        tokenizer.save_pretrained(partial_dir)
+        try:
+            os.replace(partial_dir, tokenizer_dir(path))
+        except OSError:
+            # Saved by another process in the meantime
+            shutil.rmtree(partial_dir, ignore_errors=True)
+
+    partial = f"{path}.{os.getpid()}.partial"
+    save_file(tensors, partial, metadata=metadata)
+    os.replace(partial, path)
+
+
+def load_mmap_weights(path: str) -> Tuple[Dict[str, torch.Tensor], Dict[str, str]]:
+    """
+    Map a safetensors file into memory without copying it.
+
+    The file is mapped copy-on-write, so every process loading it shares the
+    same page-cache pages until one of them writes to a tensor.
+
+    Returns:
+        Tuple of (tensors by name, file metadata)
+    """
+    with open(path, "rb") as f:
+        (header_size,) = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    metadata = header.pop("__metadata__", None) or {}
+
+    data = np.memmap(path, dtype=np.uint8, mode="c", offset=8 + header_size)
+    tensors = {}
+    for name, info in header.items():
+        start, end = info["data_offsets"]
+        raw = torch.from_numpy(data[start:end])
+        tensors[name] = raw.view(_DTYPES[info["dtype"]]).reshape(info["shape"])
+    return tensors, metadata
+
+
+def load_mmap_model(path: str) -> Any:
+    """
+    Build a causal language model whose weights are mapped from `path`.
+
+    The model is created without allocating weights and every parameter and
+    buffer is then pointed at the mapped file, so loading takes no extra
+    memory and no time proportional to the model size.
+
+    Args:
+        path: File written by `save_mmap_weights`
+
+    Returns:
+        The model in eval mode
+    """
+    tensors, metadata = load_mmap_weights(path)
+    config_dict = json.loads(metadata["config"])
+    config = AutoConfig.for_model(config_dict.pop("model_type"), **config_dict)
+
+    dtype = next(t.dtype for t in tensors.values() if t.is_floating_point())
+    with torch.device("meta"):
+        model = AutoModelForCausalLM.from_config(config, torch_dtype=dtype)
+
+    for name, tensor in tensors.items():
+        module_name, _, tensor_name = name.rpartition(".")
+        module = model.get_submodule(module_name)
+        if tensor_name in module._parameters:
+            module._parameters[tensor_name] = torch.nn.Parameter(tensor, requires_grad=False)
+        else:
+            module._buffers[tensor_name] = tensor
+    model.tie_weights()
+    if "generation_config" in metadata:
+        generation_config = GenerationConfig.from_dict(json.loads(metadata["generation_config"]))
+        # Marks the config as unmodified, as `GenerationConfig.from_pretrained` does
+        generation_config._original_object_hash = hash(generation_config)
+        model.generation_config = generation_config
+
+    missing = [
+        name
+        for name, tensor in [*model.named_parameters(), *model.named_buffers()]
+        if tensor.is_meta
+    ]
+    if missing:
+        raise ValueError(f"{path} has no weights for {', '.join(missing)}")
+    return model.eval()
+
+
+def load_tokenizer(path: str, model: str) -> Any:
+    """Load the tokenizer saved next to a weights file, or `model`'s if there is none"""
+    saved = tokenizer_dir(path)
+    return AutoTokenizer.from_pretrained(saved if os.path.isdir(saved) else model)
+
+
+def export_weights(model: str, dtype: torch.dtype, path: str) -> None:
+    """Load `model` from the Hugging Face hub or a local path and save it for mmap loading"""
+    loaded = AutoModelForCausalLM.from_pretrained(model, torch_dtype=dtype)
+    save_mmap_weights(loaded, path, AutoTokenizer.from_pretrained(model))
+
+
+def load_cached_model(model: str, dtype: torch.dtype) -> Any:
+    """
+    Load `model` in `dtype` from the weights cache, converting it on the first load.
+
+    Returns:
+        The model in eval mode, on CPU
+    """
+    path = weights_path(model, dtype)
+    if os.path.exists(path):
+        try:
+            return load_mmap_model(path)
+        except Exception as e:
+            print(f"Warning: Ignoring unreadable cached weights {path}: {e}")
+
+    loaded = AutoModelForCausalLM.from_pretrained(model, torch_dtype=dtype)
+    save_mmap_weights(loaded, path, AutoTokenizer.from_pretrained(model))
+    return loaded.eval()
@@ -0,0 +1,99 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import torch
+from transformers import StoppingCriteria
+
+from config.inference import LOG_CHAT_TIMINGS
+from core.inference.metrics import metrics
+
+metrics.describe("chat_stage_seconds", "Time chat requests spent in each stage")
+
+
+class StageTimer:
+    """
+    Per-request wall-clock time spent in each stage of the chat path.
+
+    Stages are recorded in the order they first run; a stage that runs more
+    than once accumulates. Whoever creates a timer reports it once the request
+    is done, which feeds the `chat_stage_seconds` histogram and, when
+    DEGEN_LOG_CHAT_TIMINGS is set, logs a line with the stage times and token
+    counts.
+    """
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        """Time the enclosed block as stage `name`"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float) -> None:
+        """Add `seconds` to stage `name`"""
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def merge(self, other: "StageTimer") -> None:
+        """Add every stage of `other`, e.g. the shared stages of a batch"""
+        for name, seconds in other.stages.items():
+            self.add(name, seconds)
+
+    def total(self) -> float:
+        """Time since the timer was created"""
+        return time.perf_counter() - self.started_at
+
+    def server_timing(self) -> str:
+        """Format the stages as a `Server-Timing` header value (durations in ms)"""
+        entries = [f"{name};dur={seconds * 1000:.1f}" for name, seconds in self.stages.items()]
+        entries.append(f"total;dur={self.total() * 1000:.1f}")
+        return ", ".join(entries)
+
+    def report(self, model: str, usage: Optional[Dict[str, Any]] = None) -> None:
+        """Record the stages in the metrics registry and optionally log them"""
+        for name, seconds in self.stages.items():
+            metrics.observe("chat_stage_seconds", seconds, {"model": model, "stage": name})
+        metrics.observe("chat_stage_seconds", self.total(), {"model": model, "stage": "total"})
+
+        if LOG_CHAT_TIMINGS:
+            usage = usage or {}
+            stages = " ".join(
+                f"{name}={seconds * 1000:.1f}ms" for name, seconds in self.stages.items()
+            )
+            print(
+                f"Chat timings model={model} "
+                f"prompt_tokens={usage.get('prompt_tokens', '-')} "
+                f"completion_tokens={usage.get('completion_tokens', '-')} "
+                f"{stages} total={self.total() * 1000:.1f}ms"
+            )
+
+
+class FirstTokenClock(StoppingCriteria):
+    """
+    Stopping criterion that never stops but notes when the first token is out.
+
+    Generation checks its stopping criteria after every new token, so the first
+    call marks the end of the prefill and the start of the decode loop.
+    """
+
+    def __init__(self):
+        self.first_token_at: Optional[float] = None
+
+    def __call__(
+        self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs
+    ) -> torch.BoolTensor:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        return torch.zeros(input_ids.shape[0], dtype=torch.bool, device=input_ids.device)
+
+    def split(self, timer: StageTimer, started_at: float) -> None:
+        """Record the prefill and decode stages of a generation that began at `started_at`"""
+        finished_at = time.perf_counter()
+        first_token_at = self.first_token_at or finished_at
+        timer.add("prefill", first_token_at - started_at)
+        timer.add("decode", finished_at - first_token_at)
@@ -0,0 +1,576 @@
+import atexit
+import itertools
+import multiprocessing
+import os
+import pickle
+import queue
+import threading
+import time
+import weakref
+from concurrent.futures import Future
+from typing import Any, Dict, List, Optional, Union
+
+import torch
+from transformers import TextStreamer
+
+from config.inference import ADMISSION_BUDGET_MB, INFERENCE_THREADS
+from core.chat.openai import OpenAIChat
+from core.chat.quantization import cpu_supports_bf16
+from core.inference.admission import admission_controller
+from core.inference.cancellation import (
+    CancellationToken,
+    cancellation_stats,
+    check_cancelled,
+)
+from core.inference.executor import InferenceUnavailable
+from core.inference.mmap_weights import export_weights, load_tokenizer, weights_path
+from core.inference.timing import StageTimer
+
+# Seconds a worker may take to load its model before it is given up on
+STARTUP_TIMEOUT_S = 600
+
+# Open pools, closed at exit so exiting workers are not restarted
+_pools: "weakref.WeakSet[WorkerPool]" = weakref.WeakSet()
+
+
+class _PipeStreamer(TextStreamer):
+    """Streamer in a worker process that forwards decoded text to the API process"""
+
+    def __init__(
+        self, tokenizer: Any, conn: Any, request_id: int, skip_prompt: bool, **decode_kwargs
+    ):
+        super().__init__(tokenizer, skip_prompt=skip_prompt, **decode_kwargs)
+        self.conn = conn
+        self.request_id = request_id
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self.conn.send(("text", self.request_id, text))
+        if stream_end:
+            self.conn.send(("end", self.request_id, None))
+
+
+def _picklable(error: Exception) -> Exception:
+    """Get an exception that can be sent back to the API process"""
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+def _worker_main(
+    conn: Any,
+    model: str,
+    options: Dict[str, Any],
+    weights: str,
+    num_threads: int,
+    admission_budget_mb: float,
+) -> None:
+    """Load the model in a worker process, then serve requests until told to stop"""
+    torch.set_num_threads(num_threads)
+    torch.set_num_interop_threads(1)
+    admission_controller.set_budget(admission_budget_mb)
+
+    try:
+        chat = OpenAIChat(model=model, mmap_weights=weights, **{**options, "use_cpu": True})
+    except Exception as e:
+        conn.send(("error", None, _picklable(e)))
+        return
+    conn.send(("ready", None, (os.getpid(), chat.load_timer.stages)))
+    # Cancellations are counted by the API process
+    cancellation_stats.on_record = lambda *record: conn.send(("cancelled", None, record))
+
+    # Messages are read on their own thread so a cancellation reaches the
+    # request it is for while that request is generating
+    requests: "queue.Queue[Optional[Any]]" = queue.Queue()
+    cancellations: Dict[int, List[CancellationToken]] = {}
+
+    def read() -> None:
+        while True:
+            try:
+                message = conn.recv()
+            except EOFError:
+                message = None
+            if message is None:
+                requests.put(None)
+                break
+            request_id, method, kwargs = message
+            if method == "cancel":
+                tokens = cancellations.get(request_id)
+                if tokens is not None:
+                    tokens[kwargs].cancel()
+                continue
+            rows = len(kwargs["batch"]) if method == "chat_batch" else 1
+            cancellations[request_id] = [CancellationToken() for _ in range(rows)]
+            requests.put(message)
+
+    threading.Thread(target=read, name="inference-worker-reader", daemon=True).start()
+
+    # Requests are served one at a time, in the order they were sent
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+
+        request_id, method, kwargs = message
+        tokens = cancellations[request_id]
+        try:
+            streamer = kwargs.pop("streamer", None)
+            if streamer is not None:
+                kwargs["streamer"] = _PipeStreamer(chat.tokenizer, conn, request_id, **streamer)
+            if method == "chat":
+                timers: Union[StageTimer, List[StageTimer]] = StageTimer()
+                result = chat.chat(timer=timers, cancellation=tokens[0], **kwargs)
+            else:
+                timers = [StageTimer() for _ in kwargs["batch"]]
+                result = chat.chat_batch(timers=timers, cancellations=tokens, **kwargs)
+            conn.send(("result", request_id, (result, timers)))
+        except Exception as e:
+            conn.send(("error", request_id, _picklable(e)))
+        finally:
+            cancellations.pop(request_id, None)
+
+
+class _PendingCall:
+    """A request sent to a worker that has not been answered yet"""
+
+    def __init__(self, streamer: Optional[Any] = None):
+        self.future: Future = Future()
+        self.streamer = streamer
+
+
+class _Worker:
+    """Handle on one worker process"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[Any] = None
+        self.pid: Optional[int] = None
+        # Connection to the process once it is ready; None once it has exited
+        self.conn: Optional[Any] = None
+        self.starting_conn: Optional[Any] = None
+        self.send_lock = threading.Lock()
+        self.start_lock = threading.Lock()
+        self.pending: Dict[int, _PendingCall] = {}
+        self.requests = 0
+        self.restarts = -1
+        # Time the worker's model spent per loading stage
+        self.load_stages: Dict[str, float] = {}
+
+
+class WorkerPool:
+    """
+    Chat model served by a pool of worker processes, with the OpenAIChat interface.
+
+    Each worker is a separate process running its own OpenAIChat, so generation
+    is not serialized by the API process's GIL. The weights are converted once
+    to a safetensors file that every worker memory-maps, so the model is held in
+    RAM once no matter how many workers serve it. Intra-op threads are split
+    evenly across workers so they do not oversubscribe the cores, and so is the
+    admission budget, since every worker admits its own requests.
+
+    Requests and results travel over one pipe per worker and are sent to the
+    worker with the fewest unanswered requests. Streamed text is forwarded to
+    the caller's streamer as the worker decodes it. A worker that exits fails
+    its unanswered requests with InferenceUnavailable and is restarted.
+    Cancelling a request forwards the cancellation to the worker running it.
+
+    Prefix cache, token cache and speculative decoding run inside the workers;
+    their statistics are not reported to the API process.
+    """
+
+    # The transcript's turn markers and prompt format do not depend on the loaded model
+    stop_sequences = OpenAIChat.stop_sequences
+    _prompt_pieces = OpenAIChat._prompt_pieces
+
+    def __init__(
+        self,
+        model: str,
+        num_workers: int,
+        num_threads: Optional[int] = None,
+        quantization: Optional[str] = None,
+        admission_budget_mb: Optional[float] = None,
+        **options,
+    ):
+        """
+        Start the workers and wait until every one has loaded the model.
+
+        Args:
+            model: The model name to load
+            num_workers: Worker processes to start
+            num_threads: Intra-op threads shared by all workers. Defaults to
+                DEGEN_INFERENCE_THREADS, or one per CPU core.
+            quantization: Precision mode as for OpenAIChat. bf16 weights are
+                stored and shared as bf16; int8 layers are quantized in each
+                worker, so they are not shared.
+            admission_budget_mb: Memory for generation shared by all workers, in
+                MB; each worker admits requests within an even share of it.
+                Defaults to DEGEN_ADMISSION_BUDGET_MB. 0 leaves workers unlimited.
+            **options: Further OpenAIChat keyword arguments for the workers
+        """
+        self.model = model
+        self.num_workers = max(1, num_workers)
+        total_threads = num_threads or INFERENCE_THREADS or os.cpu_count() or 1
+        self.threads_per_worker = max(1, total_threads // self.num_workers)
+        if admission_budget_mb is None:
+            admission_budget_mb = ADMISSION_BUDGET_MB
+        self.admission_budget_mb = max(0.0, admission_budget_mb) / self.num_workers
+
+        if quantization == "bf16" and not cpu_supports_bf16():
+            print("Warning: CPU has no native bfloat16 support, using float32")
+            quantization = None
+        self.quantization = quantization
+        self.options = {**options, "quantization": quantization}
+
+        # Interface of OpenAIChat that has no counterpart in the API process
+        self.device = "cpu"
+        self.prefix_cache = None
+        self.token_cache = None
+        self.speculative = None
+        self.compiled = None
+
+        self._context = multiprocessing.get_context("spawn")
+        self._lock = threading.Lock()
+        self._request_ids = itertools.count()
+        self._closed = False
+        _pools.add(self)
+
+        # Time spent per loading stage, reported by the model registry
+        self.load_timer = StageTimer()
+
+        dtype = torch.bfloat16 if quantization == "bf16" else torch.float32
+        with self.load_timer.stage("weights"):
+            self.weights = self._prepare_weights(dtype)
+        with self.load_timer.stage("tokenizer"):
+            self.tokenizer = load_tokenizer(self.weights, model)
+
+        # Workers load in parallel
+        self._workers = [_Worker(index) for index in range(self.num_workers)]
+        with self.load_timer.stage("workers"):
+            for worker in self._workers:
+                self._spawn(worker)
+            for worker in self._workers:
+                self._wait_until_ready(worker)
+
+        print(
+            f"Started {self.num_workers} inference workers for {model} "
+            f"({self.threads_per_worker} threads each)"
+        )
+
+    def chat(
+        self,
+        messages: List[Dict[str, Any]],
+        max_tokens: int = 256,
+        temperature: float = 1.0,
+        top_p: float = 1.0,
+        seed: Optional[int] = None,
+        stop: Optional[Union[str, List[str]]] = None,
+        timer: Optional[StageTimer] = None,
+        cancellation: Optional[CancellationToken] = None,
+        **kwargs,
+    ) -> Dict[str, Any]:
+        """Generate a chat completion on a worker; see `OpenAIChat.chat`"""
+        owns_timer = timer is None
+        timer = timer or StageTimer()
+        check_cancelled(cancellation, "chat")
+
+        streamer = kwargs.pop("streamer", None)
+        future = self._submit(
+            "chat",
+            {
+                "messages": messages,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "top_p": top_p,
+                "seed": seed,
+                "stop": stop,
+                **kwargs,
+            },
+            streamer,
+            [cancellation],
+        )
+        result, worker_timer = future.result()
+        timer.merge(worker_timer)
+
+        if owns_timer and result.get("usage"):
+            timer.report(self.model, result["usage"])
+        return result
+
+    def count_prompt_tokens(self, messages: List[Dict[str, Any]]) -> int:
+        """Count the tokens of the prompt built from `messages`"""
+        prompt = "".join(self._prompt_pieces(messages))
+        return len(self.tokenizer(prompt, add_special_tokens=False)["input_ids"])
+
+    def chat_batch(self, batch: List[List[Dict[str, Any]]], **kwargs) -> List[Dict[str, Any]]:
+        """Generate chat completions for a batch on one worker; see `OpenAIChat.chat_batch`"""
+        return self.submit_batch(batch, **kwargs).result()
+
+    def submit_batch(
+        self,
+        batch: List[List[Dict[str, Any]]],
+        max_tokens: Union[int, List[int]] = 256,
+        temperature: float = 1.0,
+        top_p: float = 1.0,
+        seed: Optional[int] = None,
+        stop: Optional[List[Optional[Union[str, List[str]]]]] = None,
+        timers: Optional[List[Optional[StageTimer]]] = None,
+        cancellations: Optional[List[Optional[CancellationToken]]] = None,
+        **kwargs,
+    ) -> Future:
+        """
+        Send a batch to a worker without waiting for it.
+
+        Returns:
+            Future resolving to the results of `OpenAIChat.chat_batch`
+        """
+        worker_future = self._submit(
+            "chat_batch",
+            {
+                "batch": batch,
+                "max_tokens": max_tokens,
+                "temperature": temperature,
+                "top_p": top_p,
+                "seed": seed,
+                "stop": stop,
+                **kwargs,
+            },
+            cancellations=cancellations,
+        )
+
+        future: Future = Future()
+
+        def deliver(done: Future) -> None:
+            try:
+                results, worker_timers = done.result()
+            except Exception as e:
+                future.set_exception(e)
+                return
+            for timer, worker_timer in zip(timers or [], worker_timers):
+                if timer is not None:
+                    timer.merge(worker_timer)
+            future.set_result(results)
+
+        worker_future.add_done_callback(deliver)
+        return future
+
+    def resident_bytes(self) -> int:
+        """Get the size of the shared weights, which every worker maps once"""
+        return os.path.getsize(self.weights)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the worker count, thread and budget split and per-worker request counters"""
+        with self._lock:
+            return {
+                "num_workers": self.num_workers,
+                "threads_per_worker": self.threads_per_worker,
+                "admission_budget_mb_per_worker": self.admission_budget_mb,
+                "weights": self.weights,
+                "workers": [
+                    {
+                        "pid": worker.pid,
+                        "alive": worker.conn is not None,
+                        "in_flight": len(worker.pending),
+                        "requests": worker.requests,
+                        "restarts": worker.restarts,
+                        "load_stages": worker.load_stages,
+                    }
+                    for worker in self._workers
+                ],
+            }
+
+    def close(self) -> None:
+        """Stop accepting requests; workers exit once they have answered theirs"""
+        with self._lock:
+            self._closed = True
+        for worker in self._workers:
+            conn = worker.conn
+            if conn is None:
+                continue
+            try:
+                with worker.send_lock:
+                    conn.send(None)
+            except OSError:
+                pass
+
+    def _prepare_weights(self, dtype: torch.dtype) -> str:
+        path = weights_path(self.model, dtype)
+        if os.path.exists(path):
+            return path
+
+        # Converting in a separate process keeps a full load out of the API process
+        print(f"Converting {self.model} weights for memory-mapped loading: {path}")
+        process = self._context.Process(target=export_weights, args=(self.model, dtype, path))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"Failed to convert the weights of {self.model}")
+        return path
+
+    def _restart(self, worker: _Worker) -> None:
+        with worker.start_lock:
+            if worker.conn is None and not self._closed:
+                self._spawn(worker)
+                self._wait_until_ready(worker)
+
+    def _spawn(self, worker: _Worker) -> None:
+        conn, child_conn = self._context.Pipe()
+        worker.process = self._context.Process(
+            target=_worker_main,
+            args=(
+                child_conn,
+                self.model,
+                self.options,
+                self.weights,
+                self.threads_per_worker,
+                self.admission_budget_mb,
+            ),
+            name=f"inference-worker-{worker.index}",
+            daemon=True,
+        )
+        worker.process.start()
+        child_conn.close()
+        worker.restarts += 1
+
+        # Not published as worker.conn until the model is loaded
+        worker.pid = None
+        worker.starting_conn = conn
+
+    def _wait_until_ready(self, worker: _Worker) -> None:
+        conn = worker.starting_conn
+        deadline = time.monotonic() + STARTUP_TIMEOUT_S
+        kind, payload = "error", None
+        try:
+            ready = conn.poll(1)
+            while not ready and worker.process.is_alive() and time.monotonic() <= deadline:
+                ready = conn.poll(1)
+            # Timed out or died without a word: recv() would block forever
+            if ready:
+                kind, _, payload = conn.recv()
+        except (EOFError, OSError):
+            pass
+
+        if kind != "ready":
+            worker.process.kill()
+            conn.close()
+            raise payload or RuntimeError(
+                f"Inference worker {worker.index} for {self.model} failed to start"
+            )
+
+        with self._lock:
+            worker.pid, worker.load_stages = payload
+            worker.conn = conn
+            closed = self._closed
+        if closed:
+            # The pool was closed while this worker was starting
+            conn.send(None)
+        threading.Thread(
+            target=self._receive,
+            args=(worker, conn),
+            name=f"inference-worker-{worker.index}-receiver",
+            daemon=True,
+        ).start()
+
+    def _receive(self, worker: _Worker, conn: Any) -> None:
+        """Hand the worker's answers to the waiting callers until it exits"""
+        while True:
+            try:
+                kind, request_id, payload = conn.recv()
+            except (EOFError, OSError):
+                break
+
+            if kind == "cancelled":
+                cancellation_stats.record(*payload)
+                continue
+
+            if kind in ("text", "end"):
+                call = worker.pending.get(request_id)
+                if call is not None and call.streamer is not None:
+                    if kind == "text":
+                        call.streamer.on_finalized_text(payload)
+                    else:
+                        call.streamer.end()
+                continue
+
+            with self._lock:
+                call = worker.pending.pop(request_id, None)
+            if call is None:
+                continue
+            if kind == "result":
+                call.future.set_result(payload)
+            else:
+                call.future.set_exception(payload)
+
+        with self._lock:
+            calls = list(worker.pending.values())
+            worker.pending.clear()
+            if worker.conn is conn:
+                worker.conn = None
+        conn.close()
+        for call in calls:
+            call.future.set_exception(
+                InferenceUnavailable("Inference worker exited", retry_after=1)
+            )
+
+        if not self._closed:
+            print(f"Inference worker {worker.index} for {self.model} exited, restarting it")
+            self._restart(worker)
+
+    def _submit(
+        self,
+        method: str,
+        kwargs: Dict[str, Any],
+        streamer: Optional[Any] = None,
+        cancellations: Optional[List[Optional[CancellationToken]]] = None,
+    ) -> Future:
+        with self._lock:
+            if self._closed:
+                raise InferenceUnavailable("Inference workers are shutting down", retry_after=1)
+            # Prefer running workers, then the least busy one
+            worker = min(self._workers, key=lambda w: (w.conn is None, len(w.pending)))
+
+        # Every worker is down; wait for one to come back
+        if worker.conn is None:
+            self._restart(worker)
+
+        if streamer is not None:
+            # The worker decodes with its own tokenizer using the caller's settings
+            kwargs["streamer"] = {"skip_prompt": streamer.skip_prompt, **streamer.decode_kwargs}
+
+        request_id = next(self._request_ids)
+        call = _PendingCall(streamer)
+        with self._lock:
+            conn = worker.conn
+            worker.pending[request_id] = call
+            worker.requests += 1
+
+        try:
+            with worker.send_lock:
+                conn.send((request_id, method, kwargs))
+        except (AttributeError, OSError):
+            with self._lock:
+                worker.pending.pop(request_id, None)
+            raise InferenceUnavailable("Inference worker exited", retry_after=1)
+
+        # Cancelling a request (or a row of a batch) tells the worker to stop it
+        for row, token in enumerate(cancellations or []):
+            if token is not None:
+                token.add_callback(
+                    lambda row=row: self._cancel(worker, conn, request_id, row)
+                )
+        return call.future
+
+    def _cancel(self, worker: _Worker, conn: Any, request_id: int, row: int) -> None:
+        if request_id not in worker.pending:
+            return
+        try:
+            with worker.send_lock:
+                conn.send((request_id, "cancel", row))
+        except OSError:
+            pass
+
+
+@atexit.register
+def _close_pools() -> None:
+    for pool in list(_pools):
+        pool.close()
@@ -7,6 +7,7 @@ import torch
 import soundfile as sf
 
 from core.interface.base import AIServiceBase
+from core.tts.encoders import ENCODER_FORMATS, get_encoder
 
 
 class TextToSpeechServiceBase(AIServiceBase):
@@ -29,6 +30,10 @@ class TextToSpeechServiceBase(AIServiceBase):
     ) -> io.BytesIO:
         """
         Convert audio to the specified format and return as BytesIO.
+
+        Mono audio in a response format (mp3, opus, flac, wav, pcm) goes
+        through the response encoders; anything else (several channels, other
+        soundfile formats) is written by soundfile as is.
         """
 
         # Default sample rate (adjust as needed)
@@ -39,7 +44,7 @@ class TextToSpeechServiceBase(AIServiceBase):
             samplerate = DEFAULT_SAMPLERATE  # Set default sample rate for tensor input
         elif isinstance(audio, str):
             # If audio is a string, assume it's a file path
-            audio_np, samplerate = sf.read(audio)
+            audio_np, samplerate = sf.read(audio, dtype="float32")
         else:
             raise ValueError(
                 "Unsupported audio format. Provide a valid audio file path or a tensor."
@@ -54,9 +59,14 @@ class TextToSpeechServiceBase(AIServiceBase):
 
         # print(f"Audio saved to {audio_path}")
 
-        # Save to BytesIO for return
+        # Encode into a BytesIO for return
         audio_buffer = io.BytesIO()
-        sf.write(audio_buffer, audio_np, samplerate, format=format)
+        if audio_np.ndim == 1 and format.lower() in ENCODER_FORMATS:
+            encoder = get_encoder(format.lower(), audio_buffer, samplerate)
+            encoder.encode(audio_np)
+            encoder.finish()
+        else:
+            sf.write(audio_buffer, audio_np, samplerate, format=format)
         audio_buffer.seek(0)
 
         return audio_buffer
@@ -0,0 +1,284 @@
+import io
+import struct
+from abc import ABC, abstractmethod
+from typing import BinaryIO, List, Optional, Union
+
+import numpy as np
+import soundfile as sf
+
+# Sample rate of the audio Kokoro generates
+SAMPLE_RATE = 24000
+
+# Encoded audio ready to be sent; samples are handed out as views, not copies
+Chunk = Union[bytes, memoryview]
+
+# Size the header of a WAV stream gives for its parts when its length is not
+# known yet, which players read as "until the end of the stream"
+UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+def to_pcm16(audio: np.ndarray) -> np.ndarray:
+    """Convert float audio to 16-bit little-endian samples"""
+    samples = np.empty(len(audio), dtype="<i2")
+    np.multiply(np.clip(audio, -1.0, 1.0), 32767, out=samples, casting="unsafe")
+    return samples
+
+
+class AudioEncoder(ABC):
+    """
+    Encoder of float32 audio into one format, a chunk at a time.
+
+    Without a `file`, the encoded bytes of each chunk are returned as soon as
+    they are available, for streaming. Header fields that depend on the whole
+    audio (its length, sample count) are then left open. With a seekable
+    `file`, everything is written to it and those fields are filled in by
+    `finish`.
+    """
+
+    def __init__(self, file: Optional[BinaryIO] = None, sample_rate: int = SAMPLE_RATE):
+        self.file = file
+        self.sample_rate = sample_rate
+
+    @abstractmethod
+    def encode(self, audio: np.ndarray) -> List[Chunk]:
+        """
+        Encode the next chunk of audio.
+
+        Returns:
+            The bytes ready to be sent; empty when writing to a file
+        """
+
+    @abstractmethod
+    def finish(self) -> List[Chunk]:
+        """
+        Encode what is left once the audio is complete.
+
+        Returns:
+            The last bytes to be sent; empty when writing to a file
+        """
+
+
+class PCMEncoder(AudioEncoder):
+    """Raw 16-bit mono samples, without a header"""
+
+    def encode(self, audio: np.ndarray) -> List[Chunk]:
+        samples = memoryview(to_pcm16(audio)).cast("B")
+        if self.file is not None:
+            self.file.write(samples)
+            return []
+        return [samples]
+
+    def finish(self) -> List[Chunk]:
+        return []
+
+
+class WAVEncoder(PCMEncoder):
+    """
+    16-bit mono WAV.
+
+    Streamed, the header goes out with the first chunk with its sizes left
+    open. Written to a file, the sizes are filled in by `finish`.
+    """
+
+    def __init__(self, file: Optional[BinaryIO] = None, sample_rate: int = SAMPLE_RATE):
+        super().__init__(file, sample_rate)
+        self._header_sent = False
+        self._header_position = 0
+        self._data_size = 0
+
+    def _header(self, data_size: int) -> bytes:
+        riff_size = UNKNOWN_SIZE if data_size == UNKNOWN_SIZE else 36 + data_size
+        return b"RIFF" + struct.pack(
+            "<I4s4sIHHIIHH4sI",
+            riff_size,
+            b"WAVE",
+            b"fmt ",
+            16,
+            1,  # PCM
+            1,  # Mono
+            self.sample_rate,
+            self.sample_rate * 2,
+            2,
+            16,
+            b"data",
+            data_size,
+        )
+
+    def encode(self, audio: np.ndarray) -> List[Chunk]:
+        chunks = []
+        if not self._header_sent:
+            self._header_sent = True
+            if self.file is not None:
+                self._header_position = self.file.tell()
+                self.file.write(self._header(0))
+            else:
+                chunks.append(self._header(UNKNOWN_SIZE))
+        self._data_size += len(audio) * 2
+        return chunks + super().encode(audio)
+
+    def finish(self) -> List[Chunk]:
+        if self.file is None:
+            # Nothing was encoded; still a valid (empty) stream
+            return [] if self._header_sent else [self._header(UNKNOWN_SIZE)]
+        if not self._header_sent:
+            self.encode(np.zeros(0, dtype=np.float32))
+        end = self.file.tell()
+        self.file.seek(self._header_position)
+        self.file.write(self._header(self._data_size))
+        self.file.seek(end)
+        return []
+
+
+class _StreamSink:
+    """
+    Write-only file whose bytes are taken out as soon as they are written.
+
+    Bytes taken out are gone: later writes to them, such as the header an
+    encoder updates when it is closed, are dropped.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # File position of the first byte in the buffer
+        self._start = 0
+        self._position = 0
+        self._size = 0
+
+    def write(self, data) -> int:
+        data = memoryview(data).cast("B")
+        skip = max(0, self._start - self._position)
+        if skip < len(data):
+            offset = self._position + skip - self._start
+            self._buffer[offset : offset + len(data) - skip] = data[skip:]
+        self._position += len(data)
+        self._size = max(self._size, self._position)
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self._size}[whence]
+        self._position = base + offset
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        return b""
+
+    def take(self) -> List[Chunk]:
+        """Take out the bytes written since the last call"""
+        if not self._buffer:
+            return []
+        data, self._buffer = self._buffer, bytearray()
+        self._start += len(data)
+        return [memoryview(data)]
+
+
+# Bitrates (kbit/s) of MPEG-1 and of MPEG-2/2.5 layer III frames, by bitrate index
+MP3_BITRATES = {
+    True: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    False: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+# Sample rates of MPEG-1, MPEG-2 and MPEG-2.5 frames, by sample rate index
+MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def _mp3_frame_length(header: bytes) -> int:
+    """Get the length in bytes of the layer III frame starting with `header`"""
+    version = (header[1] >> 3) & 3
+    mpeg1 = version == 3
+    bitrate = MP3_BITRATES[mpeg1][header[2] >> 4] * 1000
+    sample_rate = MP3_SAMPLE_RATES[version][(header[2] >> 2) & 3]
+    padding = (header[2] >> 1) & 1
+    return (144 if mpeg1 else 72) * bitrate // sample_rate + padding
+
+
+class SoundFileEncoder(AudioEncoder):
+    """
+    A compressed format, encoded by libsndfile as the audio comes in.
+
+    Streamed, the fields libsndfile fills in when it is closed cannot be: a
+    FLAC stream's sample count is left as unknown, and an MP3 stream goes
+    without the frame reserved for its LAME tag, which would otherwise play
+    as a blank frame.
+
+    Players therefore only know the duration of streamed FLAC and MP3
+    approximately: FLAC's is missing until the whole stream has been read, and
+    MP3's is estimated from the first frame's bitrate, which is off for
+    variable bitrate audio. Seeking in them is approximate too. Audio written
+    to a `file` has exact headers.
+    """
+
+    def __init__(
+        self,
+        format: str,
+        subtype: Optional[str] = None,
+        file: Optional[BinaryIO] = None,
+        sample_rate: int = SAMPLE_RATE,
+    ):
+        super().__init__(file, sample_rate)
+        self._sink = _StreamSink() if file is None else None
+        self._skip_tag_frame = file is None and format == "MP3"
+        self._soundfile = sf.SoundFile(
+            self._sink if file is None else file,
+            "w",
+            samplerate=sample_rate,
+            channels=1,
+            format=format,
+            subtype=subtype,
+        )
+
+    def encode(self, audio: np.ndarray) -> List[Chunk]:
+        self._soundfile.write(audio)
+        return self._take()
+
+    def finish(self) -> List[Chunk]:
+        self._soundfile.close()
+        return self._take()
+
+    def _take(self) -> List[Chunk]:
+        """Take out the bytes to send"""
+        if self._sink is None:
+            return []
+        chunks = self._sink.take()
+        if self._skip_tag_frame and chunks:
+            # The frame is reserved, in full, before any audio is written
+            self._skip_tag_frame = False
+            chunks = [chunks[0][_mp3_frame_length(chunks[0]) :]]
+        return chunks
+
+
+# soundfile format and subtype of the compressed response formats
+SOUNDFILE_FORMATS = {
+    "mp3": ("MP3", None),
+    "opus": ("OGG", "OPUS"),
+    "flac": ("FLAC", None),
+}
+
+# Response formats get_encoder handles
+ENCODER_FORMATS = {"pcm", "wav", *SOUNDFILE_FORMATS}
+
+
+def get_encoder(
+    output_format: str, file: Optional[BinaryIO] = None, sample_rate: int = SAMPLE_RATE
+) -> AudioEncoder:
+    """
+    Get an encoder for a response format. Encoders take mono audio only.
+
+    Args:
+        output_format: mp3, opus, flac, wav or pcm
+        file: Seekable file to write the complete audio to. Without one the
+            encoded bytes are returned chunk by chunk, for streaming.
+        sample_rate: Sample rate of the audio
+
+    Raises:
+        ValueError: If the format is not supported
+    """
+    if output_format == "pcm":
+        return PCMEncoder(file, sample_rate)
+    if output_format == "wav":
+        return WAVEncoder(file, sample_rate)
+    if output_format in SOUNDFILE_FORMATS:
+        format, subtype = SOUNDFILE_FORMATS[output_format]
+        return SoundFileEncoder(format, subtype, file, sample_rate)
+    raise ValueError(f"Unsupported audio format: {output_format}")
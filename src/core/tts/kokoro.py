@@ -1,12 +1,31 @@
 from kokoro import KModel, KPipeline
 import io
 import os
+import re
+import threading
+import time
 import torch
-from typing import Optional
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
 import numpy as np
-import soundfile as sf
 
+from config.inference import COMPILE, TTS_PRELOAD_LANGS
+from core.inference.cancellation import (
+    CancellationToken,
+    GenerationCancelled,
+    cancellation_stats,
+    check_cancelled,
+)
+from core.inference.compile import CompiledExecution, compile_module
 from core.interface.texttospeech import TextToSpeechServiceBase
+from core.tts.encoders import Chunk, get_encoder
+from core.tts.segment_cache import segment_cache
+
+# Text is synthesized one sentence (or line) at a time, so a cancelled request
+# stops at the next sentence boundary
+SENTENCE_SPLIT_PATTERN = r"(?<=[.!?…])\s+|(?<=[。！？])|\n+"
+
+# Voice used when the requested one is not supported
+DEFAULT_VOICE = "af_heart"
 
 
 class KokotoTTS(TextToSpeechServiceBase):
@@ -23,15 +42,54 @@ class KokotoTTS(TextToSpeechServiceBase):
         self._model = None
         self._device = "cuda" if torch.cuda.is_available() else "cpu"
         self.model_name = "kokoro-v1_0.pth"
+        # Compiled parts of the loaded model, by name
+        self.compiled: Dict[str, CompiledExecution] = {}
+
+        # One pipeline (G2P frontend and voices) per language, all sharing the model.
+        # Building them is serialized; each pipeline has a lock held while it
+        # synthesizes a sentence, so concurrent requests take turns per sentence.
+        self._pipelines: Dict[str, KPipeline] = {}
+        self._pipeline_locks: Dict[str, threading.Lock] = {}
+        self._load_lock = threading.Lock()
+
+    def preload(self, lang_codes: Optional[List[str]] = None) -> None:
+        """
+        Load the model and build pipelines before the first request needs them.
 
-        # self.load_model()
+        Failures are logged rather than raised, so the API still starts; the
+        pipeline is then built (and the error reported) on first use.
+
+        Args:
+            lang_codes: Languages to build pipelines for. Defaults to
+                DEGEN_TTS_PRELOAD_LANGS.
+        """
+        lang_codes = TTS_PRELOAD_LANGS if lang_codes is None else lang_codes
+        start = time.perf_counter()
+        for lang_code in lang_codes:
+            try:
+                # The default voice is fetched now too, rather than by the first request
+                self.get_pipeline(lang_code).load_voice(DEFAULT_VOICE)
+            except Exception as e:
+                print(f"Failed to preload Kokoro pipeline for language {lang_code}: {e}")
+        if self._pipelines:
+            print(
+                f"Preloaded Kokoro pipelines {', '.join(sorted(self._pipelines))} "
+                f"in {time.perf_counter() - start:.2f}s"
+            )
 
     def process_request(
-        self, text: str, lang_code: str | None, voice: str, speed: float = 1.0
+        self,
+        text: str,
+        lang_code: str | None,
+        voice: str,
+        speed: float = 1.0,
+        output_format: str = "wav",
+        cancellation: Optional[CancellationToken] = None,
     ):
         lang_code = lang_code if lang_code else "a"
-        return self.generate_audio(text, lang_code, voice, speed)
-    
+        return self.generate_audio(
+            text, lang_code, voice, speed, output_format, cancellation=cancellation
+        )
 
 
     def generate_audio(
@@ -41,49 +99,191 @@ class KokotoTTS(TextToSpeechServiceBase):
         voice: str,
         speed: float = 1.0,
         output_format: str = "wav",
+        cancellation: Optional[CancellationToken] = None,
     ) -> Optional[io.BytesIO]:
         """
         Generate audio from text using the specified language and voice.
-        """
-        if not text or not text.strip():
-            raise ValueError("Text cannot be empty")
-
-        voice_ = voice if voice in self.get_supported_voices() else "af_heart"
 
+        Once `cancellation` is set, synthesis stops after the current sentence
+        and GenerationCancelled is raised.
+        """
         try:
-            pipeline = self.get_pipeline(lang_code)
-            generator = pipeline(text, voice=voice_, speed=speed)
-
-            audio_list = []
-            sample_rate = 24000  # Default sample rate
-
-            # Collect all audio segments
-            for i, (_, _, audio) in enumerate(generator):
-                if audio is not None:  # Check if audio is generated
-                    audio_list.append(audio)
-
-            if not audio_list:
-                raise ValueError("No audio data was generated.")
-
-            # Combine audio arrays
-            combined_audio_np = np.concatenate(audio_list)
-
-            # Save to BytesIO
+            # Each sentence is encoded as it is synthesized, rather than the whole clip at the end
             audio_buffer = io.BytesIO()
-            sf.write(audio_buffer, combined_audio_np, sample_rate, format=output_format)
+            encoder = get_encoder(output_format, audio_buffer)
+            for audio in self.synthesize(text, lang_code, voice, speed, cancellation):
+                encoder.encode(audio)
+            encoder.finish()
             audio_buffer.seek(0)
 
             return audio_buffer
 
+        except (GenerationCancelled, ValueError):
+            raise
         except Exception as e:
             print(f"Error generating audio: {e}")
             return None
 
-    def load_model(self, path: str = "models") -> None:
+    def stream_audio(
+        self,
+        text: str,
+        lang_code: str,
+        voice: str,
+        speed: float = 1.0,
+        output_format: str = "wav",
+        cancellation: Optional[CancellationToken] = None,
+        file: Optional[BinaryIO] = None,
+    ) -> Iterator[Chunk]:
+        """
+        Generate audio from text, encoded one sentence at a time.
+
+        Audio of each sentence is encoded and yielded as soon as it is
+        synthesized, so the first bytes only wait for the first sentence.
+
+        Args:
+            file: Seekable file to also write the complete audio to, with the
+                header fields a stream leaves open filled in
+
+        Raises:
+            ValueError: If the text or the format is not supported
+            GenerationCancelled: If `cancellation` is set during synthesis
+        """
+        encoder = get_encoder(output_format)
+        file_encoder = get_encoder(output_format, file) if file is not None else None
+        for audio in self.synthesize(text, lang_code, voice, speed, cancellation):
+            if file_encoder is not None:
+                file_encoder.encode(audio)
+            yield from encoder.encode(audio)
+        if file_encoder is not None:
+            file_encoder.finish()
+        yield from encoder.finish()
+
+    def synthesize(
+        self,
+        text: str,
+        lang_code: str,
+        voice: str,
+        speed: float = 1.0,
+        cancellation: Optional[CancellationToken] = None,
+    ) -> Iterator[np.ndarray]:
+        """
+        Synthesize text one sentence (or line) at a time.
+
+        Sentences already synthesized in the same language, voice and speed
+        come from the segment cache. The pipeline of the language is only held
+        while a sentence is synthesized, so requests reading their audio slowly
+        do not hold up others.
+
+        Yields:
+            Float32 audio of each sentence, as soon as it is synthesized
+
+        Raises:
+            ValueError: If the text is empty or no audio was generated
+            GenerationCancelled: If `cancellation` is set during synthesis
+        """
+        if not text or not text.strip():
+            raise ValueError("Text cannot be empty")
+        check_cancelled(cancellation, "speech")
+
+        voice_ = voice if voice in self.get_supported_voices() else DEFAULT_VOICE
+        lang = self._language(lang_code)
+        sentences = [
+            sentence
+            for sentence in re.split(SENTENCE_SPLIT_PATTERN, text.strip())
+            if sentence.strip()
+        ]
+
+        generated = False
+        synthesized = 0
+        for sentence in sentences:
+            key = segment_cache.make_key(sentence, lang, voice_, speed)
+            segment = segment_cache.get(key)
+            if segment is None:
+                try:
+                    phonemes, audio = self._synthesize_sentence(
+                        sentence, lang, voice_, speed, cancellation
+                    )
+                except GenerationCancelled:
+                    cancellation_stats.record("speech", "running", len(text) - synthesized)
+                    raise
+                if audio is not None:
+                    segment_cache.put(key, phonemes, audio)
+            else:
+                audio = segment.audio
+            synthesized += len(sentence)
+            if cancellation is not None and cancellation.cancelled:
+                cancellation_stats.record("speech", "running", len(text) - synthesized)
+                raise GenerationCancelled("Request cancelled during synthesis")
+            if audio is None:
+                continue
+            generated = True
+            try:
+                yield audio
+            except GeneratorExit:
+                # The audio stopped being read, e.g. a streamed response was abandoned
+                cancellation_stats.record("speech", "running", len(text) - synthesized)
+                raise
+
+        if not generated:
+            raise ValueError("No audio data was generated.")
+
+    def _synthesize_sentence(
+        self,
+        sentence: str,
+        lang: str,
+        voice: str,
+        speed: float,
+        cancellation: Optional[CancellationToken] = None,
+    ) -> Tuple[Tuple[str, ...], Optional[np.ndarray]]:
+        """
+        Synthesize one sentence, holding its language's pipeline meanwhile.
+
+        Phonemes already known from the sentence in another voice or speed are
+        reused instead of running G2P again. A long sentence takes several
+        model calls; `cancellation` is checked between them.
+
+        Returns:
+            The phonemes of each model call and the sentence's audio, None if
+            nothing was pronounceable
+
+        Raises:
+            GenerationCancelled: If `cancellation` is set between model calls
+        """
+        pipeline = self.get_pipeline(lang)
+        phonemes = segment_cache.get_phonemes(sentence, lang)
+        if phonemes is None:
+            calls = [lambda: pipeline([sentence], voice=voice, speed=speed)]
+        else:
+            calls = [
+                lambda ps=ps: pipeline.generate_from_tokens(ps, voice=voice, speed=speed)
+                for ps in phonemes
+            ]
+        results = []
+        with self._pipeline_locks[lang]:
+            for call in calls:
+                for result in call():
+                    results.append(result)
+                    if cancellation is not None and cancellation.cancelled:
+                        raise GenerationCancelled("Request cancelled during synthesis")
+        results = [result for result in results if result.audio is not None]
+        if not results:
+            return (), None
+        audio = [np.asarray(result.audio, dtype=np.float32) for result in results]
+        return (
+            tuple(result.phonemes for result in results),
+            audio[0] if len(audio) == 1 else np.concatenate(audio),
+        )
+
+    def load_model(self, path: str = "models", compile: Optional[bool] = None) -> None:
         """Load pre-baked model.
 
+        Pipelines built for a previously loaded model are dropped.
+
         Args:
-            path: Path to model file
+            path: Directory of the model file. Without one there, the model is
+                downloaded from the Hugging Face Hub (once, then read from its cache).
+            compile: Run the text encoder and the decoder compiled. Defaults to
+                DEGEN_COMPILE.
 
         Raises:
             RuntimeError: If model loading fails
@@ -93,23 +293,24 @@ class KokotoTTS(TextToSpeechServiceBase):
             # model_path = os.path.abspath(path)
             # model is located one folder abover called models
             model_path = os.path.join(os.path.dirname(__file__), "..", path, self.model_name)
-            if not os.path.exists(model_path):
-                raise RuntimeError(f"Model file not found: {model_path}")
 
             # Get config path
             # Assuming the config file is in the same directory as the model file
             # and named "config.json"
             config_path = os.path.join(os.path.dirname(model_path), "config.json")
 
-            if not os.path.exists(config_path):
-                raise RuntimeError(f"Config file not found: {config_path}")
-
             print(f"Loading Kokoro model on {self._device}")
-            print(f"Config path: {config_path}")
-            print(f"Model path: {model_path}")
+            if os.path.exists(model_path) and os.path.exists(config_path):
+                print(f"Config path: {config_path}")
+                print(f"Model path: {model_path}")
+                model = KModel(repo_id=self.repo_id, config=config_path, model=model_path)
+            else:
+                print(f"Model file not found: {model_path}, using {self.repo_id}")
+                model = KModel(repo_id=self.repo_id)
 
             # Load model and let KModel handle device mapping
-            self._model = KModel(config=config_path, model=model_path).eval()
+            self._model = model.eval()
+            self._pipelines = {}
             # For MPS, manually move ISTFT layers to CPU while keeping rest on MPS
             if self._device == "mps":
                 print(
@@ -121,11 +322,28 @@ class KokotoTTS(TextToSpeechServiceBase):
             else:
                 self._model = self._model.cpu()
 
+            if COMPILE if compile is None else compile:
+                self._compile_model()
+
         except FileNotFoundError as e:
             raise e
         except Exception as e:
             raise RuntimeError(f"Failed to load Kokoro model: {e}")
 
+    def _compile_model(self) -> None:
+        """
+        Compile the heavy parts of the model: the ALBERT text encoder and the decoder.
+
+        Their input lengths follow the text and the predicted durations, which
+        vary with every segment, so they are compiled for dynamic shapes (one
+        graph for all lengths) rather than per length. The duration predictor
+        in between is data dependent and stays eager.
+        """
+        self.compiled = {
+            "bert": compile_module(self._model.bert, "kokoro.bert", dynamic=True),
+            "decoder": compile_module(self._model.decoder, "kokoro.decoder", dynamic=True),
+        }
+
     def unload_model(self) -> None:
         """Unload the model.
 
@@ -136,6 +354,8 @@ class KokotoTTS(TextToSpeechServiceBase):
             if self._model is not None:
                 del self._model
                 self._model = None
+                self.compiled = {}
+                self._pipelines = {}
                 print("Model unloaded successfully.")
             else:
                 print("No model to unload.")
@@ -178,14 +398,30 @@ class KokotoTTS(TextToSpeechServiceBase):
     def get_pipeline(self, lang_code) -> KPipeline:
         """
         Get the TTS pipeline for the specified language code.
-        """
-
-        lang = lang_code if lang_code in self.get_supported_languages() else "a"
 
-        if self._model is not None:
-            # Use the loaded model if available
-            print(f"Using loaded model for language: {lang}")
-            return KPipeline(lang_code=lang, repo_id=self.repo_id, model=self._model)
+        Pipelines are built once per language, loading the model first if needed,
+        and reused by every later request.
+        """
+        lang = self._language(lang_code)
+        pipeline = self._pipelines.get(lang)
+        if pipeline is not None:
+            return pipeline
+
+        with self._load_lock:
+            if self._model is None:
+                self.load_model()
+            if lang not in self._pipelines:
+                start = time.perf_counter()
+                self._pipeline_locks.setdefault(lang, threading.Lock())
+                self._pipelines[lang] = KPipeline(
+                    lang_code=lang, repo_id=self.repo_id, model=self._model
+                )
+                print(
+                    f"Built Kokoro pipeline for language {lang} "
+                    f"in {time.perf_counter() - start:.2f}s"
+                )
+            return self._pipelines[lang]
 
-        # Initialize the TTS pipeline with the specified language code and repository ID
-        return KPipeline(lang_code=lang, repo_id=self.repo_id)
+    def _language(self, lang_code: Optional[str]) -> str:
+        """Get the supported language code to use for `lang_code`"""
+        return lang_code if lang_code in self.get_supported_languages() else "a"
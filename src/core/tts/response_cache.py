@@ -0,0 +1,237 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, BinaryIO, Dict, List, Optional
+
+from config.inference import TTS_RESPONSE_CACHE_DIR, TTS_RESPONSE_CACHE_MB
+from model.speech import CreateSpeechRequest
+
+# Request fields that change the audio. Every model is served by Kokoro, so the
+# model name does not; neither do how the response is delivered nor downloaded.
+_AUDIO_FIELDS = {"input", "voice", "speed", "lang_code", "response_format"}
+
+# Age after which a temporary file in the cache directory is taken as abandoned
+STALE_TEMP_FILE_S = 3600
+
+
+class SpeechResponseCache:
+    """
+    Content-addressed cache of encoded /audio/speech responses on local disk.
+
+    Each response is one file named after the hash of the request fields that
+    change its audio, so the name doubles as the response's ETag. Files are
+    evicted least recently used first once they exceed `max_bytes`; their
+    modification times keep that order across restarts.
+
+    A hit is handed out as a hard link to the entry under a name of its own,
+    so the response can be sent straight from the file while evicting or
+    replacing the entry meanwhile leaves the link's contents in place.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_bytes: Optional[int] = None):
+        """
+        Initialize the cache.
+
+        Args:
+            directory: Directory of the cached files. Defaults to
+                DEGEN_TTS_RESPONSE_CACHE_DIR.
+            max_bytes: Disk budget. Defaults to DEGEN_TTS_RESPONSE_CACHE_MB; 0
+                disables caching.
+        """
+        self.directory = TTS_RESPONSE_CACHE_DIR if directory is None else directory
+        self.max_bytes = (
+            int(TTS_RESPONSE_CACHE_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        )
+
+        self._lock = threading.Lock()
+        # Cached files by key, least recently used first, with their sizes
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._bytes = 0
+        self._scanned = False
+
+        self.stats = {"hits": 0, "not_modified": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 and bool(self.directory)
+
+    @staticmethod
+    def make_key(request: CreateSpeechRequest) -> str:
+        """
+        Hash the fields of a request that change its audio.
+
+        The fields are dumped with defaults filled in and keys sorted, so
+        equivalent requests hash the same regardless of how they were written.
+        """
+        payload = request.model_dump(mode="json", include=_AUDIO_FIELDS)
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def etag(key: str) -> str:
+        """Get the ETag header value of the response cached under `key`"""
+        return f'"{key}"'
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        Look up a cached response.
+
+        The entry is linked to a new name while it is known to be in the
+        cache, so evicting it meanwhile does not take it away from the caller.
+        Links left behind by a process that stopped are removed like other
+        abandoned temporary files.
+
+        Returns:
+            Path of a link to the cached file, or None if missing. The caller
+            removes it with `release`.
+        """
+        if not self.enabled:
+            return None
+        self._scan()
+        with self._lock:
+            if key in self._files:
+                link = os.path.join(self.directory, f"{key}.{uuid.uuid4().hex}.tmp")
+                try:
+                    os.link(self._path(key), link)
+                except FileNotFoundError:
+                    # Removed behind our back
+                    self._bytes -= self._files.pop(key)
+                except OSError as e:
+                    print(f"Failed to link cached speech response {key}: {e}")
+                else:
+                    self._files.move_to_end(key)
+                    self.stats["hits"] += 1
+                    # The modification time orders the files again after a restart
+                    try:
+                        os.utime(link)
+                    except OSError:
+                        pass
+                    return link
+            self.stats["misses"] += 1
+            return None
+
+    def release(self, link: str) -> None:
+        """Remove a link returned by `get` once the response has been sent"""
+        try:
+            os.remove(link)
+        except OSError:
+            pass
+
+    def record_not_modified(self) -> None:
+        """Count a hit answered with 304 Not Modified"""
+        with self._lock:
+            self.stats["not_modified"] += 1
+
+    def create(self) -> Optional[BinaryIO]:
+        """
+        Open a temporary file in the cache directory to write a response to.
+
+        It becomes a cache entry with `commit`, or is removed with `discard`.
+        """
+        if not self.enabled:
+            return None
+        self._scan()
+        return tempfile.NamedTemporaryFile(dir=self.directory, suffix=".tmp", delete=False)
+
+    def commit(self, key: str, file: BinaryIO) -> None:
+        """Store a file from `create` as the response of `key`"""
+        file.close()
+        path = self._path(key)
+        try:
+            os.replace(file.name, path)
+            size = os.path.getsize(path)
+        except OSError:
+            # Not cached; the response itself was already sent
+            self.discard(file)
+            return
+        with self._lock:
+            self._bytes += size - self._files.pop(key, 0)
+            self._files[key] = size
+            self.stats["stores"] += 1
+            evicted = self._evict()
+        self._remove(evicted)
+
+    def discard(self, file: BinaryIO) -> None:
+        """Remove a file from `create` that will not be stored"""
+        file.close()
+        try:
+            os.remove(file.name)
+        except OSError:
+            pass
+
+    def put(self, key: str, data: bytes) -> None:
+        """Store the encoded response of `key`"""
+        file = self.create()
+        if file is None:
+            return
+        try:
+            file.write(data)
+        except OSError:
+            self.discard(file)
+            return
+        self.commit(key, file)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and the cache size"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._files),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes if self.enabled else 0,
+            }
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def _evict(self) -> List[str]:
+        """Drop the least recently used files over the budget"""
+        evicted = []
+        while self._bytes > self.max_bytes and self._files:
+            key, size = self._files.popitem(last=False)
+            self._bytes -= size
+            self.stats["evictions"] += 1
+            evicted.append(key)
+        return evicted
+
+    def _remove(self, keys: List[str]) -> None:
+        for key in keys:
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _scan(self) -> None:
+        """Index the files cached by earlier runs, oldest first, on first use"""
+        with self._lock:
+            if self._scanned:
+                return
+            self._scanned = True
+            os.makedirs(self.directory, exist_ok=True)
+            files = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                if name.endswith(".tmp"):
+                    # Left by a response that was being written when a process stopped;
+                    # recent ones may still be written by another process
+                    if time.time() - stat.st_mtime > STALE_TEMP_FILE_S:
+                        os.remove(path)
+                    continue
+                files.append((stat.st_mtime, name, stat.st_size))
+            for _, name, size in sorted(files):
+                self._files[name] = size
+                self._bytes += size
+            evicted = self._evict()
+        self._remove(evicted)
+
+
+# Shared cache used by the API
+speech_cache = SpeechResponseCache()
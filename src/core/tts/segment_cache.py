@@ -0,0 +1,307 @@
+import hashlib
+import json
+import os
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from config.inference import (
+    TTS_SEGMENT_CACHE_DIR,
+    TTS_SEGMENT_CACHE_DISK_MB,
+    TTS_SEGMENT_CACHE_MB,
+)
+from core.tts.encoders import SAMPLE_RATE
+
+# (normalised sentence, language code, voice, speed)
+SegmentKey = Tuple[str, str, str, float]
+
+
+class Segment(NamedTuple):
+    """Synthesized sentence: its phonemes (one string per model call) and audio"""
+
+    phonemes: Tuple[str, ...]
+    audio: np.ndarray
+
+    @property
+    def nbytes(self) -> int:
+        return self.audio.nbytes + sum(len(ps.encode("utf-8")) for ps in self.phonemes)
+
+
+class SegmentCache:
+    """
+    Cache of synthesized speech per sentence.
+
+    Entries live in an in-memory LRU tier bounded by `max_bytes`. With a
+    `disk_dir`, entries evicted from memory spill to it rather than being
+    dropped, and are promoted back to memory on their next hit; the files are
+    evicted least recently used first once they exceed `disk_max_bytes`, and
+    are found again after a restart.
+
+    The phonemes of a sentence do not depend on the voice or speed, so they
+    are also looked up on their own, letting a sentence already synthesized
+    in another voice skip G2P.
+    """
+
+    def __init__(
+        self,
+        max_bytes: Optional[int] = None,
+        disk_dir: Optional[str] = None,
+        disk_max_bytes: Optional[int] = None,
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            max_bytes: Memory budget. Defaults to DEGEN_TTS_SEGMENT_CACHE_MB; 0
+                disables caching.
+            disk_dir: Directory of the spill tier. Defaults to
+                DEGEN_TTS_SEGMENT_CACHE_DIR; empty disables it.
+            disk_max_bytes: Budget of the spill tier. Defaults to
+                DEGEN_TTS_SEGMENT_CACHE_DISK_MB.
+        """
+        self.max_bytes = (
+            int(TTS_SEGMENT_CACHE_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        )
+        self.disk_dir = TTS_SEGMENT_CACHE_DIR if disk_dir is None else disk_dir
+        self.disk_max_bytes = (
+            int(TTS_SEGMENT_CACHE_DISK_MB * 1024 * 1024)
+            if disk_max_bytes is None
+            else disk_max_bytes
+        )
+
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[SegmentKey, Segment]" = OrderedDict()
+        self._bytes = 0
+        # Entry holding the phonemes of each (sentence, language) in memory
+        self._phonemes: Dict[Tuple[str, str], SegmentKey] = {}
+        # Spilled files by name, least recently used first, with their sizes
+        self._files: "OrderedDict[str, int]" = OrderedDict()
+        self._disk_bytes = 0
+        if self.disk_dir:
+            self._scan_disk()
+
+        self.stats = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "phoneme_hits": 0,
+            "stores": 0,
+            "evictions": 0,
+            "spills": 0,
+            "audio_seconds_saved": 0.0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    @staticmethod
+    def make_key(text: str, lang_code: str, voice: str, speed: float) -> SegmentKey:
+        """
+        Build the key of a sentence.
+
+        The sentence is Unicode normalised and its whitespace collapsed, so
+        sentences that read the same share an entry.
+        """
+        normalised = " ".join(unicodedata.normalize("NFC", text).split())
+        return (normalised, lang_code, voice, round(float(speed), 4))
+
+    def get(self, key: SegmentKey) -> Optional[Segment]:
+        """
+        Look up a synthesized sentence in memory, then on disk.
+
+        Returns:
+            The cached sentence, or None if missing
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            segment = self._entries.get(key)
+            if segment is not None:
+                self._entries.move_to_end(key)
+                self._hit(segment, "memory_hits")
+                return segment
+
+        segment = self._load(key)
+        if segment is not None:
+            with self._lock:
+                # Promote to memory; its file is kept, so spilling it again is free
+                spilled = self._store_memory(key, segment)
+                self._hit(segment, "disk_hits")
+            self._spill(spilled)
+            return segment
+
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def get_phonemes(self, text: str, lang_code: str) -> Optional[Tuple[str, ...]]:
+        """Look up the phonemes of a sentence synthesized in any voice or speed"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            key = self._phonemes.get(self.make_key(text, lang_code, "", 0)[:2])
+            if key is None:
+                return None
+            self.stats["phoneme_hits"] += 1
+            return self._entries[key].phonemes
+
+    def put(self, key: SegmentKey, phonemes: Tuple[str, ...], audio: np.ndarray) -> None:
+        """Store a synthesized sentence in memory, spilling what it evicts"""
+        if not self.enabled:
+            return
+        segment = Segment(tuple(phonemes), np.ascontiguousarray(audio, dtype=np.float32))
+        with self._lock:
+            spilled = self._store_memory(key, segment)
+            self.stats["stores"] += 1
+        self._spill(spilled)
+
+    def clear(self) -> None:
+        """Drop the in-memory tier"""
+        with self._lock:
+            self._entries.clear()
+            self._phonemes.clear()
+            self._bytes = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters, seconds of audio not synthesized again and tier sizes"""
+        with self._lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                **self.stats,
+                "hit_rate": self.stats["hits"] / lookups if lookups else 0.0,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "disk_entries": len(self._files),
+                "disk_bytes": self._disk_bytes,
+                "disk_max_bytes": self.disk_max_bytes if self.disk_dir else 0,
+            }
+
+    def _hit(self, segment: Segment, tier: str) -> None:
+        self.stats["hits"] += 1
+        self.stats[tier] += 1
+        self.stats["audio_seconds_saved"] += len(segment.audio) / SAMPLE_RATE
+
+    def _store_memory(
+        self, key: SegmentKey, segment: Segment
+    ) -> List[Tuple[SegmentKey, Segment]]:
+        """
+        Store an entry in memory, evicting the least recently used over budget.
+
+        Returns:
+            The evicted entries, to be spilled to disk outside the lock
+        """
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self._bytes -= previous.nbytes
+        self._entries[key] = segment
+        self._bytes += segment.nbytes
+        self._phonemes[key[:2]] = key
+
+        evicted = []
+        while self._bytes > self.max_bytes and self._entries:
+            old_key, old = self._entries.popitem(last=False)
+            self._bytes -= old.nbytes
+            if self._phonemes.get(old_key[:2]) == old_key:
+                del self._phonemes[old_key[:2]]
+            self.stats["evictions"] += 1
+            evicted.append((old_key, old))
+        return evicted
+
+    def _filename(self, key: SegmentKey) -> str:
+        digest = hashlib.sha256(json.dumps(key, ensure_ascii=False).encode("utf-8")).hexdigest()
+        return f"{digest}.npz"
+
+    def _spill(self, evicted: List[Tuple[SegmentKey, Segment]]) -> None:
+        """Write entries evicted from memory to the disk tier"""
+        if not self.disk_dir:
+            return
+        for key, segment in evicted:
+            name = self._filename(key)
+            with self._lock:
+                if name in self._files:
+                    self._files.move_to_end(name)
+                    continue
+            path = os.path.join(self.disk_dir, name)
+            try:
+                # Written under a temporary name so readers never see part of a file
+                temp_path = f"{path}.{threading.get_ident()}.tmp"
+                with open(temp_path, "wb") as f:
+                    np.savez(
+                        f,
+                        key=np.array(json.dumps(key, ensure_ascii=False)),
+                        phonemes=np.array(segment.phonemes, dtype=str),
+                        audio=segment.audio,
+                    )
+                os.replace(temp_path, path)
+                size = os.path.getsize(path)
+            except OSError as e:
+                print(f"Failed to spill TTS segment to {path}: {e}")
+                continue
+            with self._lock:
+                self._files[name] = size
+                self._disk_bytes += size
+                self.stats["spills"] += 1
+                removed = self._evict_disk()
+            for old in removed:
+                try:
+                    os.remove(os.path.join(self.disk_dir, old))
+                except OSError:
+                    pass
+
+    def _evict_disk(self) -> List[str]:
+        """Drop the least recently used files over the disk budget"""
+        removed = []
+        while self._disk_bytes > self.disk_max_bytes and self._files:
+            name, size = self._files.popitem(last=False)
+            self._disk_bytes -= size
+            removed.append(name)
+        return removed
+
+    def _load(self, key: SegmentKey) -> Optional[Segment]:
+        """Read an entry from the disk tier"""
+        if not self.disk_dir:
+            return None
+        name = self._filename(key)
+        with self._lock:
+            if name not in self._files:
+                return None
+            self._files.move_to_end(name)
+        path = os.path.join(self.disk_dir, name)
+        try:
+            with np.load(path) as data:
+                if json.loads(str(data["key"])) != list(key):
+                    return None
+                segment = Segment(tuple(str(ps) for ps in data["phonemes"]), data["audio"])
+            # The modification time orders the files again after a restart
+            os.utime(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Failed to read TTS segment {path}: {e}")
+            return None
+        return segment
+
+    def _scan_disk(self) -> None:
+        """Index the files spilled by earlier runs, oldest first"""
+        os.makedirs(self.disk_dir, exist_ok=True)
+        files = []
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+            elif name.endswith(".npz"):
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._files[name] = size
+            self._disk_bytes += size
+        for old in self._evict_disk():
+            os.remove(os.path.join(self.disk_dir, old))
+
+
+# Shared cache used by the Kokoro TTS service
+segment_cache = SegmentCache()
@@ -0,0 +1,86 @@
+import threading
+import time
+from typing import Optional, Tuple
+
+from .main import Database
+
+# Expired rows are purged on startup and after this many stores
+PURGE_INTERVAL = 100
+
+
+class CompletionCacheDB:
+    """
+    Persistent tier of the chat completion cache.
+
+    Stores serialized ChatCompletionResponse JSON keyed by the request hash,
+    with an absolute expiry time. Expired rows are deleted when they are read,
+    and all of them on startup and every PURGE_INTERVAL stores, so rows that
+    are never read again do not pile up.
+
+    Writes on the request path commit on the connection directly, without the
+    log line of `Database.commit`.
+    """
+
+    def __init__(self, db_name: str = "db.sqlite3"):
+        # The cache is used from inference threads, so the connection is shared
+        # and access is serialized with a lock
+        self.db = Database(db_name, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._stores = 0
+        self._migrate()
+        self.delete_expired()
+
+    def _migrate(self):
+        """
+        Creates the necessary tables in the database if they do not exist.
+        """
+        with self._lock:
+            self.db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS completion_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    response TEXT NOT NULL,
+                    expires_at REAL NOT NULL
+                )
+                """
+            )
+            self.db.commit()
+        print("Completion cache database migration completed.")
+
+    def get_response(self, cache_key: str) -> Optional[Tuple[str, float]]:
+        """Get a cached response and its expiry time, or None if missing or expired"""
+        query = "SELECT response, expires_at FROM completion_cache WHERE cache_key = ?"
+        with self._lock:
+            result = self.db.fetch_one(query, (cache_key,))
+            if result and result["expires_at"] <= time.time():
+                self.db.execute(
+                    "DELETE FROM completion_cache WHERE cache_key = ?", (cache_key,)
+                )
+                self.db.connection.commit()
+                return None
+        return (result["response"], result["expires_at"]) if result else None
+
+    def set_response(self, cache_key: str, response: str, expires_at: float):
+        query = "INSERT OR REPLACE INTO completion_cache (cache_key, response, expires_at) VALUES (?, ?, ?)"
+        with self._lock:
+            self.db.execute(query, (cache_key, response, expires_at))
+            self._stores += 1
+            if self._stores % PURGE_INTERVAL == 0:
+                self._delete_expired()
+            self.db.connection.commit()
+
+    def delete_expired(self) -> int:
+        """
+        Delete every expired row.
+
+        Returns:
+            Number of rows deleted
+        """
+        with self._lock:
+            deleted = self._delete_expired()
+            self.db.connection.commit()
+        return deleted
+
+    def _delete_expired(self) -> int:
+        query = "DELETE FROM completion_cache WHERE expires_at <= ?"
+        return self.db.execute(query, (time.time(),)).rowcount
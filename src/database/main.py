@@ -13,8 +13,9 @@ class Database:
         connection (sqlite3.Connection): The SQLite database connection object.
 
     Methods:
-        __init__(db_name="db.sqlite3"):
+        __init__(db_name="db.sqlite3", check_same_thread=True):
             Initializes the Database instance, sets up the database name, and establishes a connection.
+            Pass check_same_thread=False to share the connection across threads (callers must serialize access).
         _connect():
             Establishes a connection to the SQLite database. Creates a new database file if it does not exist.
         close():
@@ -25,8 +26,9 @@ class Database:
         db.close()
     """
 
-    def __init__(self, db_name="db.sqlite3"):
+    def __init__(self, db_name="db.sqlite3", check_same_thread=True):
         self.db_name = db_name
+        self.check_same_thread = check_same_thread
         self.connection: Optional[sqlite3.Connection] = None
         self._connect()
 
@@ -35,7 +37,9 @@ class Database:
         db_exists = os.path.exists(self.db_name)
 
         # Connect to the SQLite database (creates a new one if it doesn't exist)
-        self.connection = sqlite3.connect(self.db_name)
+        self.connection = sqlite3.connect(
+            self.db_name, check_same_thread=self.check_same_thread
+        )
 
         if db_exists:
             print(f"Connected to existing database: {self.db_name}")
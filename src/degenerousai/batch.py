@@ -0,0 +1,64 @@
+"""
+Run a JSONL file of chat completion requests offline, in large batches.
+
+Each input line is a ChatCompletionRequest, either bare or as an OpenAI batch
+line (`custom_id`, `method`, `url`, `body`). Results are appended to the output
+file as each batch finishes; running the same command again after a crash or
+Ctrl-C skips the requests already in the output and continues from there.
+
+Usage (from src/):
+    python -m degenerousai.batch requests.jsonl
+    python -m degenerousai.batch requests.jsonl -o results.jsonl --batch-size 64
+"""
+
+import argparse
+import os
+
+from core.chat.batch import BatchRunner
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("input", help="JSONL file with one chat completion request per line")
+    parser.add_argument(
+        "-o", "--output", help="Results JSONL file (default: <input>.results.jsonl)"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        help="Most requests per generate call (default: DEGEN_OFFLINE_BATCH_SIZE)",
+    )
+    parser.add_argument(
+        "--max-batch-tokens",
+        type=int,
+        help="Most padded tokens per generate call (default: DEGEN_OFFLINE_BATCH_MAX_TOKENS)",
+    )
+    parser.add_argument(
+        "--restart", action="store_true", help="Discard existing results instead of resuming"
+    )
+    args = parser.parse_args()
+
+    output = args.output or f"{os.path.splitext(args.input)[0]}.results.jsonl"
+    if args.restart and os.path.exists(output):
+        os.remove(output)
+
+    runner = BatchRunner(
+        args.input,
+        output,
+        batch_size=args.batch_size,
+        max_batch_tokens=args.max_batch_tokens,
+        on_progress=lambda counts: print(
+            f"{counts.completed + counts.failed}/{counts.total} done ({counts.failed} failed)",
+            flush=True,
+        ),
+    )
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; run again to resume from {output}")
+        raise SystemExit(130)
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
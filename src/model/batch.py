@@ -0,0 +1,34 @@
+from pydantic import BaseModel, Field
+from typing import List, Literal, Optional
+
+
+class BatchRequestCounts(BaseModel):
+    total: int = 0
+    completed: int = 0
+    failed: int = 0
+
+
+class Batch(BaseModel):
+    """Offline batch of chat completion requests, in the shape of OpenAI's batch object"""
+
+    id: str
+    object: Literal["batch"] = "batch"
+    endpoint: str = "/v1/chat/completions"
+    status: Literal[
+        "validating", "in_progress", "completed", "failed", "cancelling", "cancelled"
+    ]
+    created_at: int
+    in_progress_at: Optional[int] = None
+    completed_at: Optional[int] = None
+    failed_at: Optional[int] = None
+    cancelled_at: Optional[int] = None
+    request_counts: BatchRequestCounts = Field(default_factory=BatchRequestCounts)
+    errors: List[str] = Field(
+        default_factory=list,
+        description="Errors that stopped the whole batch. Errors of single requests are in the output file.",
+    )
+
+
+class BatchList(BaseModel):
+    object: Literal["list"] = "list"
+    data: List[Batch]
@@ -1,9 +1,15 @@
 from enum import Enum
-from pydantic import BaseModel, Field
-from typing import List, Optional, Literal, Dict, Any, Sequence, Union
+from pydantic import AliasChoices, BaseModel, Field
+from typing import Iterator, List, Optional, Literal, Dict, Any, Sequence, Union
+import itertools
 import time
 import uuid
 
+from core.inference.cancellation import CancellationToken
+
+
+# Most stop sequences a request may give, as in OpenAI's API
+MAX_STOP_SEQUENCES = 4
 
 # Available models
 AVAILABLE_MODELS = [
@@ -44,12 +50,13 @@ class ChatCompletionResponseFormatJSONSchema(BaseModel):
         ...,
         description="The name of the function to call. This should match the name of the function in the schema.",
     )
-    description: str = Field(
-        ...,
+    description: Optional[str] = Field(
+        default=None,
         description="A description of the function. This should be a human-readable explanation of what the function does.",
     )
     json_schema: Dict[str, Any] = Field(
         ...,
+        validation_alias=AliasChoices("json_schema", "schema"),
         title="JSON Schema",
         description="The schema for the function. This should be a JSON schema that describes the parameters the function takes.",
     )
@@ -69,6 +76,24 @@ class ChatCompletionRequest(BaseModel):
     response_format: Optional[ChatCompletionResponseFormat] = None
     temperature: Optional[float] = 1.0
     max_tokens: Optional[int] = 256
+    stop: Optional[Union[str, List[str]]] = Field(
+        default=None,
+        description="Up to 4 sequences where the model stops generating. The returned text does not contain them.",
+    )
+    seed: Optional[int] = Field(
+        default=None,
+        description="If set, sampling is seeded so repeated requests with the same seed and parameters return the same result.",
+    )
+    stream: Optional[bool] = Field(
+        default=False,
+        description="If true, partial message deltas are sent as server-sent events as they are generated, followed by a final usage chunk.",
+    )
+    n: Optional[int] = Field(
+        default=1,
+        ge=1,
+        le=128,
+        description="How many chat completion choices to generate. The prompt is processed once for all of them; usage counts the tokens of every choice.",
+    )
 
 
 class ChatCompletionChoice(BaseModel):
@@ -94,6 +119,30 @@ class ChatCompletionResponse(BaseModel):
     usage: Optional[ChatCompletionUsage]
 
 
+class ChatCompletionChunkDelta(BaseModel):
+    role: Optional[RoleEnum] = None
+    content: Optional[str] = None
+
+
+class ChatCompletionChunkChoice(BaseModel):
+    index: int
+    delta: ChatCompletionChunkDelta
+    finish_reason: Optional[
+        Literal["stop", "length", "function_call", "content_filter"]
+    ] = None
+
+
+class ChatCompletionChunk(BaseModel):
+    """Streamed chunk of a chat completion (`stream: true`)"""
+
+    id: str
+    object: Literal["chat.completion.chunk"] = "chat.completion.chunk"
+    created: int
+    model: str
+    choices: List[ChatCompletionChunkChoice]
+    usage: Optional[ChatCompletionUsage] = None
+
+
 # Available models
 AVAILABLE_MODELS = [
     "openai/gpt-oss-20b",
@@ -110,88 +159,208 @@ class ChatCompletions:
         return AVAILABLE_MODELS
 
     @staticmethod
-    def create(request: ChatCompletionRequest) -> ChatCompletionResponse:
+    def create(
+        request: ChatCompletionRequest,
+        response_headers: Optional[Dict[str, str]] = None,
+        cancellation: Optional[CancellationToken] = None,
+    ) -> ChatCompletionResponse:
         """
         Create a chat completion using the specified model and parameters.
 
+        Deterministic requests (temperature 0 or a fixed seed) are answered from
+        the completion cache when an identical request was seen before.
+
         Args:
             request: ChatCompletionRequest containing model, messages, and parameters
+            response_headers: Optional dictionary that receives headers for the
+                HTTP response, e.g. `X-Cache: HIT` for cached completions and a
+                `Server-Timing` breakdown of where the time went
+            cancellation: Token set when the caller goes away; generation then
+                stops after the current token
 
         Returns:
             ChatCompletionResponse with the model's response
 
         Raises:
-            ValueError: If the specified model is not available
+            ValueError: If the specified model is not available or the stop
+                sequences are invalid
+            GenerationCancelled: If the request was cancelled
         """
-        if request.model not in AVAILABLE_MODELS:
-            raise ValueError(
-                f"Model '{request.model}' not available. Available models: {AVAILABLE_MODELS}"
+        ChatCompletions._validate_model(request.model)
+        ChatCompletions._validate_stop(request.stop)
+
+        # Import here to avoid circular imports
+        from core.chat.registry import model_registry
+        from core.chat.response_cache import completion_cache
+        from core.chat.scheduler import chat_scheduler
+        from core.inference.timing import StageTimer
+
+        headers = response_headers if response_headers is not None else {}
+        timer = StageTimer()
+
+        cache_key = None
+        if completion_cache.enabled and completion_cache.is_cacheable(request):
+            with timer.stage("cache_lookup"):
+                cache_key = completion_cache.make_key(request)
+                cached_response = completion_cache.get(cache_key)
+            if cached_response is not None:
+                headers["X-Cache"] = "HIT"
+                headers["Server-Timing"] = timer.server_timing()
+                timer.report(request.model)
+                return cached_response
+            headers["X-Cache"] = "MISS"
+        else:
+            headers["X-Cache"] = "BYPASS"
+
+        # Convert messages to the format expected by the chat model
+        messages = ChatCompletions._to_chat_messages(request)
+
+        generation_kwargs = {
+            "max_tokens": request.max_tokens if request.max_tokens else 256,
+            "temperature": request.temperature if request.temperature is not None else 1.0,
+            "seed": request.seed,
+            "stop": request.stop,
+            "timer": timer,
+            "cancellation": cancellation,
+        }
+        json_schema = ChatCompletions._json_schema(request)
+        if json_schema is not None:
+            # Constrained generation keeps per-request automaton state, so it
+            # runs on its own rather than in a scheduler batch
+            raw_response = model_registry.get(request.model).chat(
+                messages, n=request.n or 1, json_schema=json_schema, **generation_kwargs
+            )
+        elif request.n and request.n > 1:
+            # Several choices of one prompt already form a batch sharing a
+            # prefill, so they skip the scheduler
+            raw_response = model_registry.get(request.model).chat(
+                messages, n=request.n, **generation_kwargs
             )
+        else:
+            # Generate response through the batching scheduler, which reuses the
+            # shared model instance and groups concurrent requests
+            raw_response = chat_scheduler.chat(
+                request.model, messages=messages, **generation_kwargs
+            )
+
+        with timer.stage("response_build"):
+            response = ChatCompletions._build_response(request, raw_response)
+            if cache_key is not None:
+                completion_cache.set(cache_key, response)
+
+        headers["Server-Timing"] = timer.server_timing()
+        timer.report(request.model, raw_response.get("usage"))
+        return response
+
+    @staticmethod
+    def count_prompt_tokens(request: ChatCompletionRequest) -> int:
+        """
+        Count the prompt tokens of a request without generating anything.
+
+        Raises:
+            ValueError: If the specified model is not available or the stop
+                sequences are invalid
+        """
+        ChatCompletions._validate_model(request.model)
+        ChatCompletions._validate_stop(request.stop)
 
         # Import here to avoid circular imports
-        from src.core.chat.openai import OpenAIChat
+        from core.chat.registry import model_registry
 
-        # Initialize the chat model
-        chat_model = OpenAIChat(model=request.model)
+        messages = ChatCompletions._to_chat_messages(request)
+        return model_registry.get(request.model).count_prompt_tokens(messages)
 
-        # Convert messages to the format expected by the chat model
-        messages = []
-        for msg in request.messages:
-            message_dict = {"role": msg.role, "content": msg.content}
-            if msg.name:
-                message_dict["name"] = msg.name
-            if msg.function_call:
-                message_dict["function_call"] = {
-                    "name": msg.function_call.name,
-                    "arguments": msg.function_call.arguments,
-                }
-            messages.append(message_dict)
+    @staticmethod
+    def create_batch(
+        requests: List[ChatCompletionRequest],
+    ) -> List[ChatCompletionResponse]:
+        """
+        Create chat completions for several requests in one batched generate call.
 
-        # Generate response using the chat model
-        raw_response = chat_model.chat(
-            messages=messages,
-            max_tokens=request.max_tokens if request.max_tokens else 256,
-            temperature=request.temperature if request.temperature else 1.0,
-        )
+        Used for offline workloads: the requests go straight to the model
+        rather than through the scheduler and completion cache. They must share
+        the model and sampling settings and ask for a single free-text choice.
 
-        # Convert response to ChatCompletionResponse format
-        response_id = f"chatcmpl-{uuid.uuid4().hex[:29]}"
-        created_timestamp = int(time.time())
+        Args:
+            requests: Requests with the same model, temperature and seed
 
-        # Extract the generated content
-        if "choices" in raw_response and raw_response["choices"]:
-            generated_content = raw_response["choices"][0]["message"]["content"]
+        Returns:
+            One ChatCompletionResponse per request, in input order
 
-            # Clean up the content - remove the original prompt if it's included
-            # This is a simple heuristic to extract just the assistant's response
-            if "assistant:" in generated_content.lower():
-                parts = generated_content.split("assistant:", 1)
-                if len(parts) > 1:
-                    generated_content = parts[1].strip()
-        else:
-            generated_content = "No response generated"
+        Raises:
+            ValueError: If the model is not available, a request's stop
+                sequences are invalid or the requests cannot share a generate call
+        """
+        first = requests[0]
+        ChatCompletions._validate_model(first.model)
+        for request in requests:
+            ChatCompletions._validate_stop(request.stop)
+            if (request.model, request.temperature, request.seed) != (
+                first.model,
+                first.temperature,
+                first.seed,
+            ):
+                raise ValueError("Batched requests must share model, temperature and seed")
+            if (request.n or 1) > 1 or ChatCompletions._json_schema(request) is not None:
+                raise ValueError("Batched requests must ask for a single free-text choice")
 
-        # Create response message
-        response_message = ChatCompletionMessage(
-            role=RoleEnum.assistant, content=generated_content
+        # Import here to avoid circular imports
+        from core.chat.registry import model_registry
+
+        raw_responses = model_registry.get(first.model).chat_batch(
+            [ChatCompletions._to_chat_messages(request) for request in requests],
+            max_tokens=[request.max_tokens or 256 for request in requests],
+            temperature=first.temperature if first.temperature is not None else 1.0,
+            seed=first.seed,
+            stop=[request.stop for request in requests],
         )
+        return [
+            ChatCompletions._build_response(request, raw_response)
+            for request, raw_response in zip(requests, raw_responses)
+        ]
 
-        # Create choice
-        choice = ChatCompletionChoice(
-            index=0, message=response_message, finish_reason="stop"
-        )
+    @staticmethod
+    def _build_response(
+        request: ChatCompletionRequest, raw_response: Dict[str, Any]
+    ) -> ChatCompletionResponse:
+        """Convert a chat model result into a ChatCompletionResponse"""
+        response_id = f"chatcmpl-{uuid.uuid4().hex[:29]}"
+        created_timestamp = int(time.time())
 
-        # Estimate usage (simplified for now)
-        prompt_tokens = sum(
-            len(msg.content.split()) if msg.content else 0 for msg in request.messages
-        )
-        completion_tokens = len(generated_content.split()) if generated_content else 0
-        total_tokens = prompt_tokens + completion_tokens
+        # Extract the generated content of each choice; generation already
+        # stopped at the next turn marker or requested stop sequence
+        choices = []
+        for index, generated_choice in enumerate(raw_response.get("choices") or []):
+            generated_content = generated_choice["message"]["content"]
+            finish_reason = generated_choice.get("finish_reason", "stop")
+            if finish_reason == "error":
+                raise RuntimeError(generated_content)
+            choices.append(
+                ChatCompletionChoice(
+                    index=index,
+                    message=ChatCompletionMessage(
+                        role=RoleEnum.assistant, content=generated_content
+                    ),
+                    finish_reason=finish_reason,
+                )
+            )
+        if not choices:
+            choices.append(
+                ChatCompletionChoice(
+                    index=0,
+                    message=ChatCompletionMessage(
+                        role=RoleEnum.assistant, content="No response generated"
+                    ),
+                    finish_reason="stop",
+                )
+            )
 
+        # Usage counts the tokens fed to and produced by the model
+        raw_usage = raw_response.get("usage") or {}
         usage = ChatCompletionUsage(
-            prompt_tokens=prompt_tokens,
-            completion_tokens=completion_tokens,
-            total_tokens=total_tokens,
+            prompt_tokens=raw_usage.get("prompt_tokens", 0),
+            completion_tokens=raw_usage.get("completion_tokens", 0),
+            total_tokens=raw_usage.get("total_tokens", 0),
         )
 
         return ChatCompletionResponse(
@@ -199,10 +368,197 @@ class ChatCompletions:
             object="chat.completion",
             created=created_timestamp,
             model=request.model,
-            choices=[choice],
+            choices=choices,
             usage=usage,
         )
 
+    @staticmethod
+    def stream(
+        request: ChatCompletionRequest, cancellation: Optional[CancellationToken] = None
+    ) -> Iterator[ChatCompletionChunk]:
+        """
+        Create a streamed chat completion.
+
+        The model is resolved (and loaded if needed) before this returns, so an
+        unavailable model raises immediately rather than mid-stream. Closing the
+        returned iterator before it is exhausted cancels the generation.
+
+        Args:
+            request: ChatCompletionRequest containing model, messages, and parameters
+            cancellation: Token set when the caller goes away; generation then
+                stops after the current token
+
+        Returns:
+            Iterator of ChatCompletionChunk: a role chunk, one chunk per decoded text
+            delta, a chunk carrying the finish_reason and a final usage chunk
+
+        Raises:
+            ValueError: If the specified model is not available, the stop
+                sequences are invalid or more than one choice is requested
+            InferenceRejected: If the inference executor cannot take the request
+        """
+        ChatCompletions._validate_model(request.model)
+        ChatCompletions._validate_stop(request.stop)
+        if request.n and request.n > 1:
+            raise ValueError("Streaming supports a single choice only (n=1)")
+
+        # Import here to avoid circular imports
+        from transformers import TextIteratorStreamer
+
+        from core.chat.registry import model_registry
+        from core.chat.stopping import StopSequenceFilter
+        from core.inference.executor import inference_executor
+        from core.inference.timing import StageTimer
+
+        cancellation = cancellation or CancellationToken()
+        chat_model = model_registry.get(request.model)
+        messages = ChatCompletions._to_chat_messages(request)
+        json_schema = ChatCompletions._json_schema(request)
+        streamer = TextIteratorStreamer(
+            chat_model.tokenizer, skip_prompt=True, skip_special_tokens=True
+        )
+
+        response_id = f"chatcmpl-{uuid.uuid4().hex[:29]}"
+        created_timestamp = int(time.time())
+
+        def chunk(
+            delta: ChatCompletionChunkDelta, finish_reason: Optional[str] = None
+        ) -> ChatCompletionChunk:
+            return ChatCompletionChunk(
+                id=response_id,
+                created=created_timestamp,
+                model=request.model,
+                choices=[
+                    ChatCompletionChunkChoice(
+                        index=0, delta=delta, finish_reason=finish_reason
+                    )
+                ],
+            )
+
+        # Headers are sent before generation ends, so stage timings are only
+        # recorded as metrics (and logged), not sent as Server-Timing
+        timer = StageTimer()
+
+        def generate(result: Dict[str, Any]):
+            timer.add("queue", timer.total())
+            try:
+                result.update(
+                    chat_model.chat(
+                        messages=messages,
+                        max_tokens=request.max_tokens if request.max_tokens else 256,
+                        temperature=(
+                            request.temperature
+                            if request.temperature is not None
+                            else 1.0
+                        ),
+                        seed=request.seed,
+                        stop=request.stop,
+                        json_schema=json_schema,
+                        streamer=streamer,
+                        timer=timer,
+                        cancellation=cancellation,
+                    )
+                )
+            finally:
+                # Unblock the consumer even if generation failed before streaming
+                streamer.end()
+
+        # Generation runs on the bounded inference executor; a full queue is
+        # rejected here, before the response has started
+        result: Dict[str, Any] = {}
+        generation = inference_executor.submit(generate, result)
+
+        def generated_chunks() -> Iterator[ChatCompletionChunk]:
+            yield chunk(ChatCompletionChunkDelta(role=RoleEnum.assistant, content=""))
+
+            # A stop sequence is streamed before generation notices it; hold back
+            # text until it is clear it is not part of one
+            stop_filter = StopSequenceFilter(chat_model.stop_sequences(request.stop))
+
+            # The non-streamed response is stripped; drop leading whitespace to match
+            started = False
+            for text in itertools.chain(
+                (stop_filter.feed(text) for text in streamer), [stop_filter.flush()]
+            ):
+                if not started:
+                    text = text.lstrip()
+                    started = bool(text)
+                if text:
+                    yield chunk(ChatCompletionChunkDelta(content=text))
+
+            generation.result()
+
+            choice = result.get("choices", [{}])[0]
+            if choice.get("finish_reason") == "error":
+                raise RuntimeError(choice["message"]["content"])
+
+            yield chunk(ChatCompletionChunkDelta(), choice.get("finish_reason", "stop"))
+
+            usage = result.get("usage")
+            timer.report(request.model, usage)
+            yield ChatCompletionChunk(
+                id=response_id,
+                created=created_timestamp,
+                model=request.model,
+                choices=[],
+                usage=ChatCompletionUsage(**usage) if usage else None,
+            )
+
+        def chunks() -> Iterator[ChatCompletionChunk]:
+            try:
+                yield from generated_chunks()
+            except GeneratorExit:
+                # The consumer stopped reading, so the rest is not wanted
+                cancellation.cancel()
+                raise
+
+        return chunks()
+
+    @staticmethod
+    def _validate_model(model: str) -> None:
+        if model not in AVAILABLE_MODELS:
+            raise ValueError(
+                f"Model '{model}' not available. Available models: {AVAILABLE_MODELS}"
+            )
+
+    @staticmethod
+    def _validate_stop(stop: Optional[Union[str, List[str]]]) -> None:
+        sequences = [stop] if isinstance(stop, str) else stop or []
+        if len(sequences) > MAX_STOP_SEQUENCES:
+            raise ValueError(
+                f"stop accepts at most {MAX_STOP_SEQUENCES} sequences, got {len(sequences)}"
+            )
+        if any(not sequence for sequence in sequences):
+            raise ValueError("stop sequences must not be empty")
+
+    @staticmethod
+    def _json_schema(request: ChatCompletionRequest) -> Optional[Dict[str, Any]]:
+        """Get the schema the completion is constrained to, or None for free text"""
+        response_format = request.response_format
+        if response_format is None or response_format.type == "text":
+            return None
+        if response_format.type == "json_object":
+            return {"type": "object"}
+        if response_format.json_schema is None:
+            raise ValueError("response_format of type json_schema requires a json_schema")
+        return response_format.json_schema.json_schema
+
+    @staticmethod
+    def _to_chat_messages(request: ChatCompletionRequest) -> List[Dict[str, Any]]:
+        """Convert request messages to the format expected by the chat model"""
+        messages = []
+        for msg in request.messages:
+            message_dict = {"role": msg.role, "content": msg.content}
+            if msg.name:
+                message_dict["name"] = msg.name
+            if msg.function_call:
+                message_dict["function_call"] = {
+                    "name": msg.function_call.name,
+                    "arguments": msg.function_call.arguments,
+                }
+            messages.append(message_dict)
+        return messages
+
 
 # Convenience function for direct usage
 def create_chat_completion(
@@ -58,7 +58,7 @@ class CreateSpeechRequest(BaseModel):
     download_format: Optional[Literal["mp3", "opus", "aac", "flac", "wav", "pcm"]] = (
         Field(
             default=None,
-            description="Optional different format for the final download. If not provided, uses response_format.",
+            description="Optional different format for the final download, used instead of response_format when stream is false. Streamed audio is always sent in response_format.",
         )
     )
 
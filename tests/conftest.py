@@ -0,0 +1,110 @@
+import os
+import sys
+
+import threading
+
+import numpy as np
+import pytest
+import torch
+from transformers import GPT2Config, GPT2LMHeadModel
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+# Keep test runs from writing to the user's caches
+os.environ.setdefault("DEGEN_WEIGHT_CACHE", "false")
+os.environ.setdefault("DEGEN_COMPLETION_CACHE_DB", "")
+os.environ.setdefault("DEGEN_TTS_RESPONSE_CACHE_MB", "0")
+os.environ.setdefault("DEGEN_TTS_SEGMENT_CACHE_DIR", "")
+
+from tiny_model import build_layer_skip_draft, build_tiny_model  # noqa: E402
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant. Keep responses concise."},
+    {"role": "user", "content": "What is the capital of France?"},
+]
+
+
+@pytest.fixture(scope="session")
+def tiny_model_path(tmp_path_factory) -> str:
+    """
+    Directory of a tiny randomly initialised GPT-2 and its tokenizer.
+
+    The weights are drawn wider than GPT-2's initialisation, which would make
+    greedy decoding repeat one token, so completions vary from token to token.
+    """
+    path = build_tiny_model(path=str(tmp_path_factory.mktemp("models") / "tiny-gpt2"))
+    config = GPT2Config.from_pretrained(path)
+    config.initializer_range = 0.3
+    torch.manual_seed(0)
+    GPT2LMHeadModel(config).save_pretrained(path)
+    return path
+
+
+@pytest.fixture(scope="session")
+def draft_model_path(tiny_model_path) -> str:
+    """Draft model made of the first block of the tiny model"""
+    return build_layer_skip_draft(tiny_model_path)
+
+
+@pytest.fixture(scope="session")
+def chat_model(tiny_model_path):
+    """The tiny model behind OpenAIChat, without a prefix cache"""
+    from core.chat.openai import OpenAIChat
+
+    return OpenAIChat(model=tiny_model_path, use_cpu=True, prefix_cache_mb=0)
+
+
+@pytest.fixture
+def messages():
+    return [dict(message) for message in MESSAGES]
+
+
+class FakeResult:
+    def __init__(self, text: str):
+        self.graphemes = self.phonemes = text
+        self.audio = (0.2 * np.sin(np.arange(2400) / 5)).astype(np.float32)
+
+
+class FakePipeline:
+    """Kokoro pipeline that returns a short tone per sentence and records its calls"""
+
+    def __init__(self):
+        self.calls = 0
+        # Sentences run through G2P and the model, and phonemes run through the model alone
+        self.sentences = []
+        self.tokens = []
+        self.voices = []
+        # Called with every sentence before it is synthesized
+        self.on_sentence = None
+
+    def __call__(self, sentences, voice, speed):
+        self.calls += 1
+        for sentence in sentences:
+            if self.on_sentence is not None:
+                self.on_sentence(sentence)
+            self.sentences.append(sentence)
+            yield FakeResult(sentence)
+
+    def generate_from_tokens(self, tokens, voice, speed):
+        self.tokens.append(tokens)
+        yield FakeResult(tokens)
+
+    def load_voice(self, voice):
+        self.voices.append(voice)
+
+
+@pytest.fixture
+def pipeline(monkeypatch):
+    """FakePipeline serving English speech for the TTS service"""
+    from api.services import tts
+    from core.tts import kokoro
+    from core.tts.segment_cache import SegmentCache
+
+    # Without sentence caching, every synthesized response calls the pipeline
+    monkeypatch.setattr(kokoro, "segment_cache", SegmentCache(max_bytes=0, disk_dir=""))
+    pipeline = FakePipeline()
+    monkeypatch.setitem(tts.kokoro_tts._pipelines, "a", pipeline)
+    monkeypatch.setitem(tts.kokoro_tts._pipeline_locks, "a", threading.Lock())
+    return pipeline
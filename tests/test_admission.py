@@ -0,0 +1,72 @@
+import threading
+
+import pytest
+
+from core.chat import openai
+from core.inference.admission import AdmissionController, AdmissionTimeout, RequestTooLarge
+
+MB = 1024**2
+
+
+def test_requests_larger_than_the_budget_are_rejected():
+    controller = AdmissionController(budget_mb=1, timeout_s=1)
+
+    with pytest.raises(RequestTooLarge):
+        controller.acquire(2 * MB)
+
+    stats = controller.get_stats()
+    assert (stats["rejected"], stats["admitted"], stats["in_use_bytes"]) == (1, 0, 0)
+
+
+def test_waiting_request_times_out_while_memory_is_held():
+    controller = AdmissionController(budget_mb=1, timeout_s=0.05)
+
+    with controller.admit(MB // 2 + 1):
+        with pytest.raises(AdmissionTimeout):
+            controller.acquire(MB // 2)
+
+    stats = controller.get_stats()
+    assert (stats["admitted"], stats["queued"], stats["timeouts"]) == (1, 1, 1)
+    assert stats["in_use_bytes"] == 0 and stats["waiting"] == 0
+
+
+def test_waiting_request_is_admitted_once_memory_is_released():
+    controller = AdmissionController(budget_mb=1, timeout_s=5)
+    controller.acquire(MB)
+
+    admitted = threading.Event()
+    waiter = threading.Thread(target=lambda: (controller.acquire(MB), admitted.set()))
+    waiter.start()
+    assert not admitted.wait(0.1)
+
+    controller.release(MB)
+    waiter.join(timeout=5)
+    assert admitted.is_set()
+    assert controller.get_stats()["peak_bytes"] == MB
+
+
+def test_chat_rejects_requests_beyond_a_small_budget(chat_model, messages, monkeypatch):
+    reserved = chat_model.estimate_memory(_prompt_tokens(chat_model, messages), 16)
+    controller = AdmissionController(budget_mb=(reserved - 1) / MB, timeout_s=1)
+    monkeypatch.setattr(openai, "admission_controller", controller)
+
+    with pytest.raises(RequestTooLarge):
+        chat_model.chat(messages, max_tokens=16, temperature=0)
+    assert controller.get_stats()["rejected"] == 1
+
+
+def test_batches_beyond_the_budget_run_in_halves(chat_model, messages, monkeypatch):
+    expected = chat_model.chat(messages, max_tokens=8, temperature=0)
+
+    single = chat_model.estimate_memory(_prompt_tokens(chat_model, messages), 8)
+    controller = AdmissionController(budget_mb=single * 1.5 / MB, timeout_s=1)
+    monkeypatch.setattr(openai, "admission_controller", controller)
+
+    results = chat_model.chat_batch([messages, messages], max_tokens=8, temperature=0)
+    assert [result["choices"] for result in results] == [expected["choices"]] * 2
+    stats = controller.get_stats()
+    assert (stats["admitted"], stats["rejected"], stats["peak_bytes"]) == (2, 0, single)
+
+
+def _prompt_tokens(chat: openai.OpenAIChat, messages) -> int:
+    return len(chat.token_cache.encode(chat._prompt_pieces(messages)))
@@ -0,0 +1,201 @@
+import json
+
+import pytest
+
+from core.chat import batch as batch_module
+from core.chat.batch import BatchItem, BatchRunner, read_results
+from model.chat_completions import (
+    ChatCompletionChoice,
+    ChatCompletionMessage,
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+)
+
+
+class FakeCompletions:
+    """
+    Stands in for ChatCompletions: prompts are as many tokens as their text
+    has characters, and every completion echoes its prompt.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    @staticmethod
+    def count_prompt_tokens(request):
+        return len(request.messages[-1].content)
+
+    def create(self, request):
+        self.calls.append(("create", [request.messages[-1].content]))
+        return self._respond(request)
+
+    def create_batch(self, requests):
+        prompts = [request.messages[-1].content for request in requests]
+        self.calls.append(("create_batch", prompts))
+        if len(prompts) > 1 and "fail" in prompts:
+            raise RuntimeError("Batch failed")
+        return [self._respond(request) for request in requests]
+
+    def _respond(self, request):
+        if request.messages[-1].content == "fail":
+            raise ValueError("Bad request")
+        return ChatCompletionResponse(
+            id="chatcmpl-test",
+            object="chat.completion",
+            created=0,
+            model=request.model,
+            choices=[
+                ChatCompletionChoice(
+                    index=0,
+                    message=ChatCompletionMessage(
+                        role="assistant", content=request.messages[-1].content
+                    ),
+                    finish_reason="stop",
+                )
+            ],
+            usage=None,
+        )
+
+
+@pytest.fixture
+def completions(monkeypatch):
+    fake = FakeCompletions()
+    monkeypatch.setattr(batch_module, "ChatCompletions", fake)
+    return fake
+
+
+def line(custom_id: str, prompt: str, **body) -> str:
+    return json.dumps(
+        {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": "openai/gpt-oss-20b",
+                "messages": [{"role": "user", "content": prompt}],
+                "max_tokens": 4,
+                **body,
+            },
+        }
+    )
+
+
+def run(tmp_path, lines, **options):
+    input_path = tmp_path / "input.jsonl"
+    output_path = tmp_path / "output.jsonl"
+    input_path.write_text("".join(f"{text}\n" for text in lines))
+    counts = BatchRunner(str(input_path), str(output_path), **options).run()
+    records = [json.loads(text) for text in output_path.read_text().splitlines()]
+    return counts, {record["custom_id"]: record for record in records}
+
+
+def test_requests_are_bucketed_by_sampling_and_length(tmp_path, completions):
+    lines = [
+        line("a", "x" * 10, temperature=0),
+        line("b", "x" * 30, temperature=0),
+        line("c", "x" * 20, temperature=0),
+        line("d", "x" * 5, temperature=0.7, seed=1),
+    ]
+    counts, records = run(tmp_path, lines, batch_size=2)
+
+    assert (counts.total, counts.completed, counts.failed) == (4, 4, 0)
+    assert all(record["response"]["status_code"] == 200 for record in records.values())
+    # Longest first within a group; greedy and seeded requests never share a call
+    assert completions.calls == [
+        ("create_batch", ["x" * 30, "x" * 20]),
+        ("create_batch", ["x" * 10]),
+        ("create_batch", ["x" * 5]),
+    ]
+
+
+def test_invalid_lines_get_error_records(tmp_path, completions):
+    lines = [
+        "not json",
+        line("a", "hi").replace("/v1/chat/completions", "/v1/embeddings"),
+        json.dumps({"custom_id": "b", "body": {"model": "m"}}),
+        line("c", "hi"),
+        line("c", "again"),
+    ]
+    counts, records = run(tmp_path, lines)
+
+    assert (counts.total, counts.completed, counts.failed) == (5, 1, 4)
+    assert set(records) == {"line-1", "line-2", "line-3", "c", "line-5"}
+    for custom_id in ("line-1", "line-2", "line-3", "line-5"):
+        assert records[custom_id]["error"]["code"] == "invalid_request"
+    assert records["c"]["response"]["body"]["choices"][0]["message"]["content"] == "hi"
+
+
+def test_unbatchable_requests_run_alone(tmp_path, completions):
+    lines = [
+        line("a", "one", n=2),
+        line("b", "two", response_format={"type": "json_object"}),
+        line("c", "three"),
+    ]
+    counts, _ = run(tmp_path, lines)
+
+    assert counts.completed == 3
+    assert completions.calls == [
+        ("create_batch", ["three"]),
+        ("create", ["one"]),
+        ("create", ["two"]),
+    ]
+
+
+def test_failed_bucket_is_retried_one_request_at_a_time(tmp_path, completions):
+    counts, records = run(tmp_path, [line("a", "fine"), line("b", "fail")])
+
+    assert (counts.completed, counts.failed) == (1, 1)
+    assert records["b"]["error"]["code"] == "invalid_request"
+    assert [call[0] for call in completions.calls] == ["create_batch"] * 3
+
+
+def test_run_resumes_after_a_truncated_line(tmp_path, completions):
+    lines = [line("a", "one"), line("b", "two"), line("c", "three")]
+    run(tmp_path, lines[:1])
+    output_path = tmp_path / "output.jsonl"
+    # A crash while the next result was being written
+    with open(output_path, "a") as output:
+        output.write('{"id": "batch_req_x", "custom_id": "b", "resp')
+
+    completions.calls.clear()
+    counts, records = run(tmp_path, lines)
+
+    assert (counts.total, counts.completed, counts.failed) == (3, 3, 0)
+    assert set(records) == {"a", "b", "c"}
+    assert completions.calls == [("create_batch", ["three", "two"])]
+
+
+def test_buckets_respect_batch_size_and_token_budget(completions):
+    items = [
+        BatchItem(
+            f"item-{index}",
+            ChatCompletionRequest(
+                model="m",
+                messages=[{"role": "user", "content": "x" * prompt_tokens}],
+                max_tokens=10,
+            ),
+        )
+        for index, prompt_tokens in enumerate([100, 90, 80, 20, 10, 5])
+    ]
+    runner = BatchRunner("unused", "unused", batch_size=3, max_batch_tokens=300)
+
+    buckets = runner._buckets(items, output=None)
+
+    assert [[item.custom_id for item in bucket] for bucket in buckets] == [
+        ["item-0", "item-1"],
+        ["item-2", "item-3", "item-4"],
+        ["item-5"],
+    ]
+    for bucket in buckets:
+        assert len(bucket) <= 3
+        assert len(bucket) * (bucket[0].prompt_tokens + 10) <= 300
+
+
+def test_read_results_cuts_off_a_partial_line(tmp_path):
+    path = tmp_path / "output.jsonl"
+    complete = json.dumps({"custom_id": "a", "error": None}) + "\n"
+    failed = json.dumps({"custom_id": "b", "error": {"code": "server_error"}}) + "\n"
+    path.write_text(complete + failed + '{"custom_id": "c", "err')
+
+    assert read_results(str(path)) == {"a": True, "b": False}
+    assert path.read_text() == complete + failed
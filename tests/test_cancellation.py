@@ -0,0 +1,88 @@
+import functools
+
+import pytest
+
+from core.inference.cancellation import (
+    CancellationToken,
+    GenerationCancelled,
+    cancellation_stats,
+)
+
+MAX_TOKENS = 24
+# Decoding step during which the client goes away
+CANCEL_AT = 5
+
+
+def chat_stats():
+    return cancellation_stats.get_stats()["chat"]
+
+
+def cancel_during_step(chat_model, monkeypatch) -> CancellationToken:
+    """Get a token that is cancelled while the model runs decoding step CANCEL_AT"""
+    model = chat_model.pipe.model
+    forward = model.forward
+    cancellation = CancellationToken()
+    steps = []
+
+    @functools.wraps(forward)
+    def cancelling_forward(*args, **kwargs):
+        steps.append(None)
+        if len(steps) == CANCEL_AT:
+            cancellation.cancel()
+        return forward(*args, **kwargs)
+
+    monkeypatch.setattr(model, "forward", cancelling_forward)
+    return cancellation
+
+
+def test_request_cancelled_while_queued_never_generates(chat_model, messages, monkeypatch):
+    def generate(*args, **kwargs):
+        raise AssertionError("A cancelled request was generated")
+
+    monkeypatch.setattr(chat_model.pipe.model, "generate", generate)
+    before = chat_stats()
+    cancellation = CancellationToken()
+    cancellation.cancel()
+
+    with pytest.raises(GenerationCancelled):
+        chat_model.chat(messages, max_tokens=MAX_TOKENS, cancellation=cancellation)
+    assert chat_stats()["queued"] == before["queued"] + 1
+
+
+def test_running_request_stops_after_the_current_token(chat_model, messages, monkeypatch):
+    expected = chat_model.chat(messages, max_tokens=MAX_TOKENS, temperature=0)
+    assert expected["usage"]["completion_tokens"] > CANCEL_AT
+
+    cancellation = cancel_during_step(chat_model, monkeypatch)
+    before = chat_stats()
+    with pytest.raises(GenerationCancelled):
+        chat_model.chat(
+            messages, max_tokens=MAX_TOKENS, temperature=0, cancellation=cancellation
+        )
+
+    after = chat_stats()
+    assert after["running"] == before["running"] + 1
+    assert after["tokens_avoided"] == before["tokens_avoided"] + MAX_TOKENS - CANCEL_AT
+
+
+def test_cancelled_row_stops_while_the_rest_of_its_batch_finishes(
+    chat_model, messages, monkeypatch
+):
+    other = [*messages[:1], {"role": "user", "content": "Name a colour."}]
+    expected = chat_model.chat_batch([messages, other], max_tokens=MAX_TOKENS, temperature=0)
+    assert all(result["usage"]["completion_tokens"] > CANCEL_AT for result in expected)
+
+    cancellation = cancel_during_step(chat_model, monkeypatch)
+    before = chat_stats()
+    results = chat_model.chat_batch(
+        [messages, other],
+        max_tokens=MAX_TOKENS,
+        temperature=0,
+        cancellations=[cancellation, None],
+    )
+
+    assert results[0]["usage"]["completion_tokens"] == CANCEL_AT
+    assert results[1]["choices"] == expected[1]["choices"]
+    after = chat_stats()
+    assert after["running"] == before["running"] + 1
+    assert after["tokens_avoided"] == before["tokens_avoided"] + MAX_TOKENS - CANCEL_AT
@@ -0,0 +1,61 @@
+import functools
+
+import pytest
+
+
+@pytest.fixture
+def prefills(chat_model, monkeypatch):
+    """Lengths of the multi-token inputs (prefills) the model runs"""
+    model = chat_model.pipe.model
+    forward = model.forward
+    lengths = []
+
+    @functools.wraps(forward)
+    def counting_forward(*args, **kwargs):
+        input_ids = kwargs.get("input_ids")
+        if input_ids is not None and input_ids.shape[1] > 1:
+            lengths.append(input_ids.shape[1])
+        return forward(*args, **kwargs)
+
+    monkeypatch.setattr(model, "forward", counting_forward)
+    return lengths
+
+
+def test_choices_share_one_prefill(chat_model, messages, monkeypatch, prefills):
+    choices = []
+    build_result = chat_model._build_result
+
+    def recording_build_result(*args, **kwargs):
+        result = build_result(*args, **kwargs)
+        choices.append(result["usage"]["completion_tokens"])
+        return result
+
+    monkeypatch.setattr(chat_model, "_build_result", recording_build_result)
+    result = chat_model.chat(messages, max_tokens=8, temperature=1.0, seed=1, n=3)
+
+    assert [choice["index"] for choice in result["choices"]] == [0, 1, 2]
+    assert len(prefills) == 1
+    usage = result["usage"]
+    assert usage["completion_tokens"] == sum(choices) and len(choices) == 3
+    assert usage["total_tokens"] == usage["prompt_tokens"] + usage["completion_tokens"]
+
+
+def test_seeded_choices_are_reproducible_and_distinct(chat_model, messages):
+    first = chat_model.chat(messages, max_tokens=12, temperature=1.0, seed=11, n=3)
+    second = chat_model.chat(messages, max_tokens=12, temperature=1.0, seed=11, n=3)
+
+    assert first["choices"] == second["choices"]
+    contents = [choice["message"]["content"] for choice in first["choices"]]
+    assert len(set(contents)) == 3
+
+
+def test_greedy_choices_are_generated_once(chat_model, messages, prefills):
+    result = chat_model.chat(messages, max_tokens=8, temperature=0, n=3)
+    single = chat_model.chat(messages, max_tokens=8, temperature=0)
+
+    assert len(prefills) == 2
+    assert [choice["index"] for choice in result["choices"]] == [0, 1, 2]
+    assert all(
+        choice["message"] == single["choices"][0]["message"] for choice in result["choices"]
+    )
+    assert result["usage"]["completion_tokens"] == 3 * single["usage"]["completion_tokens"]
@@ -0,0 +1,64 @@
+import functools
+
+import pytest
+from transformers import CompileConfig, StaticCache
+
+from core.inference import compile
+from core.inference.compile import CompiledExecution
+from tests.test_constrained import SCHEMA
+
+CASES = [
+    {"temperature": 0, "json_schema": SCHEMA},
+    {"temperature": 1.0, "seed": 5, "json_schema": SCHEMA},
+    {"temperature": 1.0, "seed": 7},
+]
+
+
+def fail_compiled_decoding(chat_model, monkeypatch) -> CompiledExecution:
+    """Turn on compiled decoding that fails after a few steps, on the static key/value cache only"""
+    monkeypatch.setattr(compile, "enable_compile_cache", lambda: None)
+    execution = CompiledExecution("tiny")
+    monkeypatch.setattr(chat_model, "compiled", execution, raising=False)
+    # Without `_compile_all_devices`, generate runs the static cache eagerly on CPU
+    monkeypatch.setattr(chat_model, "_compile_config", CompileConfig(), raising=False)
+
+    model = chat_model.pipe.model
+    forward = model.forward
+    static_steps = []
+
+    @functools.wraps(forward)
+    def failing_forward(*args, **kwargs):
+        if isinstance(kwargs.get("past_key_values"), StaticCache):
+            static_steps.append(1)
+            if len(static_steps) == 3:
+                raise RuntimeError("compiled graph failed")
+        return forward(*args, **kwargs)
+
+    monkeypatch.setattr(model, "forward", failing_forward)
+    return execution
+
+
+@pytest.mark.parametrize("sampling", CASES)
+def test_fallback_matches_eager_generation(chat_model, messages, sampling, monkeypatch):
+    expected = chat_model.chat(messages, max_tokens=48, **sampling)
+
+    execution = fail_compiled_decoding(chat_model, monkeypatch)
+    result = chat_model.chat(messages, max_tokens=48, **sampling)
+
+    assert execution.get_stats()["fallbacks"] == 1 and not execution.enabled
+    assert result["choices"] == expected["choices"]
+    assert result["usage"] == expected["usage"]
+
+
+def test_batch_fallback_matches_eager_generation(chat_model, messages, monkeypatch):
+    other = [*messages[:1], {"role": "user", "content": "Name a colour."}]
+    expected = chat_model.chat_batch([messages, other], max_tokens=24, seed=3)
+
+    execution = fail_compiled_decoding(chat_model, monkeypatch)
+    results = chat_model.chat_batch([messages, other], max_tokens=24, seed=3)
+
+    assert execution.get_stats()["fallbacks"] == 1
+    assert [result["choices"] for result in results] == [
+        result["choices"] for result in expected
+    ]
+
@@ -0,0 +1,166 @@
+import time
+
+import pytest
+import torch
+
+from core.chat.response_cache import CompletionCache
+from database import completion_cache
+from database.completion_cache import CompletionCacheDB
+from model.chat_completions import (
+    ChatCompletionChoice,
+    ChatCompletionMessage,
+    ChatCompletionRequest,
+    ChatCompletionResponse,
+)
+
+
+def make_request(**fields) -> ChatCompletionRequest:
+    return ChatCompletionRequest(
+        model="openai/gpt-oss-20b",
+        messages=[{"role": "user", "content": "What is the capital of France?"}],
+        **fields,
+    )
+
+
+def make_response(content: str = "Paris.") -> ChatCompletionResponse:
+    return ChatCompletionResponse(
+        id="chatcmpl-test",
+        object="chat.completion",
+        created=0,
+        model="openai/gpt-oss-20b",
+        choices=[
+            ChatCompletionChoice(
+                index=0,
+                message=ChatCompletionMessage(role="assistant", content=content),
+                finish_reason="stop",
+            )
+        ],
+        usage=None,
+    )
+
+
+def test_only_deterministic_requests_are_cacheable():
+    assert CompletionCache.is_cacheable(make_request(temperature=0))
+    assert CompletionCache.is_cacheable(make_request(temperature=0.8, seed=1))
+    assert not CompletionCache.is_cacheable(make_request(temperature=0.8))
+
+
+def test_key_ignores_stream_and_defaults():
+    key = CompletionCache.make_key(make_request(temperature=0))
+    assert key == CompletionCache.make_key(make_request(temperature=0, stream=True))
+    assert key == CompletionCache.make_key(make_request(temperature=0, max_tokens=256))
+    assert key != CompletionCache.make_key(make_request(temperature=0, max_tokens=16))
+
+
+def test_hit_and_miss():
+    cache = CompletionCache(max_entries=8, ttl_s=60, db=None)
+    key = cache.make_key(make_request(temperature=0))
+
+    assert cache.get(key) is None
+    cache.set(key, make_response())
+    assert cache.get(key) == make_response()
+
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (1, 1, 1)
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    cache = CompletionCache(max_entries=8, ttl_s=60, db=None)
+    cache.set("key", make_response())
+
+    now[0] += 59
+    assert cache.get("key") is not None
+    now[0] += 2
+    assert cache.get("key") is None
+    assert cache.get_stats()["entries"] == 0
+
+
+def test_least_recently_used_entry_is_dropped():
+    cache = CompletionCache(max_entries=2, ttl_s=60, db=None)
+    cache.set("a", make_response("a"))
+    cache.set("b", make_response("b"))
+    cache.get("a")
+    cache.set("c", make_response("c"))
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None and cache.get("c") is not None
+
+
+def test_db_hit_keeps_its_expiry(monkeypatch, tmp_path):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    db = CompletionCacheDB(str(tmp_path / "cache.sqlite3"))
+    CompletionCache(max_entries=8, ttl_s=60, db=db).set("key", make_response())
+
+    # A new process finds the entry in the database, 50s into its lifetime
+    now[0] += 50
+    cache = CompletionCache(max_entries=8, ttl_s=60, db=db)
+    assert cache.get("key") is not None
+    assert cache.get_stats()["db_hits"] == 1
+
+    # Promoted to memory, it still expires 60s after it was stored
+    now[0] += 11
+    assert cache.get("key") is None
+
+
+def test_expired_rows_are_purged_on_startup_and_periodically(monkeypatch, tmp_path):
+    now = [1000.0]
+    monkeypatch.setattr(time, "time", lambda: now[0])
+    path = str(tmp_path / "cache.sqlite3")
+    db = CompletionCacheDB(path)
+    db.set_response("old", "{}", expires_at=1010.0)
+    db.set_response("new", "{}", expires_at=2000.0)
+
+    now[0] += 20
+    db = CompletionCacheDB(path)
+    assert _keys(db) == ["new"]
+
+    db.set_response("soon", "{}", expires_at=1030.0)
+    now[0] += 20
+    for index in range(completion_cache.PURGE_INTERVAL - 2):
+        db.set_response(f"key-{index}", "{}", expires_at=2000.0)
+    assert "soon" in _keys(db)
+    db.set_response("last", "{}", expires_at=2000.0)
+    assert "soon" not in _keys(db)
+
+
+def test_request_path_does_not_log_commits(tmp_path, capsys):
+    db = CompletionCacheDB(str(tmp_path / "cache.sqlite3"))
+    capsys.readouterr()
+
+    db.set_response("key", "{}", expires_at=time.time() + 60)
+    assert db.get_response("key") is not None
+    assert capsys.readouterr().out == ""
+
+
+def test_seed_reproduces_completion(chat_model, messages):
+    def sample(seed):
+        result = chat_model.chat(messages, max_tokens=12, temperature=1.0, seed=seed)
+        return result["choices"][0]["message"]["content"]
+
+    first = sample(7)
+    # Draws from the global generator in between do not change seeded sampling
+    torch.rand(1000)
+    assert sample(7) == first
+    assert sample(8) != first
+
+
+def test_seeded_row_does_not_depend_on_its_batch(chat_model, messages):
+    other = [{"role": "user", "content": "Explain machine learning in one sentence."}]
+    alone = chat_model.chat(messages, max_tokens=12, temperature=1.0, seed=7)
+    batched = chat_model.chat_batch([other, messages], max_tokens=12, temperature=1.0, seed=7)
+
+    assert batched[1]["choices"] == alone["choices"]
+
+
+@pytest.mark.parametrize("n", [1, 3])
+def test_seeded_choices_are_reproducible(chat_model, messages, n):
+    first = chat_model.chat(messages, max_tokens=8, temperature=1.0, seed=3, n=n)
+    second = chat_model.chat(messages, max_tokens=8, temperature=1.0, seed=3, n=n)
+    assert first["choices"] == second["choices"]
+
+
+def _keys(db: CompletionCacheDB):
+    return [row["cache_key"] for row in db.db.fetch_all("SELECT cache_key FROM completion_cache")]
@@ -0,0 +1,118 @@
+import json
+
+import pytest
+import torch
+
+from core.chat.constrained import (
+    AutomatonCache,
+    CharAutomaton,
+    JSONSchemaLogitsProcessor,
+    TokenAutomaton,
+    Vocabulary,
+    _SchemaCompiler,
+    _TrieNode,
+)
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "answer": {"enum": ["yes", "no"]},
+        "count": {"type": "integer"},
+        "sure": {"type": "boolean"},
+    },
+    "required": ["answer", "sure"],
+}
+
+EOS = 0
+
+
+def fake_vocabulary(texts):
+    """Vocabulary of the given token texts, with token 0 as end-of-sequence"""
+    vocabulary = Vocabulary.__new__(Vocabulary)
+    vocabulary.size = max(texts) + 1
+    vocabulary.eos_token_ids = {EOS}
+    vocabulary.texts = dict(texts)
+    vocabulary.root = _TrieNode()
+    for token_id, text in texts.items():
+        node = vocabulary.root
+        for char in text:
+            node = node.children.setdefault(char, _TrieNode())
+        node.token_ids.append(token_id)
+    return vocabulary
+
+
+def compile_automaton(schema, vocabulary, max_states=None):
+    nfa, initial, accept = _SchemaCompiler(schema, max_depth=4).compile()
+    return TokenAutomaton(CharAutomaton(nfa, initial, accept), vocabulary, max_states)
+
+
+def matches_schema(value) -> bool:
+    return (
+        isinstance(value, dict)
+        and set(value) <= set(SCHEMA["properties"])
+        and value["answer"] in ("yes", "no")
+        and isinstance(value["sure"], bool)
+        and (
+            "count" not in value
+            or isinstance(value["count"], int) and not isinstance(value["count"], bool)
+        )
+    )
+
+
+@pytest.mark.parametrize(
+    "sampling", [{"temperature": 0}, {"temperature": 1.0, "seed": 5, "n": 3}]
+)
+def test_completions_match_the_schema(chat_model, messages, sampling):
+    result = chat_model.chat(messages, max_tokens=96, json_schema=SCHEMA, **sampling)
+
+    for choice in result["choices"]:
+        assert choice["finish_reason"] == "stop"
+        assert matches_schema(json.loads(choice["message"]["content"]))
+
+
+def test_dead_end_ends_generation():
+    # The schema needs "b" after the quote, but no token writes it
+    vocabulary = fake_vocabulary({1: '"', 2: "a"})
+    processor = JSONSchemaLogitsProcessor(compile_automaton({"const": "b"}, vocabulary))
+    scores = torch.zeros(1, vocabulary.size)
+
+    first = processor(torch.tensor([[5]]), scores)
+    assert torch.isfinite(first[0]).tolist() == [False, True, False]
+    assert processor.dead_ends == set()
+
+    second = processor(torch.tensor([[5, 1]]), scores)
+    assert torch.isfinite(second[0]).tolist() == [True, False, False]
+    assert processor.dead_ends == {0}
+
+
+def test_end_of_sequence_follows_a_complete_match():
+    vocabulary = fake_vocabulary({1: '"', 2: "a", 3: 'a"'})
+    automaton = compile_automaton({"const": "a"}, vocabulary)
+
+    state = automaton.advance(automaton.advance(automaton.initial, 1), 3)
+    assert automaton.mask(state, vocabulary.size).tolist() == [True, False, False, False]
+    assert not automaton.dead_end(state, vocabulary.size)
+
+
+def test_token_masks_are_bounded():
+    vocabulary = fake_vocabulary({1: '"', 2: "a", 3: "b", 4: "c"})
+    automaton = compile_automaton({"const": "abc"}, vocabulary, max_states=2)
+
+    state = automaton.initial
+    for token_id in (1, 2, 3, 4):
+        automaton.mask(state, vocabulary.size)
+        state = automaton.advance(state, token_id)
+
+    assert len(automaton._masks) == 2 and len(automaton._next) == 2
+
+
+def test_automata_are_cached_per_schema(chat_model):
+    cache = AutomatonCache(max_entries=2)
+    reordered = dict(reversed(list(SCHEMA.items())))
+
+    automaton = cache.get(chat_model.tokenizer, SCHEMA)
+    assert cache.get(chat_model.tokenizer, reordered) is automaton
+    assert (cache.get_stats()["hits"], cache.get_stats()["misses"]) == (1, 1)
+
+    with pytest.raises(ValueError):
+        cache.get(chat_model.tokenizer, {"type": "date"})
@@ -0,0 +1,118 @@
+import io
+import struct
+
+import numpy as np
+import pytest
+import soundfile as sf
+import torch
+
+from core.interface.texttospeech import TextToSpeechServiceBase
+from core.tts.encoders import SAMPLE_RATE, UNKNOWN_SIZE, get_encoder, to_pcm16
+
+# One second of a tone, in three chunks like the sentences of a response
+AUDIO = (0.5 * np.sin(np.arange(SAMPLE_RATE) * 2 * np.pi * 440 / SAMPLE_RATE)).astype(
+    np.float32
+)
+CHUNKS = np.array_split(AUDIO, 3)
+
+
+def encode(output_format, file=None):
+    encoder = get_encoder(output_format, file)
+    chunks = [chunk for audio in CHUNKS for chunk in encoder.encode(audio)]
+    return b"".join(bytes(chunk) for chunk in chunks + encoder.finish())
+
+
+def test_pcm_is_raw_samples():
+    assert encode("pcm") == to_pcm16(AUDIO).tobytes()
+
+
+def test_wav_file_header_has_the_sizes():
+    file = io.BytesIO()
+    assert encode("wav", file) == b""
+
+    data = file.getvalue()
+    data_size = len(AUDIO) * 2
+    assert struct.unpack("<I", data[4:8])[0] == 36 + data_size
+    assert struct.unpack("<I", data[40:44])[0] == data_size
+    assert data[44:] == to_pcm16(AUDIO).tobytes()
+
+    samples, sample_rate = sf.read(io.BytesIO(data), dtype="float32")
+    assert sample_rate == SAMPLE_RATE and len(samples) == len(AUDIO)
+
+
+def test_streamed_wav_leaves_the_sizes_open():
+    file = io.BytesIO()
+    encode("wav", file)
+    streamed = encode("wav")
+
+    assert struct.unpack("<I", streamed[4:8])[0] == UNKNOWN_SIZE
+    assert struct.unpack("<I", streamed[40:44])[0] == UNKNOWN_SIZE
+    assert streamed[8:40] == file.getvalue()[8:40]
+    assert streamed[44:] == file.getvalue()[44:]
+
+
+@pytest.mark.parametrize("output_format", ["mp3", "opus", "flac"])
+def test_compressed_files_decode(output_format):
+    file = io.BytesIO()
+    encode(output_format, file)
+    file.seek(0)
+
+    info = sf.info(file)
+    file.seek(0)
+    samples, _ = sf.read(file, dtype="float32")
+    assert info.channels == 1
+    if output_format == "flac":
+        assert len(samples) == len(AUDIO)
+        assert np.abs(samples - AUDIO).max() < 1e-3
+    else:
+        # Lossy codecs pad the start and end of the audio
+        assert abs(len(samples) - len(AUDIO)) < SAMPLE_RATE // 10
+
+
+def test_streamed_opus_decodes():
+    samples, _ = sf.read(io.BytesIO(encode("opus")), dtype="float32")
+    assert abs(len(samples) - len(AUDIO)) < SAMPLE_RATE // 10
+
+
+def test_streamed_flac_only_lacks_the_stream_info():
+    file = io.BytesIO()
+    encode("flac", file)
+    streamed = encode("flac")
+
+    # "fLaC", then the STREAMINFO block whose sample count is left unknown (0)
+    assert streamed[:4] == b"fLaC"
+    assert streamed[21] & 0x0F == 0 and streamed[22:26] == bytes(4)
+    assert streamed[42:] == file.getvalue()[42:]
+
+
+def test_streamed_mp3_skips_the_blank_tag_frame():
+    file = io.BytesIO()
+    encode("mp3", file)
+    streamed = encode("mp3")
+
+    # The file starts with the frame holding the LAME tag, the stream with audio
+    tag_frame = file.getvalue()[:200]
+    assert b"Xing" in tag_frame or b"Info" in tag_frame
+    assert streamed[0] == 0xFF and streamed[1] & 0xE0 == 0xE0
+    assert b"Xing" not in streamed[:200] and b"Info" not in streamed[:200]
+
+
+def test_unsupported_format_is_rejected():
+    with pytest.raises(ValueError):
+        get_encoder("aac")
+
+
+def test_convert_audio_writes_stereo_with_soundfile(tmp_path):
+    path = str(tmp_path / "stereo.wav")
+    sf.write(path, np.stack([AUDIO, -AUDIO], axis=1), SAMPLE_RATE)
+
+    converted = TextToSpeechServiceBase.convert_audio(None, path, "FLAC")
+    samples, _ = sf.read(converted, dtype="float32")
+    assert samples.shape == (len(AUDIO), 2)
+
+
+def test_convert_audio_encodes_mono_tensors():
+    converted = TextToSpeechServiceBase.convert_audio(None, torch.from_numpy(AUDIO), "wav")
+    file = io.BytesIO()
+    encode("wav", file)
+    assert converted.getvalue() == file.getvalue()
@@ -0,0 +1,44 @@
+import threading
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.routers import openai as routes
+from core.inference.executor import InferenceExecutor, InferenceQueueFull
+
+
+@pytest.fixture
+def busy_executor():
+    """Executor with one worker, held by a blocked job, and room for one more job"""
+    executor = InferenceExecutor(max_concurrency=1, max_queue=1, name="test")
+    release = threading.Event()
+    running = threading.Event()
+    executor.submit(lambda: (running.set(), release.wait(10)))
+    assert running.wait(5)
+    queued = executor.submit(lambda: None)
+    yield executor
+    release.set()
+    queued.result(timeout=5)
+    executor.shutdown()
+
+
+def test_full_queue_is_rejected_with_a_retry_delay(busy_executor):
+    assert (busy_executor.in_flight(), busy_executor.queue_depth()) == (1, 1)
+
+    with pytest.raises(InferenceQueueFull) as rejected:
+        busy_executor.submit(lambda: None)
+    assert rejected.value.retry_after >= 1
+
+
+def test_full_queue_answers_429_with_retry_after(busy_executor, monkeypatch):
+    monkeypatch.setattr(routes, "inference_executor", busy_executor)
+    app = FastAPI()
+    app.include_router(routes.router)
+
+    response = TestClient(app).post(
+        "/chat/completions",
+        json={"model": "openai/gpt-oss-20b", "messages": [{"role": "user", "content": "Hi"}]},
+    )
+    assert response.status_code == 429
+    assert int(response.headers["retry-after"]) >= 1
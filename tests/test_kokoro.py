@@ -0,0 +1,152 @@
+import threading
+
+import numpy as np
+import pytest
+
+from api.services import tts
+from core.inference.cancellation import (
+    CancellationToken,
+    GenerationCancelled,
+    cancellation_stats,
+)
+from core.tts import kokoro
+from core.tts.kokoro import DEFAULT_VOICE, KokotoTTS
+from core.tts.segment_cache import SegmentCache
+from tests.conftest import FakePipeline
+
+
+@pytest.fixture
+def segment_cache(monkeypatch):
+    cache = SegmentCache(max_bytes=1024**2, disk_dir="")
+    monkeypatch.setattr(kokoro, "segment_cache", cache)
+    return cache
+
+
+@pytest.fixture
+def built(monkeypatch):
+    """Languages KPipeline is built for, by a service whose model is already loaded"""
+    languages = []
+
+    def build_pipeline(lang_code, repo_id, model):
+        languages.append(lang_code)
+        if lang_code == "z":
+            raise OSError("No G2P frontend for z")
+        return FakePipeline()
+
+    monkeypatch.setattr(kokoro, "KPipeline", build_pipeline)
+    return languages
+
+
+def loaded_service() -> KokotoTTS:
+    service = KokotoTTS()
+    service._model = object()
+    return service
+
+
+def synthesize(text: str, **options):
+    return list(tts.kokoro_tts.synthesize(text, "a", DEFAULT_VOICE, **options))
+
+
+def speech_stats():
+    return cancellation_stats.get_stats()["speech"]
+
+
+def test_pipeline_is_built_once_per_language(built):
+    service = loaded_service()
+
+    threads = [threading.Thread(target=service.get_pipeline, args=("j",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    english = service.get_pipeline("a")
+
+    assert service.get_pipeline("a") is english
+    # Unsupported languages use the English pipeline
+    assert service.get_pipeline("xx") is english
+    assert built == ["j", "a"]
+    assert set(service._pipeline_locks) == {"j", "a"}
+
+
+def test_preload_builds_pipelines_and_their_default_voice(built):
+    service = loaded_service()
+
+    service.preload(["a", "z", "j"])
+
+    assert built == ["a", "z", "j"]
+    assert sorted(service._pipelines) == ["a", "j"]
+    assert all(pipeline.voices == [DEFAULT_VOICE] for pipeline in service._pipelines.values())
+
+
+def test_text_is_synthesized_one_sentence_at_a_time(pipeline):
+    audio = synthesize("One. Two!  Three?\nFour…\n\nFive 你好。再见。")
+
+    assert pipeline.sentences == ["One.", "Two!", "Three?", "Four…", "Five 你好。", "再见。"]
+    assert pipeline.calls == len(audio) == 6
+
+
+def test_stream_yields_audio_before_the_next_sentence(pipeline):
+    chunks = tts.kokoro_tts.stream_audio("One. Two. Three.", "a", DEFAULT_VOICE, 1.0, "pcm")
+
+    next(chunks)
+    assert pipeline.sentences == ["One."]
+    list(chunks)
+    assert pipeline.sentences == ["One.", "Two.", "Three."]
+
+
+def test_cancellation_stops_at_the_next_sentence_boundary(pipeline):
+    text = "One. Two. Three."
+    cancellation = CancellationToken()
+    pipeline.on_sentence = lambda sentence: sentence == "Two." and cancellation.cancel()
+    before = speech_stats()
+
+    with pytest.raises(GenerationCancelled):
+        synthesize(text, cancellation=cancellation)
+
+    assert pipeline.sentences == ["One.", "Two."]
+    after = speech_stats()
+    assert after["running"] == before["running"] + 1
+    assert after["characters_avoided"] == before["characters_avoided"] + len(text) - len("One.")
+
+
+def test_cached_sentences_are_not_synthesized_again(pipeline, segment_cache):
+    first = synthesize("One. Two.")
+    second = synthesize("Two.  One.")
+
+    assert pipeline.sentences == ["One.", "Two."]
+    assert [audio.tobytes() for audio in second] == [audio.tobytes() for audio in first][::-1]
+    stats = segment_cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["stores"]) == (2, 2, 2)
+    assert stats["audio_seconds_saved"] > 0
+
+
+def test_known_phonemes_skip_g2p_in_another_voice(pipeline, segment_cache):
+    synthesize("One. Two.")
+    synthesize("One.", speed=1.5)
+
+    assert pipeline.sentences == ["One.", "Two."]
+    assert pipeline.tokens == ["One."]
+    assert segment_cache.get_stats()["phoneme_hits"] == 1
+
+
+def test_entries_spill_to_disk_and_are_promoted_back(tmp_path):
+    audio = np.zeros(1000, dtype=np.float32)
+    keys = [SegmentCache.make_key(text, "a", DEFAULT_VOICE, 1.0) for text in ("One.", "Two.")]
+    cache = SegmentCache(max_bytes=audio.nbytes + 8, disk_dir=str(tmp_path), disk_max_bytes=10**6)
+
+    cache.put(keys[0], ("one",), audio)
+    cache.put(keys[1], ("two",), audio + 1)
+    assert cache.get_stats()["spills"] == 1
+    assert len(list(tmp_path.iterdir())) == 1
+
+    # Promoted back to memory, which spills the other entry in turn
+    assert cache.get(keys[0]).phonemes == ("one",)
+    assert cache.get(keys[0]).phonemes == ("one",)
+    stats = cache.get_stats()
+    assert (stats["disk_hits"], stats["memory_hits"], stats["spills"]) == (1, 1, 2)
+    assert stats["disk_entries"] == 2
+
+    # Found on disk after a restart
+    restarted = SegmentCache(max_bytes=audio.nbytes + 8, disk_dir=str(tmp_path))
+    assert np.array_equal(restarted.get(keys[1]).audio, audio + 1)
+    assert restarted.get_stats()["disk_hits"] == 1
@@ -0,0 +1,73 @@
+import pytest
+import torch
+
+from core.chat.openai import OpenAIChat
+from core.chat.prefix_cache import PrefixCache
+
+
+@pytest.fixture
+def cached_model(tiny_model_path):
+    return OpenAIChat(model=tiny_model_path, use_cpu=True, prefix_cache_mb=64)
+
+
+def test_reused_prefix_gives_same_completion(cached_model, chat_model, messages):
+    first = cached_model.chat(messages, max_tokens=16, temperature=0)
+    assert cached_model.prefix_cache.get_stats()["insertions"] == 1
+
+    # Same system prompt, new question: only the question is prefilled
+    follow_up = messages[:1] + [{"role": "user", "content": "Tell me a short joke."}]
+    second = cached_model.chat(follow_up, max_tokens=16, temperature=0)
+
+    stats = cached_model.prefix_cache.get_stats()
+    assert stats["hits"] == 1
+    assert stats["tokens_saved"] > 0
+
+    # Identical to generating without any cache
+    assert first["choices"] == chat_model.chat(messages, max_tokens=16, temperature=0)["choices"]
+    assert second["choices"] == chat_model.chat(follow_up, max_tokens=16, temperature=0)["choices"]
+
+
+def test_lookup_leaves_one_token_uncached(cached_model):
+    tokens = list(range(1, 21))
+    _, cache = _prefill(cached_model, tokens)
+    prefix_cache = PrefixCache(max_bytes=64 * 1024**2, min_prefix_tokens=8)
+    assert prefix_cache.insert(tokens, cache)
+
+    matched, reused = prefix_cache.lookup(tokens)
+    assert matched == len(tokens) - 1
+    assert reused.get_seq_length() == matched
+
+    # Longer prompts reuse the whole stored sequence, unrelated ones nothing
+    assert prefix_cache.lookup(tokens + [30, 31])[0] == len(tokens)
+    assert prefix_cache.lookup([40] * 20) == (0, None)
+
+
+def test_short_matches_are_not_reused(cached_model):
+    tokens = list(range(1, 21))
+    _, cache = _prefill(cached_model, tokens)
+    prefix_cache = PrefixCache(max_bytes=64 * 1024**2, min_prefix_tokens=8)
+    prefix_cache.insert(tokens, cache)
+
+    assert prefix_cache.lookup(tokens[:5] + [40] * 10) == (0, None)
+    assert prefix_cache.get_stats()["hits"] == 0
+
+
+def test_least_recently_used_entries_are_evicted(cached_model):
+    first, second = list(range(1, 21)), list(range(101, 121))
+    _, cache = _prefill(cached_model, first)
+    entry_bytes = sum(k.nbytes + v.nbytes for k, v in PrefixCache.extract(cache, len(first)))
+    prefix_cache = PrefixCache(max_bytes=int(entry_bytes * 1.5), min_prefix_tokens=8)
+
+    prefix_cache.insert(first, cache)
+    prefix_cache.insert(second, _prefill(cached_model, second)[1])
+
+    assert prefix_cache.lookup(first) == (0, None)
+    assert prefix_cache.lookup(second)[0] == len(second) - 1
+    assert prefix_cache.get_stats()["evictions"] == 1
+
+
+def _prefill(chat: OpenAIChat, tokens):
+    model = chat.pipe.model
+    with torch.inference_mode():
+        output = model(input_ids=torch.tensor([tokens]), use_cache=True)
+    return output.logits, output.past_key_values
@@ -0,0 +1,150 @@
+import time
+
+import pytest
+
+from core.chat.scheduler import BatchScheduler
+from core.inference.cancellation import (
+    CancellationToken,
+    GenerationCancelled,
+    cancellation_stats,
+)
+
+BAD = [{"role": "user", "content": "bad"}]
+
+
+class FakeChat:
+    """Records the batches it is given and answers each row with its messages"""
+
+    def __init__(self):
+        self.batches = []
+
+    def chat_batch(self, batch, **kwargs):
+        self.batches.append(batch)
+        if BAD in batch:
+            raise ValueError("Bad request")
+        return [{"messages": messages} for messages in batch]
+
+
+class FakeRegistry:
+    def __init__(self, chat):
+        self.chat = chat
+
+    def get(self, model):
+        return self.chat
+
+
+@pytest.fixture
+def fake_chat():
+    return FakeChat()
+
+
+def make_scheduler(chat, **options) -> BatchScheduler:
+    return BatchScheduler(registry=FakeRegistry(chat), **options)
+
+
+def conversation(text: str):
+    return [{"role": "user", "content": text}]
+
+
+def test_requests_are_grouped_by_model_sampling_and_seed(fake_chat):
+    scheduler = make_scheduler(fake_chat, max_batch_size=8, max_queue_delay_ms=200)
+    requests = [
+        ("a", {"temperature": 0}),
+        ("a", {"temperature": 0, "top_p": 0.5}),
+        ("b", {"temperature": 0}),
+        ("a", {"temperature": 1.0, "seed": 1}),
+        ("a", {"temperature": 1.0, "seed": 1}),
+        ("a", {"temperature": 1.0, "seed": 2}),
+    ]
+    futures = [
+        scheduler.submit(model, conversation(str(index)), **sampling)
+        for index, (model, sampling) in enumerate(requests)
+    ]
+
+    results = [future.result(timeout=5) for future in futures]
+    scheduler.shutdown()
+    assert [result["messages"] for result in results] == [
+        conversation(str(index)) for index in range(len(requests))
+    ]
+    # Greedy requests share a batch whatever their top_p
+    assert sorted(
+        [[messages[0]["content"] for messages in batch] for batch in fake_chat.batches]
+    ) == [["0", "1"], ["2"], ["3", "4"], ["5"]]
+
+
+def test_partial_batch_is_sent_after_the_maximum_delay(fake_chat):
+    scheduler = make_scheduler(fake_chat, max_batch_size=8, max_queue_delay_ms=100)
+
+    start = time.perf_counter()
+    scheduler.submit("a", conversation("0"), temperature=0).result(timeout=5)
+    elapsed = time.perf_counter() - start
+    scheduler.shutdown()
+
+    assert 0.1 <= elapsed < 2
+    assert len(fake_chat.batches) == 1
+
+
+def test_full_batch_is_sent_without_waiting(fake_chat):
+    scheduler = make_scheduler(fake_chat, max_batch_size=2, max_queue_delay_ms=60_000)
+
+    futures = [scheduler.submit("a", conversation(str(i)), temperature=0) for i in range(3)]
+    futures[0].result(timeout=5)
+    futures[1].result(timeout=5)
+    assert not futures[2].done()
+
+    scheduler.shutdown()
+    futures[2].result(timeout=5)
+    assert [len(batch) for batch in fake_chat.batches] == [2, 1]
+
+
+def test_failed_batch_is_retried_one_request_at_a_time(fake_chat):
+    scheduler = make_scheduler(fake_chat, max_batch_size=2, max_queue_delay_ms=60_000)
+
+    good = scheduler.submit("a", conversation("good"), temperature=0)
+    bad = scheduler.submit("a", BAD, temperature=0)
+
+    assert good.result(timeout=5) == {"messages": conversation("good")}
+    with pytest.raises(ValueError):
+        bad.result(timeout=5)
+    scheduler.shutdown()
+    assert [len(batch) for batch in fake_chat.batches] == [2, 1, 1]
+
+
+def test_requests_cancelled_while_queued_are_dropped(fake_chat):
+    scheduler = make_scheduler(fake_chat, max_batch_size=2, max_queue_delay_ms=60_000)
+    queued = cancellation_stats.get_stats()["chat"]["queued"]
+
+    cancellation = CancellationToken()
+    cancelled = scheduler.submit(
+        "a", conversation("gone"), temperature=0, cancellation=cancellation
+    )
+    cancellation.cancel()
+    live = scheduler.submit("a", conversation("here"), temperature=0)
+
+    assert live.result(timeout=5) == {"messages": conversation("here")}
+    with pytest.raises(GenerationCancelled):
+        cancelled.result(timeout=5)
+    scheduler.shutdown()
+    assert fake_chat.batches == [[conversation("here")]]
+    assert cancellation_stats.get_stats()["chat"]["queued"] == queued + 1
+
+
+@pytest.mark.parametrize("sampling", [{"temperature": 0}, {"temperature": 1.0, "seed": 7}])
+def test_batched_results_match_unbatched_ones(chat_model, messages, sampling):
+    other = [*messages[:1], {"role": "user", "content": "Name a colour."}]
+    expected = [
+        chat_model.chat(rows, max_tokens=12, **sampling)["choices"]
+        for rows in (messages, other)
+    ]
+
+    scheduler = BatchScheduler(
+        registry=FakeRegistry(chat_model), max_batch_size=2, max_queue_delay_ms=60_000
+    )
+    futures = [
+        scheduler.submit("tiny", rows, max_tokens=12, **sampling) for rows in (messages, other)
+    ]
+    results = [future.result(timeout=60) for future in futures]
+    scheduler.shutdown()
+
+    assert scheduler.stats["batches"] == 1
+    assert [result["choices"] for result in results] == expected
@@ -0,0 +1,63 @@
+import pytest
+import torch
+
+from core.chat.openai import OpenAIChat
+
+PROMPTS = [
+    "What is the capital of France?",
+    "Hello! Can you tell me a short joke?",
+    "Explain machine learning in one sentence.",
+]
+
+
+@pytest.fixture(scope="module")
+def speculative_model(tiny_model_path, draft_model_path):
+    chat = OpenAIChat(
+        model=tiny_model_path,
+        use_cpu=True,
+        prefix_cache_mb=0,
+        draft_model=draft_model_path,
+        num_draft_tokens=4,
+    )
+    assert chat.speculative is not None
+    return chat
+
+
+@pytest.mark.parametrize("prompt", PROMPTS)
+def test_speculative_matches_greedy(speculative_model, prompt):
+    messages = [{"role": "user", "content": prompt}]
+    speculative = speculative_model.chat(messages, max_tokens=24, temperature=0)
+
+    decoder = speculative_model.speculative
+    speculative_model.speculative = None
+    try:
+        greedy = speculative_model.chat(messages, max_tokens=24, temperature=0)
+    finally:
+        speculative_model.speculative = decoder
+
+    assert speculative["choices"] == greedy["choices"]
+    assert speculative["usage"] == greedy["usage"]
+
+
+def test_speculative_tokens_match_greedy(speculative_model):
+    tokenizer = speculative_model.tokenizer
+    model = speculative_model.pipe.model
+    prompt_ids = tokenizer("Human: What is the capital of France?\nAssistant:")["input_ids"]
+
+    tokens, _ = speculative_model.speculative.generate(
+        prompt_ids, max_new_tokens=32, eos_token_ids=speculative_model._eos_token_ids()
+    )
+
+    with torch.inference_mode():
+        output = model.generate(
+            input_ids=torch.tensor([prompt_ids]),
+            attention_mask=torch.ones(1, len(prompt_ids), dtype=torch.long),
+            max_new_tokens=32,
+            do_sample=False,
+            pad_token_id=tokenizer.pad_token_id,
+        )
+    assert tokens == output[0, len(prompt_ids) :].tolist()
+
+    # Both accepted and rejected drafts were exercised
+    stats = speculative_model.speculative.get_stats()
+    assert 0 < stats["accepted_tokens"] < stats["draft_tokens"]
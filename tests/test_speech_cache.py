@@ -0,0 +1,131 @@
+import os
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.routers import openai as routes
+from api.services import tts
+from core.tts.response_cache import SpeechResponseCache
+from model.speech import CreateSpeechRequest
+
+REQUEST = {"input": "One. Two.", "response_format": "wav", "stream": False}
+
+
+@pytest.fixture
+def client(monkeypatch, tmp_path):
+    cache = SpeechResponseCache(str(tmp_path / "speech"), max_bytes=1024**2)
+    monkeypatch.setattr(routes, "speech_cache", cache)
+    monkeypatch.setattr(tts, "speech_cache", cache)
+
+    app = FastAPI()
+    app.include_router(routes.router)
+    return TestClient(app)
+
+
+def test_put_and_get(tmp_path):
+    cache = SpeechResponseCache(str(tmp_path), max_bytes=1024)
+
+    assert cache.get("a") is None
+    cache.put("a", b"audio")
+    link = cache.get("a")
+    with open(link, "rb") as file:
+        assert file.read() == b"audio"
+    cache.release(link)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a"]
+
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["bytes"]) == (1, 1, 1, 5)
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = SpeechResponseCache(str(tmp_path), max_bytes=1000)
+    cache.put("a", bytes(400))
+    cache.put("b", bytes(400))
+    cache.release(cache.get("a"))
+    cache.put("c", bytes(400))
+
+    assert cache.get("b") is None
+    assert cache.get_stats()["evictions"] == 1
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["a", "c"]
+
+
+def test_linked_file_survives_eviction(tmp_path):
+    cache = SpeechResponseCache(str(tmp_path), max_bytes=1000)
+    cache.put("a", b"x" * 600)
+
+    link = cache.get("a")
+    cache.put("b", bytes(600))
+    assert not (tmp_path / "a").exists()
+    with open(link, "rb") as file:
+        assert file.read() == b"x" * 600
+    cache.release(link)
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["b"]
+
+
+def test_files_are_found_after_a_restart(tmp_path):
+    SpeechResponseCache(str(tmp_path), max_bytes=1024).put("a", b"audio")
+
+    link = SpeechResponseCache(str(tmp_path), max_bytes=1024).get("a")
+    with open(link, "rb") as file:
+        assert file.read() == b"audio"
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = SpeechResponseCache(str(tmp_path), max_bytes=0)
+    cache.put("a", b"audio")
+    assert cache.get("a") is None and not any(tmp_path.iterdir())
+
+
+def test_cached_response_has_etag_and_revalidates(client, pipeline):
+    first = client.post("/audio/speech", json=REQUEST)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+    calls = pipeline.calls
+
+    # Sent from the cache, without synthesizing again
+    second = client.post("/audio/speech", json=REQUEST)
+    assert second.status_code == 200
+    assert second.content == first.content
+    assert second.headers["etag"] == etag
+    assert second.headers["content-length"] == str(len(first.content))
+    assert pipeline.calls == calls
+
+    not_modified = client.post(
+        "/audio/speech", json=REQUEST, headers={"If-None-Match": f'W/"other", {etag}'}
+    )
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert not_modified.headers["etag"] == etag
+
+    changed = client.post("/audio/speech", json={**REQUEST, "speed": 1.5})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
+    stats = routes.speech_cache.get_stats()
+    assert (stats["hits"], stats["not_modified"], stats["stores"]) == (2, 1, 2)
+    # The links the hits were sent from are gone
+    assert not [name for name in os.listdir(routes.speech_cache.directory) if ".tmp" in name]
+
+
+def test_streamed_response_is_cached_as_a_file(client, pipeline):
+    streamed = client.post("/audio/speech", json={**REQUEST, "stream": True})
+    assert streamed.status_code == 200
+    calls = pipeline.calls
+
+    cached = client.post("/audio/speech", json=REQUEST)
+    assert cached.headers["etag"]
+    # Same samples; the cached file's header has the real sizes
+    assert cached.content[44:] == streamed.content[44:]
+    assert pipeline.calls == calls
+
+
+def test_abandoned_stream_discards_its_cache_file(client, pipeline):
+    request = CreateSpeechRequest(input="One. Two. Three.", response_format="wav", stream=True)
+    audio = tts.stream_request(request)
+    next(audio)
+    assert len(os.listdir(tts.speech_cache.directory)) == 1
+
+    audio.close()
+    assert os.listdir(tts.speech_cache.directory) == []
+    assert tts.speech_cache.get_stats()["stores"] == 0
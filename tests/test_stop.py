@@ -0,0 +1,75 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from api.routers.openai import router
+from core.chat.stopping import StopSequenceFilter, find_stop_sequence
+from model.chat_completions import MAX_STOP_SEQUENCES, ChatCompletions
+
+
+def test_find_stop_sequence_returns_earliest_match():
+    assert find_stop_sequence("one two three", ["three", "two"]) == 4
+    assert find_stop_sequence("one two three", ["four", ""]) is None
+
+
+def test_filter_holds_back_partial_matches():
+    stop_filter = StopSequenceFilter(["\nUser:"])
+
+    assert stop_filter.feed("Paris is the capital.\nUs") == "Paris is the capital."
+    assert stop_filter.feed("ually") == "\nUsually"
+    assert stop_filter.feed(" yes.\nUser: hi") == " yes."
+    assert stop_filter.stopped
+    assert stop_filter.feed("more") == ""
+
+
+def test_filter_flushes_held_text_at_the_end():
+    stop_filter = StopSequenceFilter(["\nUser:"])
+    assert stop_filter.feed("Done.\nU") == "Done."
+    assert stop_filter.flush() == "\nU"
+
+
+def test_completion_is_trimmed_at_stop_sequence(chat_model, messages):
+    plain = chat_model.chat(messages, max_tokens=24, temperature=0)
+    content = plain["choices"][0]["message"]["content"]
+    assert plain["choices"][0]["finish_reason"] == "length"
+
+    stop = content[8:11]
+    stopped = chat_model.chat(messages, max_tokens=24, temperature=0, stop=stop)
+    choice = stopped["choices"][0]
+
+    assert choice["message"]["content"] == content[: content.index(stop)]
+    assert choice["finish_reason"] == "stop"
+    assert stopped["usage"]["completion_tokens"] < plain["usage"]["completion_tokens"]
+
+
+def test_batch_rows_use_their_own_stop_sequences(chat_model, messages):
+    plain = chat_model.chat(messages, max_tokens=24, temperature=0)
+    content = plain["choices"][0]["message"]["content"]
+    stop = content[8:11]
+
+    stopped, unstopped = chat_model.chat_batch(
+        [messages, messages], max_tokens=24, temperature=0, stop=[stop, None]
+    )
+    assert stopped["choices"][0]["message"]["content"] == content[: content.index(stop)]
+    assert stopped["choices"][0]["finish_reason"] == "stop"
+    assert unstopped["choices"] == plain["choices"]
+
+
+@pytest.mark.parametrize(
+    "stop", [[str(index) for index in range(MAX_STOP_SEQUENCES + 1)], "", ["ok", ""]]
+)
+def test_invalid_stop_sequences_are_rejected(stop):
+    with pytest.raises(ValueError):
+        ChatCompletions._validate_stop(stop)
+
+    app = FastAPI()
+    app.include_router(router)
+    response = TestClient(app).post(
+        "/chat/completions",
+        json={
+            "model": "openai/gpt-oss-20b",
+            "messages": [{"role": "user", "content": "Hi"}],
+            "stop": stop,
+        },
+    )
+    assert response.status_code == 400
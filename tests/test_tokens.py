@@ -0,0 +1,46 @@
+import pytest
+
+from core.chat.tokens import TokenCache
+
+PIECES = [
+    # Boundaries merged into a single token ("Human", " The") by the tokenizer
+    ["\nHu", "man: hi"],
+    ["Be brief. ", "The capital of France is Paris."],
+    ["System: Be brief.", "\n", "\nHuman: What is the capital of Fr", "ance?", "\nAssistant:"],
+    ["", "Hello", "", " there"],
+]
+
+
+@pytest.fixture
+def token_cache(chat_model):
+    return TokenCache(chat_model.tokenizer, max_entries=64)
+
+
+@pytest.mark.parametrize("pieces", PIECES)
+def test_pieces_encode_like_the_joined_prompt(token_cache, pieces):
+    expected = token_cache.tokenizer("".join(pieces))["input_ids"]
+
+    assert token_cache.encode(pieces) == expected
+    # Again from the cache
+    assert token_cache.encode(pieces) == expected
+
+
+def test_chat_prompt_encodes_like_the_joined_prompt(chat_model, token_cache, messages):
+    pieces = chat_model._prompt_pieces(messages)
+    assert token_cache.enabled
+    assert token_cache.encode(pieces) == chat_model.tokenizer("".join(pieces))["input_ids"]
+
+    # A later turn of the conversation only tokenizes its new messages
+    followup = [*messages, {"role": "assistant", "content": "Paris."}]
+    token_cache.encode(chat_model._prompt_pieces(followup))
+    stats = token_cache.get_stats()
+    assert stats["hits"] > 0 and stats["tokens_saved"] > 0
+
+
+def test_disabled_cache_encodes_the_joined_prompt(chat_model):
+    token_cache = TokenCache(chat_model.tokenizer, max_entries=0)
+    pieces = PIECES[0]
+
+    assert not token_cache.enabled
+    assert token_cache.encode(pieces) == chat_model.tokenizer("".join(pieces))["input_ids"]
+    assert token_cache.get_stats()["entries"] == 0
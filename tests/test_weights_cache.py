@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from core.chat import openai as openai_module
+from core.chat.openai import OpenAIChat
+from core.inference import mmap_weights
+
+CACHED_STAGES = ["weights", "tokenizer", "pipeline"]
+FIRST_LOAD_STAGES = ["load", "cache_write"]
+
+
+@pytest.fixture
+def weights_cache(tmp_path, monkeypatch):
+    """Weights cache turned on, in an empty directory"""
+    monkeypatch.setattr(openai_module, "WEIGHT_CACHE", True)
+    monkeypatch.setattr(mmap_weights, "WEIGHTS_CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def load(tiny_model_path) -> OpenAIChat:
+    return OpenAIChat(model=tiny_model_path, use_cpu=True, prefix_cache_mb=0)
+
+
+def cache_file(chat: OpenAIChat) -> str:
+    return mmap_weights.weights_path(chat.model, chat.pipe.model.dtype)
+
+
+def test_second_load_maps_the_cached_weights(weights_cache, tiny_model_path, messages):
+    first = load(tiny_model_path)
+    assert list(first.load_timer.stages) == FIRST_LOAD_STAGES
+    assert os.path.exists(cache_file(first))
+
+    second = load(tiny_model_path)
+    assert list(second.load_timer.stages) == CACHED_STAGES
+
+    for options in ({"temperature": 0}, {"temperature": 1.0, "seed": 3}):
+        expected = first.chat(messages, max_tokens=12, **options)["choices"]
+        assert second.chat(messages, max_tokens=12, **options)["choices"] == expected
+
+
+@pytest.mark.parametrize("damage", ["corrupt", "truncate"])
+def test_unreadable_cache_file_falls_back_to_a_normal_load(
+    weights_cache, tiny_model_path, messages, damage
+):
+    first = load(tiny_model_path)
+    path = cache_file(first)
+    if damage == "corrupt":
+        with open(path, "wb") as f:
+            f.write(b"not a safetensors file")
+    else:
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) // 2)
+
+    reloaded = load(tiny_model_path)
+
+    # The failed attempt to map the file is timed as well
+    assert list(reloaded.load_timer.stages) == ["weights", *FIRST_LOAD_STAGES]
+    expected = first.chat(messages, max_tokens=12, temperature=0)["choices"]
+    assert reloaded.chat(messages, max_tokens=12, temperature=0)["choices"] == expected
+    # The damaged file was replaced with a good one
+    assert list(load(tiny_model_path).load_timer.stages) == CACHED_STAGES
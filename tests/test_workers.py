@@ -0,0 +1,128 @@
+import os
+import signal
+import time
+
+import pytest
+from transformers import TextStreamer
+
+from core.inference import mmap_weights
+from core.inference.admission import RequestTooLarge
+from core.inference.cancellation import (
+    CancellationToken,
+    GenerationCancelled,
+    cancellation_stats,
+)
+from core.inference.executor import InferenceUnavailable
+from core.inference.workers import WorkerPool
+from tests.conftest import MESSAGES
+from tests.test_admission import MB, _prompt_tokens
+
+# Tokens of a request that fits a pool's admission budget, but not one worker's share
+LONG_REQUEST_TOKENS = 900
+
+
+class CancellingStreamer(TextStreamer):
+    """Streamer that cancels its request as soon as the first text arrives"""
+
+    def __init__(self, tokenizer, cancellation: CancellationToken):
+        super().__init__(tokenizer, skip_prompt=True)
+        self.cancellation = cancellation
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        self.cancellation.cancel()
+
+
+class KillingStreamer(TextStreamer):
+    """Streamer that kills the worker generating its text when the first text arrives"""
+
+    def __init__(self, tokenizer, pool: WorkerPool):
+        super().__init__(tokenizer, skip_prompt=True)
+        self.pool = pool
+        self.killed = []
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if self.killed:
+            return
+        for worker in self.pool.get_stats()["workers"]:
+            if worker["in_flight"]:
+                os.kill(worker["pid"], signal.SIGKILL)
+                self.killed.append(worker["pid"])
+
+
+@pytest.fixture(scope="module")
+def pool(tiny_model_path, chat_model, tmp_path_factory):
+    weights_dir = str(tmp_path_factory.mktemp("weights"))
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(mmap_weights, "WEIGHTS_CACHE_DIR", weights_dir)
+        prompt_tokens = _prompt_tokens(chat_model, MESSAGES)
+        long_request = chat_model.estimate_memory(prompt_tokens, LONG_REQUEST_TOKENS)
+        pool = WorkerPool(
+            tiny_model_path,
+            num_workers=2,
+            num_threads=2,
+            prefix_cache_mb=0,
+            admission_budget_mb=2 * 0.9 * long_request / MB,
+        )
+    yield pool
+    pool.close()
+
+
+def test_workers_match_the_in_process_model(pool, chat_model, messages):
+    expected = chat_model.chat(messages, max_tokens=16, temperature=0)
+    assert pool.chat(messages, max_tokens=16, temperature=0)["choices"] == expected["choices"]
+
+    other = [*messages[:1], {"role": "user", "content": "Name a colour."}]
+    expected_batch = chat_model.chat_batch([messages, other], max_tokens=8, temperature=0)
+    results = pool.chat_batch([messages, other], max_tokens=8, temperature=0)
+    assert [result["choices"] for result in results] == [
+        result["choices"] for result in expected_batch
+    ]
+
+
+def test_admission_budget_is_split_between_workers(pool, messages):
+    assert pool.get_stats()["admission_budget_mb_per_worker"] == pool.admission_budget_mb
+
+    with pytest.raises(RequestTooLarge):
+        pool.chat(messages, max_tokens=LONG_REQUEST_TOKENS, temperature=0)
+
+
+def test_cancel_reaches_the_running_request(pool, messages):
+    before = cancellation_stats.get_stats()["chat"]
+    cancellation = CancellationToken()
+    streamer = CancellingStreamer(pool.tokenizer, cancellation)
+
+    with pytest.raises(GenerationCancelled):
+        pool.chat(
+            messages, max_tokens=512, temperature=0, streamer=streamer, cancellation=cancellation
+        )
+
+    after = cancellation_stats.get_stats()["chat"]
+    assert after["running"] == before["running"] + 1
+    assert after["tokens_avoided"] > before["tokens_avoided"]
+
+
+def test_killed_worker_fails_its_requests_and_is_replaced(pool, messages):
+    expected = pool.chat(messages, max_tokens=16, temperature=0)
+    streamer = KillingStreamer(pool.tokenizer, pool)
+
+    with pytest.raises(InferenceUnavailable):
+        pool.chat(messages, max_tokens=512, temperature=0, streamer=streamer)
+    assert len(streamer.killed) == 1
+
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        workers = pool.get_stats()["workers"]
+        if all(worker["alive"] for worker in workers) and any(
+            worker["restarts"] == 1 for worker in workers
+        ):
+            break
+        time.sleep(0.2)
+    workers = pool.get_stats()["workers"]
+    assert all(worker["alive"] for worker in workers)
+    assert streamer.killed[0] not in [worker["pid"] for worker in workers]
+
+    # Sent together, the requests go to both workers, including the replaced one
+    futures = [pool.submit_batch([messages], max_tokens=16, temperature=0) for _ in range(2)]
+    assert [future.result(timeout=60)[0]["choices"] for future in futures] == [
+        expected["choices"]
+    ] * 2